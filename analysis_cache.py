@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Default location for on-disk caches (override with MEDIGEN_CACHE_DIR)
+DEFAULT_CACHE_DIR = os.getenv("MEDIGEN_CACHE_DIR", ".medigen_cache")
+
+
+# Build a content-addressed cache key from the image digest and everything that shapes the answer
+def make_cache_key(image_digest, prompt, model_name, generation_config):
+    key = hashlib.sha256()
+    for part in (image_digest, prompt, model_name, json.dumps(generation_config, sort_keys=True)):
+        key.update(part.encode("utf-8"))
+        key.update(b"\0")
+    return key.hexdigest()
+
+
+# Disk-backed analysis cache with size- and age-based eviction
+class AnalysisCache:
+    def __init__(self, path=None, max_entries=5000, max_bytes=256 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "analyses.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_last_access ON analyses(last_access)")
+        self._conn.commit()
+
+    # Return the cached analysis for a key, or None on a miss (expired entries count as misses)
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT analysis, created_at FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            analysis, created_at = row
+            if self.max_age_seconds and now - created_at > self.max_age_seconds:
+                self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return analysis
+
+    # Store an analysis and evict old or excess entries
+    def put(self, key, analysis):
+        now = time.time()
+        size = len(analysis.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, analysis, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, analysis, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    # Drop expired entries, then least-recently-used ones until both limits hold
+    def _evict(self, now):
+        if self.max_age_seconds:
+            self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.max_age_seconds,))
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM analyses ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analyses")
+            self._conn.commit()
+
+    # Hit/miss counters for this process plus current on-disk usage
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
@@ -0,0 +1,31 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# Run analyze_fn over items with at most max_workers calls in flight.
+# Items are pulled from the iterable lazily (at most max_pending queued at once), so arbitrarily long
+# streams of work use bounded memory. Yields (item, result, error) in completion order.
+def run_bounded(items, analyze_fn, max_workers=4, max_pending=None):
+    max_workers = max(1, max_workers)
+    max_pending = max_pending or max_workers * 2
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(analyze_fn, item)] = item
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
+
@@ -0,0 +1,266 @@
+# Benchmark: end-to-end app flows against the fake model backend (no API key or network needed).
+#
+# For each run size (1, 10 and 100 images by default) the script generates synthetic scans and drives:
+#   1. Upload & Analyze: dedup, triage, preprocessing and "Analyze all" through the job queue, pipeline and scheduler
+#   2. Ask AI: a streamed follow-up question per image (up to --questions) through the chat engine
+#   3. PDF export: one report per image plus the combined "Export all as one PDF" bundle
+# and then renders the Upload & Analyze (history) and Ask AI pages of medigen_enhance.py with Streamlit's
+# AppTest on the same session store, asking one question through the real widgets. AppTest cannot drive
+# st.file_uploader, so step 1 calls the pipeline the way the page does.
+#
+# Reports throughput, p50/p95/p99 latency and peak memory (Python heap from tracemalloc, process RSS) per
+# step. Each invocation starts from an empty temporary cache directory. --json writes the numbers for comparison
+# between commits.
+#
+# Usage: python benchmarks/bench_app.py [--sizes 1 10 100] [--latency 0.5] [--error-rate 0.02] [--rpm 600] [--json out.json]
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="medigen_bench_")
+# Configure the app before any of its modules are imported (the cache directory is read at import time)
+os.environ.update(
+    MEDIGEN_MODEL_BACKEND="fake",
+    MEDIGEN_CACHE_DIR=WORK_DIR,
+    MEDIGEN_UPLOAD_DIR=os.path.join(WORK_DIR, "uploads"),
+    MEDIGEN_SESSION_STORE=f"sqlite:///{os.path.join(WORK_DIR, 'sessions.sqlite3')}",
+    GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "benchmark-dummy-key"),
+)
+
+from PIL import Image
+
+from blob_store import UploadBlobStore
+from chat_engine import ChatEngine
+from image_dedup import UploadDeduper
+from instrumentation import percentile
+from job_queue import DONE, JobQueue
+from medigen_core import analysis_model_name, create_pipeline, generation_config, safety_settings
+from request_scheduler import BATCH
+from session_store import create_session_store, new_session_id
+
+QUESTIONS = ["What does the main finding mean?", "Is a follow-up scan needed?", "Which medication would you suggest?"]
+
+
+# Stands in for Streamlit's UploadedFile (name, size, file_id and the BytesIO buffer API)
+class FakeUpload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = f"{name}:{len(data)}"
+
+
+# Deterministic noisy scan, different for every (run, index)
+def synthetic_scan(run, index, edge):
+    image = Image.effect_noise((edge, edge), 40 + (run * 31 + index) % 60).convert("RGB")
+    image.putpixel((index % edge, run % edge), (index % 256, run % 256, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def rss_mb():
+    # ru_maxrss is the high-water mark, in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Run fn() with tracemalloc on; returns (result, seconds, peak Python heap in MB)
+def measured(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def summary(name, count, elapsed, latencies, heap_mb, errors=0):
+    row = {
+        "step": name, "count": count, "seconds": round(elapsed, 3), "per_second": round(count / elapsed, 2) if elapsed else None,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "heap_mb": round(heap_mb, 1), "rss_mb": round(rss_mb(), 1), "errors": errors,
+    }
+    latency = f"p50 {row['p50_ms']:8.1f}  p95 {row['p95_ms']:8.1f}  p99 {row['p99_ms']:8.1f} ms" if latencies else " " * 44
+    print(f"  {name:<14} {count:>4} in {elapsed:6.2f}s ({row['per_second'] or 0:7.2f}/s)  {latency}  "
+          f"heap {heap_mb:6.1f} MB  rss {row['rss_mb']:7.1f} MB" + (f"  errors {errors}" if errors else ""))
+    return row
+
+
+# Upload & Analyze: dedupe the uploads and spill them to the upload blob store, then "Analyze all", which
+# queues one background job per image on a job queue with `concurrency` workers. Jobs map the stored bytes
+# as the page's jobs do. Latency runs from the click to each job finishing, as the user sees it.
+def analyze_all(pipeline, session_store, session_id, uploads, concurrency):
+    groups = UploadDeduper().group(uploads)
+    upload_blobs = UploadBlobStore(root=os.path.join(WORK_DIR, "uploads"))
+    for digest, upload, _ in groups:
+        upload_blobs.put(session_id, digest, upload)
+    jobs = JobQueue(max_workers=concurrency)
+
+    def analysis_job(digest, name):
+        def run(job):
+            data = upload_blobs.view(digest)
+            try:
+                analysis_text, _ = pipeline.analyze(digest, data, image_name=name)
+                if not analysis_text:
+                    raise RuntimeError(f"Failed to generate analysis for {name}.")
+                # The downscaled payload, as the app's save_analysis keeps, not the full upload
+                session_store.put_blob(digest, pipeline.preprocessed_images.get(digest, data)[0])
+            finally:
+                data.release()
+            session_store.save_analysis(session_id, digest, name, analysis_text)
+            return digest, name, analysis_text
+
+        return run
+
+    started = time.time()
+    job_ids = [jobs.submit(analysis_job(digest, upload.name), session_id, "analysis", upload.name, BATCH)
+               for digest, upload, _ in groups]
+    while not all(jobs.get(job_id).finished for job_id in job_ids):
+        time.sleep(0.01)
+    finished = [jobs.get(job_id) for job_id in job_ids]
+    reports = [job.result for job in finished if job.status == DONE]
+    latencies = [job.finished_at - started for job in finished if job.status == DONE]
+    if reports:
+        session_store.set_selected(session_id, reports[0][0], reports[0][1])
+    return reports, latencies, len(finished) - len(reports)
+
+
+# Ask AI: one streamed follow-up per image (the image comes from the history store, as on the page);
+# latency is time to the complete answer
+def ask_questions(pipeline, session_store, reports, limit):
+    latencies, first_tokens, errors = [], [], 0
+    for index, (digest, _, analysis_text) in enumerate(reports[:limit]):
+        payload, mime_type, _ = pipeline.preprocessed_images.get(digest, session_store.get_blob(digest))
+        engine = ChatEngine(
+            pipeline.models.get(analysis_model_name, generation_config, safety_settings), analysis_text,
+            image_part={"mime_type": mime_type, "data": payload}, scheduler=pipeline.scheduler,
+        )
+        try:
+            stream = engine.ask(QUESTIONS[index % len(QUESTIONS)])
+            "".join(stream)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(stream.total_seconds)
+        first_tokens.append(stream.first_token_seconds or 0.0)
+    return latencies, first_tokens, errors
+
+
+# PDF export: every report on its own, then the combined bundle
+def export_pdfs(pipeline, reports):
+    latencies = []
+    for _, name, analysis_text in reports:
+        started = time.perf_counter()
+        pipeline.render_pdf(name, analysis_text)
+        latencies.append(time.perf_counter() - started)
+    renderer = pipeline.report_renderer
+    renderer.wait(renderer.submit_bundle([(name, text) for _, name, text in reports]))
+    return latencies
+
+
+# Render the history page and ask one question on the Ask AI page through AppTest
+def app_test_flows(session_id, question):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, "medigen_enhance.py"), default_timeout=300)
+    app.query_params["session"] = session_id
+    timings = {}
+    started = time.perf_counter()
+    app.run()
+    app.sidebar.radio[0].set_value("📂 Upload & Analyze").run()
+    timings["history_page"] = time.perf_counter() - started
+    started = time.perf_counter()
+    app.sidebar.radio[0].set_value("💬 Ask AI").run()
+    timings["ask_page"] = time.perf_counter() - started
+    started = time.perf_counter()
+    app.text_input(key="chat_input").set_value(question)
+    next(button for button in app.button if button.label == "Ask AI").click().run()
+    timings["ask_answer"] = time.perf_counter() - started
+    return timings, [str(exception.value) for exception in app.exception]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput, tail latency and memory with a fake model backend")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="images per run")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean fake model response time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of fake 503 responses (retried)")
+    parser.add_argument("--concurrency", type=int, default=4, help="job workers for 'Analyze all'")
+    parser.add_argument("--rpm", type=int, default=600, help="scheduler rate limit in requests per minute")
+    parser.add_argument("--questions", type=int, default=10, help="follow-up questions per run")
+    parser.add_argument("--edge", type=int, default=1024, help="edge length of the synthetic scans in pixels")
+    parser.add_argument("--skip-pdf", action="store_true", help="skip PDF export (needs weasyprint)")
+    parser.add_argument("--skip-apptest", action="store_true", help="skip the Streamlit AppTest page runs")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    os.environ.update(
+        MEDIGEN_FAKE_LATENCY=str(args.latency), MEDIGEN_FAKE_ERROR_RATE=str(args.error_rate),
+        MEDIGEN_REQUESTS_PER_MINUTE=str(args.rpm),
+    )
+
+    print(f"Fake backend: {args.latency:.2f}s mean latency, {args.error_rate:.0%} errors; working directory {WORK_DIR}")
+    results = []
+    for run, size in enumerate(args.sizes):
+        print(f"\n{size} image(s)")
+        pipeline = create_pipeline()
+        session_store = create_session_store()
+        session_id = new_session_id()
+        uploads = [FakeUpload(f"scan_{run}_{index}.png", synthetic_scan(run, index, args.edge)) for index in range(size)]
+
+        (reports, latencies, errors), elapsed, heap = measured(
+            lambda: analyze_all(pipeline, session_store, session_id, uploads, args.concurrency)
+        )
+        results.append(dict(summary("analyze", size, elapsed, latencies, heap, errors), images=size))
+
+        (latencies, first_tokens, errors), elapsed, heap = measured(lambda: ask_questions(pipeline, session_store, reports, args.questions))
+        row = summary("ask", len(latencies) + errors, elapsed, latencies, heap, errors)
+        if first_tokens:
+            row["first_token_p95_ms"] = round(percentile(first_tokens, 0.95) * 1000, 1)
+            print(f"  {'':<14} time to first token p95 {row['first_token_p95_ms']:.1f} ms")
+        results.append(dict(row, images=size))
+
+        if not args.skip_pdf:
+            try:
+                latencies, elapsed, heap = measured(lambda: export_pdfs(pipeline, reports))
+                results.append(dict(summary("pdf_export", len(reports), elapsed, latencies, heap), images=size))
+            except Exception as e:
+                print(f"  pdf_export     unavailable ({type(e).__name__}: {e})")
+
+        if not args.skip_apptest and reports:
+            try:
+                (timings, exceptions), elapsed, heap = measured(lambda: app_test_flows(session_id, QUESTIONS[0]))
+            except Exception as e:
+                print(f"  apptest        failed ({type(e).__name__}: {e})")
+            else:
+                pages = "  ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+                print(f"  {'apptest':<14} {pages}  heap {heap:6.1f} MB" + (f"  page exceptions: {exceptions}" if exceptions else ""))
+                results.append({"step": "apptest", "images": size, "heap_mb": round(heap, 1), "exceptions": len(exceptions),
+                                **{f"{name}_ms": round(seconds * 1000, 1) for name, seconds in timings.items()}})
+
+        print(f"  scheduler {pipeline.scheduler.stats}, fake model {pipeline.models.stats}")
+        if pipeline.triage is not None:
+            print(f"  triage {pipeline.triage.stats()}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump({"latency": args.latency, "error_rate": args.error_rate, "results": results}, output, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
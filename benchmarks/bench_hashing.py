@@ -0,0 +1,81 @@
+# Benchmark: legacy full-decode MD5 hashing vs. fast byte digests with per-upload memoization.
+#
+# Usage: python benchmarks/bench_hashing.py [--images 40] [--size 3000] [--reruns 5]
+import argparse
+import hashlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from image_dedup import UploadDeduper, fast_digest
+
+
+# Stand-in for Streamlit's UploadedFile
+class FakeUpload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = name
+
+
+def make_images(count, size):
+    uploads = []
+    for i in range(count):
+        rng = random.Random(i)
+        image = Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        noise = Image.effect_noise((size, size), 40).convert("RGB")
+        image = Image.blend(image, noise, 0.3)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        uploads.append(FakeUpload(f"scan_{i}.jpg", buffer.getvalue()))
+    return uploads
+
+
+# The original hash_image: decode every pixel, then MD5 the raw buffer
+def legacy_hash(upload):
+    upload.seek(0)
+    return hashlib.md5(Image.open(upload).tobytes()).hexdigest()
+
+
+def timed(label, reruns, fn):
+    start = time.perf_counter()
+    for _ in range(reruns):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<38} {elapsed:8.3f}s total  {elapsed / reruns * 1000:9.1f} ms/rerun")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare upload hashing strategies")
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--size", type=int, default=3000, help="edge length in pixels")
+    parser.add_argument("--reruns", type=int, default=5, help="simulated Streamlit reruns")
+    args = parser.parse_args()
+
+    print(f"Generating {args.images} JPEGs of {args.size}x{args.size}...")
+    uploads = make_images(args.images, args.size)
+    total_mb = sum(upload.size for upload in uploads) / 1e6
+    print(f"Payload: {total_mb:.1f} MB compressed\n")
+
+    legacy = timed("legacy decode + md5", args.reruns, lambda: [legacy_hash(u) for u in uploads])
+    timed("blake2b of compressed bytes", args.reruns, lambda: [fast_digest(u.getbuffer()) for u in uploads])
+
+    deduper = UploadDeduper()
+    memoized = timed("memoized UploadDeduper (exact)", args.reruns, lambda: deduper.group(uploads))
+
+    deduper = UploadDeduper()
+    perceptual = timed("memoized UploadDeduper (perceptual)", args.reruns, lambda: deduper.group(uploads, perceptual=True))
+
+    print(f"\nSpeed-up vs legacy: exact {legacy / memoized:.0f}x, perceptual {legacy / perceptual:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
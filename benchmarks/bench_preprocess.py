@@ -0,0 +1,81 @@
+# Benchmark: payload size and end-to-end latency with and without client-side preprocessing.
+#
+# Usage: python benchmarks/bench_preprocess.py [--images 10] [--size 4000] [--uplink-mbps 20] [--live]
+# Without --live, upload time is estimated from --uplink-mbps. With --live (needs GOOGLE_API_KEY),
+# each payload is sent to the model and the measured request latency is reported.
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from image_preprocess import DEFAULT_MAX_EDGE, detect_mime_type, preprocess_image
+
+
+def make_scan(seed, size, fmt):
+    rng = random.Random(seed)
+    image = Image.radial_gradient("L").resize((size, size)).convert("RGB")
+    noise = Image.effect_noise((size, size), 25 + rng.randrange(20)).convert("RGB")
+    image = Image.blend(image, noise, 0.25)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **({"quality": 95} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def live_latency(model, data, mime_type):
+    started = time.perf_counter()
+    model.generate_content([{"mime_type": mime_type, "data": data}, "Describe this image in one sentence."])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure preprocessing savings")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--size", type=int, default=4000, help="edge length in pixels")
+    parser.add_argument("--max-edge", type=int, default=DEFAULT_MAX_EDGE)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    parser.add_argument("--live", action="store_true", help="send payloads to Gemini and time real requests")
+    args = parser.parse_args()
+
+    model = None
+    if args.live:
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        model = genai.GenerativeModel(model_name="gemini-1.5-flash-latest")
+
+    rows = []
+    for i in range(args.images):
+        fmt = "PNG" if i % 2 else "JPEG"
+        original = make_scan(i, args.size, fmt)
+        started = time.perf_counter()
+        processed, mime_type, _ = preprocess_image(original, max_edge=args.max_edge)
+        preprocess_seconds = time.perf_counter() - started
+
+        if model:
+            before = live_latency(model, original, detect_mime_type(original))
+            after = preprocess_seconds + live_latency(model, processed, mime_type)
+        else:
+            before = len(original) * 8 / (args.uplink_mbps * 1e6)
+            after = preprocess_seconds + len(processed) * 8 / (args.uplink_mbps * 1e6)
+        rows.append((fmt, len(original), len(processed), preprocess_seconds, before, after))
+        print(f"{fmt:<5} {len(original) / 1e6:7.2f} MB -> {len(processed) / 1e6:6.2f} MB  "
+              f"preprocess {preprocess_seconds * 1000:6.0f} ms  latency {before:6.2f}s -> {after:6.2f}s")
+
+    original_total = sum(row[1] for row in rows)
+    processed_total = sum(row[2] for row in rows)
+    mode = "measured" if model else f"estimated at {args.uplink_mbps:g} Mbit/s"
+    print(f"\nBytes saved: {(original_total - processed_total) / 1e6:.1f} MB "
+          f"({100 * (1 - processed_total / original_total):.0f}%)")
+    print(f"Median latency ({mode}): {statistics.median(r[4] for r in rows):.2f}s -> "
+          f"{statistics.median(r[5] for r in rows):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Exercise the request scheduler against a local fake model server.
+#
+# The server enforces a per-second quota (429 when exceeded) and fails a fraction of requests with 503,
+# like Gemini under load. Simulated users submit interactive and batch requests, some of them identical,
+# and the script reports API calls made, retries, coalescing and latency per priority.
+#
+# Usage: python benchmarks/bench_scheduler.py [--requests 200] [--quota 20] [--duplicates 0.3]
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from request_scheduler import BATCH, INTERACTIVE, RequestScheduler
+
+
+class FakeModelServer(ThreadingHTTPServer):
+    def __init__(self, quota_per_second, error_rate, latency):
+        super().__init__(("127.0.0.1", 0), FakeModelHandler)
+        self.quota_per_second = quota_per_second
+        self.error_rate = error_rate
+        self.latency = latency
+        self.counts = {"calls": 0, "429": 0, "503": 0, "ok": 0}
+        self.window = (0, 0)
+        self.lock = threading.Lock()
+
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.counts["calls"] += 1
+            second = int(time.monotonic())
+            start, used = server.window
+            used = used + 1 if start == second else 1
+            server.window = (second, used)
+            if used > server.quota_per_second:
+                status = 429
+            elif random.random() < server.error_rate:
+                status = 503
+            else:
+                status = 200
+            server.counts["ok" if status == 200 else str(status)] += 1
+        if status == 200:
+            time.sleep(server.latency)
+        payload = json.dumps({"text": f"analysis of {body['digest']}"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def call_model(url, digest):
+    request = urllib.request.Request(url, data=json.dumps({"digest": digest}).encode(), method="POST")
+    with urllib.request.urlopen(request) as response:  # HTTPError carries .code, so 429/5xx are retried
+        return json.loads(response.read())["text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler behaviour against a fake model server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--quota", type=int, default=20, help="server-side requests per second before 429")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of 503 responses")
+    parser.add_argument("--latency", type=float, default=0.2, help="server latency in seconds")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="fraction of requests repeating an earlier image")
+    parser.add_argument("--rpm", type=int, default=None, help="client-side rate limit (default: 90%% of quota)")
+    args = parser.parse_args()
+
+    server = FakeModelServer(args.quota, args.error_rate, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/generate"
+
+    scheduler = RequestScheduler(
+        requests_per_minute=args.rpm or int(args.quota * 60 * 0.9),
+        burst=max(1, args.quota // 2),
+        max_workers=16,
+        base_delay=0.2,
+        max_delay=5.0,
+    )
+
+    rng = random.Random(0)
+    digests = []
+    jobs = []
+    for i in range(args.requests):
+        digest = rng.choice(digests) if digests and rng.random() < args.duplicates else f"img{i:05d}"
+        digests.append(digest)
+        jobs.append((digest, INTERACTIVE if rng.random() < 0.2 else BATCH))
+
+    latencies = {INTERACTIVE: [], BATCH: []}
+    errors = []
+
+    def user(job):
+        digest, priority = job
+        started = time.perf_counter()
+        try:
+            scheduler.run(lambda: call_model(url, digest), priority, key=digest)
+            latencies[priority].append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as users:
+        for job in jobs:
+            users.submit(user, job)
+            time.sleep(0.002)
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    print(f"{args.requests} requests in {elapsed:.1f}s, {len(set(digests))} unique images")
+    print(f"Server: {server.counts['calls']} calls, {server.counts['429']} x 429, {server.counts['503']} x 503")
+    print(f"Scheduler: {scheduler.stats}")
+    for priority, name in ((INTERACTIVE, "interactive"), (BATCH, "batch")):
+        values = sorted(latencies[priority])
+        if values:
+            p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+            print(f"  {name:<11} n={len(values):<4} p50 {statistics.median(values):.2f}s  p95 {p95:.2f}s")
+    print(f"Failed requests: {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
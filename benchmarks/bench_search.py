@@ -0,0 +1,65 @@
+# Benchmark: incremental indexing and top-k query latency of the search index.
+#
+# Builds an index of synthetic analyses and chat turns spread over many sessions (report-like text with a
+# sprinkling of medical terms), then times keyword, semantic and hybrid queries scoped to one session
+# and across all sessions. Semantic and hybrid modes need numpy.
+#
+# Usage: python benchmarks/bench_search.py [--documents 30000] [--sessions 200] [--queries 200]
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instrumentation import percentile
+from search_index import SearchIndex
+
+TERMS = [
+    "pneumonia", "fracture", "nodule", "effusion", "dermatitis", "opacity", "lesion", "edema", "calcification",
+    "consolidation", "eczema", "psoriasis", "cardiomegaly", "atelectasis", "hairline", "biopsy", "ultrasound",
+    "antibiotic", "ointment", "hydrocortisone", "ibuprofen", "follow-up", "radiograph", "swelling",
+]
+FILLER = "the image shows a region with normal appearance and no acute change in the surrounding tissue".split()
+
+
+def synthetic_text(rng, words):
+    return " ".join(rng.choice(TERMS) if rng.random() < 0.08 else rng.choice(FILLER) for _ in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing throughput and query latency of the search index")
+    parser.add_argument("--documents", type=int, default=30000)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for i in range(args.documents):
+        session_id = f"session{i % args.sessions}"
+        if i % 3:
+            index.add_chat_turn(session_id, {"question": synthetic_text(rng, 12), "answer": synthetic_text(rng, 120), "created_at": float(i)})
+        else:
+            index.add_analysis(session_id, {"digest": f"{i:08x}", "image_name": f"scan{i}.png", "analysis": synthetic_text(rng, 400)})
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {args.documents} documents in {elapsed:.1f}s ({args.documents / elapsed:.0f} docs/s, modes: {', '.join(index.modes)})")
+
+    queries = [" ".join(rng.sample(TERMS, rng.randint(1, 3))) for _ in range(args.queries)]
+    for mode in index.modes:
+        for scope, session_id in (("one session", "session7"), ("all sessions", None)):
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, k=args.k, session_id=session_id, mode=mode)
+                latencies.append(time.perf_counter() - started)
+            print(f"  {mode:<8} {scope:<13} p50 {statistics.median(latencies) * 1000:6.1f} ms   "
+                  f"p95 {percentile(latencies, 0.95) * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
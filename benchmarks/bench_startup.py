@@ -0,0 +1,93 @@
+# Benchmark: cold-start cost of the Streamlit entry points.
+#
+# 1. Import time of the heavy dependencies and of each app module, each in a fresh interpreter.
+# 2. First-render time of every sidebar page of medigen_enhance.py (and the single page of
+#    medigen_catalyst.py) using Streamlit's AppTest, again in a fresh interpreter per page, plus
+#    the time of a second rerun in the same process.
+#
+# No model calls are made: a dummy GOOGLE_API_KEY is used and pages are only rendered.
+# Usage: python benchmarks/bench_startup.py [--repeat 3]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "streamlit",
+    "PIL.Image",
+    "google.generativeai",
+    "weasyprint",
+    "medigen_core",
+    "chat_engine",
+    "pdf_reports",
+]
+
+# Every page in the sidebar, in sidebar order
+PAGES = ["🏠 Home", "📂 Upload & Analyze", "💬 Ask AI", "🕘 Previous Interactions", "🔎 Search Findings", "ℹ️ How It Works", "📊 Admin"]
+
+IMPORT_SNIPPET = """
+import time, json
+started = time.perf_counter()
+import {module}
+print(json.dumps(time.perf_counter() - started))
+"""
+
+RENDER_SNIPPET = """
+import time, json
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+app = AppTest.from_file({script!r}, default_timeout=120)
+app.run()
+page = {page!r}
+if page:
+    app.sidebar.radio[0].set_value(page).run()
+first = time.perf_counter() - started
+started = time.perf_counter()
+app.run()
+print(json.dumps([first, time.perf_counter() - started, len(app.exception)]))
+"""
+
+
+def run_snippet(code):
+    env = dict(os.environ, GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "benchmark-dummy-key"))
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and first-render time")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("Import time (fresh interpreter, median)")
+    for module in MODULES:
+        try:
+            samples = [run_snippet(IMPORT_SNIPPET.format(module=module)) for _ in range(args.repeat)]
+            print(f"  {module:<22} {statistics.median(samples) * 1000:8.0f} ms")
+        except RuntimeError as e:
+            print(f"  {module:<22} unavailable ({e})")
+
+    print("\nFirst render / warm rerun (fresh interpreter, median)")
+    targets = [("medigen_enhance.py", page) for page in PAGES] + [("medigen_catalyst.py", None)]
+    for script, page in targets:
+        label = f"{script} {page or ''}".strip()
+        try:
+            samples = [run_snippet(RENDER_SNIPPET.format(script=script, page=page)) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"  {label:<45} failed ({e})")
+            continue
+        first = statistics.median(sample[0] for sample in samples)
+        rerun = statistics.median(sample[1] for sample in samples)
+        errors = max(sample[2] for sample in samples)
+        note = f"  ({errors} page exceptions)" if errors else ""
+        print(f"  {label:<45} first {first * 1000:7.0f} ms   rerun {rerun * 1000:6.0f} ms{note}")
+
+
+if __name__ == "__main__":
+    main()
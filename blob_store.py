@@ -0,0 +1,248 @@
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from image_dedup import upload_bytes
+from instrumentation import metrics
+
+
+# Raised when an upload would take a session over its byte budget; the message is shown to the user
+class UploadLimitExceeded(Exception):
+    pass
+
+
+class _Blob:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.sessions = set()
+        self.pins = 0
+
+
+class _Session:
+    def __init__(self):
+        self.digests = set()
+        self.bytes = 0
+        self.last_seen = time.time()
+
+
+# Process-wide store of upload bytes, content-addressed by digest. Each upload is written once to a file
+# under `root` and read back through a read-only memory map, so hashing, thumbnails, triage and the model
+# request all work on a zero-copy memoryview whose pages the kernel can drop under memory pressure, instead
+# of each holding its own copy of the bytes on the heap. Sessions are charged once per digest they hold:
+# `put` raises UploadLimitExceeded beyond `session_limit_bytes`, sessions idle for `session_ttl_seconds`
+# are released, and beyond `max_bytes` the least recently seen other sessions are released first.
+# A blob is deleted when no session holds it and no job has it pinned.
+class UploadBlobStore:
+    def __init__(self, root=None, session_limit_bytes=512 * 1024 * 1024, max_bytes=4 * 1024 * 1024 * 1024, session_ttl_seconds=6 * 3600):
+        self.root = root or tempfile.mkdtemp(prefix="medigen_uploads_")
+        self.session_limit_bytes = session_limit_bytes
+        self.max_bytes = max_bytes
+        self.session_ttl_seconds = session_ttl_seconds
+        self._blobs = {}
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._stats = {"stored": 0, "shared": 0, "rejected": 0, "released_sessions": 0, "mapped": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    # Charge `session_id` for an upload (an UploadedFile, bytes or memoryview) and spill it to disk unless
+    # another session already stored the same digest
+    def put(self, session_id, digest, upload):
+        with self._lock:
+            self._release_idle(session_id)
+            session = self._session(session_id)
+            if digest in session.digests:
+                return
+            blob = self._blobs.get(digest)
+            size = blob.size if blob is not None else _upload_size(upload)
+            if session.bytes + size > self.session_limit_bytes:
+                self._stats["rejected"] += 1
+                raise UploadLimitExceeded(
+                    f"this session already holds {session.bytes / (1024 * 1024):.0f} MB of uploads "
+                    f"(limit {self.session_limit_bytes / (1024 * 1024):.0f} MB); remove some files first"
+                )
+
+        while True:
+            if blob is None:
+                blob = self._write(digest, upload)
+            with self._lock:
+                # Another session may have released the blob (and its file) since it was looked up above
+                current = self._blobs.get(digest)
+                if current is None and not os.path.exists(blob.path):
+                    blob = None
+                    continue
+                blob = self._blobs[digest] = current or blob
+                if not blob.sessions:
+                    self._total_bytes += blob.size
+                    self._stats["stored"] += 1
+                else:
+                    self._stats["shared"] += 1
+                session = self._session(session_id)
+                if digest not in session.digests:
+                    session.digests.add(digest)
+                    session.bytes += blob.size
+                    blob.sessions.add(session_id)
+                self._release_over_budget(session_id)
+                return
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._blobs
+
+    # Read-only memoryview of a blob, or None if it is no longer stored. The mapping lives exactly as long
+    # as the view: call view.release() (or drop every reference) when done.
+    def view(self, digest):
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                return None
+            self._stats["mapped"] += 1
+        if not blob.size:
+            return memoryview(b"")
+        with open(blob.path, "rb") as source:
+            return memoryview(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+
+    # Path of a blob for readers that open files themselves (DICOM, pyvips). The blob is pinned on disk
+    # until the block exits, even if every session lets go of it meanwhile.
+    @contextmanager
+    def local_path(self, digest):
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                raise KeyError(digest)
+            blob.pins += 1
+        try:
+            yield blob.path
+        finally:
+            with self._lock:
+                blob.pins -= 1
+                self._delete_if_orphaned(digest, blob)
+
+    # Let go of one upload (digest given) or of everything a session holds
+    def release(self, session_id, digest=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            for held in [digest] if digest is not None else list(session.digests):
+                self._release_blob(session_id, session, held)
+            if not session.digests:
+                del self._sessions[session_id]
+
+    # Let go of every upload a session holds except `keep` (e.g. the files still in its uploader)
+    def retain(self, session_id, keep):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            for digest in list(session.digests - set(keep)):
+                self._release_blob(session_id, session, digest)
+
+    # Bytes a session is charged for, and its limit
+    def usage(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return {
+                "blobs": len(session.digests) if session else 0,
+                "bytes": session.bytes if session else 0,
+                "limit": self.session_limit_bytes,
+            }
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                blobs=len(self._blobs),
+                bytes=self._total_bytes,
+                sessions=len(self._sessions),
+                largest_session_bytes=max((session.bytes for session in self._sessions.values()), default=0),
+            )
+
+    # Remove every blob file (e.g. on shutdown)
+    def close(self):
+        with self._lock:
+            self._blobs.clear()
+            self._sessions.clear()
+            self._total_bytes = 0
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = time.time()
+        return session
+
+    # Write to a temporary name and rename, so concurrent writers of one digest never expose a partial file
+    def _write(self, digest, upload):
+        path = os.path.join(self.root, digest)
+        data = upload_bytes(upload) if hasattr(upload, "getvalue") else upload
+        with metrics.timer("upload_spill"):
+            descriptor, partial = tempfile.mkstemp(dir=self.root, prefix=".partial_")
+            try:
+                with os.fdopen(descriptor, "wb") as spool:
+                    spool.write(data)
+                os.replace(partial, path)
+            except BaseException:
+                os.remove(partial)
+                raise
+            finally:
+                if isinstance(data, memoryview) and data is not upload:
+                    data.release()
+        return _Blob(path, os.path.getsize(path))
+
+    def _release_blob(self, session_id, session, digest):
+        if digest not in session.digests:
+            return
+        blob = self._blobs[digest]
+        session.digests.discard(digest)
+        session.bytes -= blob.size
+        blob.sessions.discard(session_id)
+        self._delete_if_orphaned(digest, blob)
+
+    def _delete_if_orphaned(self, digest, blob):
+        if blob.sessions or blob.pins or self._blobs.get(digest) is not blob:
+            return
+        del self._blobs[digest]
+        self._total_bytes -= blob.size
+        try:
+            os.remove(blob.path)
+        except OSError:
+            pass  # still mapped on Windows, or already gone
+
+    def _release_session(self, session_id):
+        session = self._sessions.pop(session_id)
+        for digest in list(session.digests):
+            self._release_blob(session_id, session, digest)
+        self._stats["released_sessions"] += 1
+
+    # Streamlit has no "session ended" hook, so sessions that stopped uploading are released after a while
+    def _release_idle(self, current_session_id):
+        if not self.session_ttl_seconds:
+            return
+        cutoff = time.time() - self.session_ttl_seconds
+        for session_id, session in list(self._sessions.items()):
+            if session.last_seen >= cutoff:
+                break  # ordered by last use
+            if session_id != current_session_id:
+                self._release_session(session_id)
+
+    def _release_over_budget(self, current_session_id):
+        for session_id in list(self._sessions):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if session_id != current_session_id:
+                self._release_session(session_id)
+
+
+def _upload_size(upload):
+    size = getattr(upload, "size", None)
+    return size if isinstance(size, int) else len(upload)
@@ -0,0 +1,189 @@
+import datetime
+import os
+import time
+from collections import namedtuple
+
+from model_clients import load_genai
+from instrumentation import metrics
+from request_scheduler import INTERACTIVE
+from streaming import start_stream
+
+# Versioned model used for context caching (the -latest aliases cannot be cached)
+CONTEXT_CACHE_MODEL = os.getenv("MEDIGEN_CONTEXT_CACHE_MODEL", "models/gemini-1.5-pro-002")
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a clinician and an assistant about a medical image analysis "
+    "in under 150 words. Keep every finding, diagnosis, medication and recommendation that was discussed.\n\n"
+)
+
+# Margin before a context cache's expiry at which it is no longer trusted for a request
+CONTEXT_EXPIRY_MARGIN_SECONDS = 30
+
+# What a context cache factory returns: the model bound to the cache, its TTL, extend() which pushes
+# the expiry back by another TTL, and delete() which removes the cache so it stops being billed
+CachedContext = namedtuple("CachedContext", ["model", "ttl_seconds", "extend", "delete"])
+
+
+# Rough token estimate (~4 characters per token), good enough for budgeting without an API round trip
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+# Multi-turn follow-up chat about one analysis, built on the model's chat API.
+# The image and report are sent once as context (in a context cache when the API allows it),
+# and older turns are summarized or dropped once they exceed the token budget.
+class ChatEngine:
+    def __init__(self, model, analysis_text, image_part=None, max_history_tokens=4000, keep_recent_turns=4,
+                 summarize=True, cached_model_factory=None, scheduler=None, turns=None):
+        self.model = model
+        self.scheduler = scheduler
+        self.analysis_text = analysis_text
+        self.image_part = image_part
+        self.max_history_tokens = max_history_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summarize = summarize
+        # (question, answer) pairs, oldest first; `turns` resumes an earlier conversation
+        self.turns = list(turns or [])
+        self.summary = None
+        self.turn_stats = []
+        self.context_cached = False
+        self._pending = False
+        self._cached_model_factory = cached_model_factory
+        self._context = None
+        self._context_expires_at = 0.0
+
+        self._chat_model = model
+        if cached_model_factory:
+            self._start_context_cache()
+        self._chat = self._chat_model.start_chat(history=self._build_history())
+
+    def _start_context_cache(self):
+        if self._context is not None:
+            # A replaced cache would otherwise keep being billed until its TTL runs out
+            try:
+                self._context.delete()
+            except Exception:
+                pass  # already expired or deleted
+        try:
+            self._context = self._cached_model_factory(self._context_contents())
+            self._context_expires_at = time.time() + self._context.ttl_seconds
+            self._chat_model = self._context.model
+            self.context_cached = True
+        except Exception:
+            # Context caching needs a minimum prompt size and a versioned model; fall back to inline context
+            self._context = None
+            self._chat_model = self.model
+            self.context_cached = False
+
+    # The engine outlives the cache's TTL (it stays in the session), so the cache is extended once half of
+    # its TTL has passed. A cache that already lapsed is recreated, or the context goes inline again.
+    def _refresh_context(self):
+        if not self.context_cached:
+            return
+        remaining = self._context_expires_at - time.time()
+        if remaining > self._context.ttl_seconds / 2:
+            return
+        if remaining > CONTEXT_EXPIRY_MARGIN_SECONDS:
+            try:
+                self._context.extend()
+                self._context_expires_at = time.time() + self._context.ttl_seconds
+                return
+            except Exception:
+                pass
+        self._start_context_cache()
+        self._chat = self._chat_model.start_chat(history=self._build_history())
+
+    def _context_contents(self):
+        parts = [self.image_part] if self.image_part else []
+        parts.append(
+            "Here is the medical image and the analysis report you produced for it:\n\n"
+            f"{self.analysis_text}\n\nAnswer my follow-up questions about this analysis."
+        )
+        return [{"role": "user", "parts": parts}]
+
+    def _build_history(self):
+        history = []
+        if not self.context_cached:
+            history.extend(self._context_contents())
+            history.append({"role": "model", "parts": ["Understood. Ask me anything about this analysis."]})
+        if self.summary:
+            history.append({"role": "user", "parts": [f"Summary of our earlier conversation: {self.summary}"]})
+            history.append({"role": "model", "parts": ["Noted."]})
+        for question, answer in self.turns:
+            history.append({"role": "user", "parts": [question]})
+            history.append({"role": "model", "parts": [answer]})
+        return history
+
+    def history_tokens(self):
+        return sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns) + estimate_tokens(self.summary or "")
+
+    # Keep the running history within budget: fold older turns into a summary (or drop them)
+    def _compact(self):
+        if self.history_tokens() <= self.max_history_tokens or len(self.turns) <= self.keep_recent_turns:
+            return
+        older, self.turns = self.turns[:-self.keep_recent_turns], self.turns[-self.keep_recent_turns:]
+        if self.summarize:
+            transcript = "\n".join(f"Clinician: {q}\nAssistant: {a}" for q, a in older)
+            if self.summary:
+                transcript = f"Earlier summary: {self.summary}\n{transcript}"
+            try:
+                with metrics.timer("model.chat_summary"):
+                    self.summary = self._call(lambda: self.model.generate_content(SUMMARY_PROMPT + transcript)).text
+            except Exception:
+                pass
+        self._chat = self._chat_model.start_chat(history=self._build_history())
+
+    # Route model calls through the shared scheduler when one is configured
+    def _call(self, fn):
+        if self.scheduler is None:
+            return fn()
+        return self.scheduler.run(fn, INTERACTIVE)
+
+    # Add a turn answered elsewhere (e.g. from the Q&A cache) so later questions see it as context
+    def record_turn(self, question, answer):
+        self.turns.append((question, answer))
+        self._compact()
+        self._chat = self._chat_model.start_chat(history=self._build_history())
+
+    # Ask a follow-up question; returns a TimedStream of answer chunks.
+    # The turn is recorded once the stream has been fully consumed.
+    def ask(self, question):
+        self._refresh_context()
+        if self._pending:
+            # The previous answer was interrupted mid-stream; restart the chat from the recorded turns
+            self._chat = self._chat_model.start_chat(history=self._build_history())
+        self._compact()
+        self._pending = True
+
+        def finish(stream):
+            self._pending = False
+            if stream.text:
+                self.turns.append((question, stream.text))
+                self.turn_stats.append(
+                    {"input_tokens": stream.input_tokens, "first_token_seconds": stream.first_token_seconds,
+                     "total_seconds": stream.total_seconds}
+                )
+
+        return start_stream(
+            self._chat.send_message, question,
+            on_complete=finish, scheduler=self.scheduler, priority=INTERACTIVE, metric="model.chat",
+        )
+
+
+# Build a factory that places the image and report in a Gemini context cache; returns a CachedContext
+def context_cache_factory(generation_config=None, safety_settings=None, ttl_minutes=30, model_name=CONTEXT_CACHE_MODEL):
+    def factory(contents):
+        from google.generativeai import caching
+
+        genai = load_genai()
+
+        ttl = datetime.timedelta(minutes=ttl_minutes)
+        cached_content = caching.CachedContent.create(model=model_name, contents=contents, ttl=ttl)
+        model = genai.GenerativeModel.from_cached_content(
+            cached_content=cached_content,
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+        )
+        return CachedContext(model, ttl.total_seconds(), lambda: cached_content.update(ttl=ttl), cached_content.delete)
+
+    return factory
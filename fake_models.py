@@ -0,0 +1,201 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+
+from findings import SEVERITIES
+
+# Same fields as the usage_metadata Gemini attaches to responses
+FakeUsage = namedtuple("FakeUsage", ["prompt_token_count", "candidates_token_count", "total_token_count"])
+
+# Tokens billed for one image part, as for Gemini 1.5
+IMAGE_TOKENS = 258
+
+_MODALITIES = [("X-ray", "chest"), ("CT", "abdomen"), ("MRI", "left knee"), ("skin photo", "forearm"), ("ultrasound", "thyroid")]
+_FINDINGS = [
+    "No acute abnormality", "Small area of consolidation", "Mild soft tissue swelling", "Hairline fracture",
+    "Well-defined nodule", "Patchy erythema with scaling", "Trace pleural effusion",
+]
+_RECOMMENDATIONS = [
+    "Follow-up imaging in 6 weeks", "Clinical correlation", "Referral to a specialist", "Repeat study with contrast",
+]
+_TREATMENTS = ["Rest and elevation", "Topical hydrocortisone 1% twice daily", "Ibuprofen 400 mg as needed"]
+
+
+# Raised for simulated failures. `code` makes the request scheduler treat it like a Gemini 503.
+class FakeServiceUnavailable(Exception):
+    code = 503
+
+
+class FakeResponse:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+# Streamed response: iterating yields chunks (objects with .text) at the simulated pace
+class FakeStream:
+    def __init__(self, text, usage, first_token_seconds, total_seconds, chunk_chars=80):
+        self.usage_metadata = usage
+        self.text = text
+        self._first_token_seconds = first_token_seconds
+        self._total_seconds = total_seconds
+        self._chunk_chars = chunk_chars
+
+    def __iter__(self):
+        chunks = [self.text[i:i + self._chunk_chars] for i in range(0, len(self.text), self._chunk_chars)] or [""]
+        time.sleep(self._first_token_seconds)
+        pause = max(0.0, self._total_seconds - self._first_token_seconds) / len(chunks)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(pause)
+            yield FakeResponse(chunk, None)
+
+
+def _digest(contents):
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, dict):
+            data = part.get("data")
+            if data is not None:
+                hasher.update(bytes(data))
+            for nested in part.get("parts", ()):
+                hasher.update(_digest(nested).encode())
+        else:
+            hasher.update(str(part).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def _prompt_tokens(contents):
+    tokens = 0
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, dict):
+            tokens += IMAGE_TOKENS if "data" in part else _prompt_tokens(list(part.get("parts", ())))
+        else:
+            tokens += len(str(part)) // 4 + 1
+    return tokens
+
+
+# Stand-in for genai.GenerativeModel with the calls this app makes (generate_content, start_chat).
+# Responses are derived from a hash of the request, so the same input always gives the same text, latency
+# and (simulated) failure; retries of a failing request draw again. Structured-output configs get JSON
+# that matches the analysis (or triage) response schema.
+class FakeModel:
+    def __init__(self, backend, model_name, generation_config=None, system_instruction=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self.backend.respond(self, contents, stream)
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+    def reply_text(self, rng, contents):
+        schema = self.generation_config.get("response_schema") or {}
+        if "medical" in schema.get("properties", {}):
+            # Triage answer: most uploads are medical and usable
+            medical = rng.random() < 0.9
+            return json.dumps({
+                "medical": medical,
+                "quality": rng.choice(["good", "good", "good", "poor", "unusable"]) if medical else "good",
+                "modality": rng.choice(_MODALITIES)[0] if medical else "photo",
+                "reason": "Synthetic triage answer from the fake model backend.",
+            })
+        if self.generation_config.get("response_mime_type") == "application/json":
+            modality, body_region = rng.choice(_MODALITIES)
+            return json.dumps({
+                "modality": modality,
+                "body_region": body_region,
+                "detailed_analysis": f"Synthetic {modality} of the {body_region} generated by the fake model backend.",
+                "findings": [
+                    {"finding": rng.choice(_FINDINGS), "body_region": body_region, "severity": rng.choice(SEVERITIES),
+                     "confidence": round(rng.random(), 2)}
+                    for _ in range(rng.randint(1, 3))
+                ],
+                "recommendations": rng.sample(_RECOMMENDATIONS, 2),
+                "treatments": rng.sample(_TREATMENTS, 1),
+                "medications": [],
+                "home_remedies": [],
+                "disclaimer": "Consult with a Doctor before making any decisions.",
+            })
+        modality, body_region = rng.choice(_MODALITIES)
+        sentences = " ".join(f"{rng.choice(_FINDINGS)} in the {body_region}." for _ in range(rng.randint(4, 12)))
+        return (
+            f"### Detailed Analysis\nSynthetic {modality} report from the fake model backend. {sentences}\n\n"
+            f"### Findings Report\n- {rng.choice(_FINDINGS)}\n\n"
+            f"### Recommendation and Next Steps\n- {rng.choice(_RECOMMENDATIONS)}\n\n"
+            f"### Treatment Suggestions\n- {rng.choice(_TREATMENTS)}\n\n"
+            "Consult with a Doctor before making any decisions."
+        )
+
+
+class FakeChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        response = self.model.backend.respond(self.model, self.history + [{"role": "user", "parts": [content]}], stream)
+        self.history.append({"role": "user", "parts": [content]})
+        self.history.append({"role": "model", "parts": [response.text]})
+        return response
+
+
+# Drop-in replacement for ModelRegistry that never touches the network. `latency` is the mean time of a
+# whole response in seconds (each request gets 50-150% of it, a third of that before the first token) and
+# `error_rate` the fraction of requests that fail with a retryable 503.
+class FakeModelRegistry:
+    def __init__(self, latency=1.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.stats = {"calls": 0, "errors": 0}
+        self._models = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name, generation_config=None, safety_settings=None, system_instruction=None):
+        key = (model_name, json.dumps(generation_config, sort_keys=True), system_instruction)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = FakeModel(self, model_name, generation_config, system_instruction)
+        return model
+
+    def get_cached(self, model_name, generation_config, safety_settings, system_instruction, ttl_minutes=60):
+        return self.get(model_name, generation_config, safety_settings, system_instruction)
+
+    def respond(self, model, contents, stream):
+        request = _digest([model.model_name, json.dumps(model.generation_config, sort_keys=True, default=str),
+                           model.system_instruction or ""] + (list(contents) if isinstance(contents, (list, tuple)) else [contents]))
+        with self._lock:
+            attempt = self._attempts.get(request, 0)
+            self._attempts[request] = attempt + 1
+            self.stats["calls"] += 1
+        rng = random.Random(f"{self.seed}:{request}:{attempt}")
+        total_seconds = self.latency * rng.uniform(0.5, 1.5)
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            time.sleep(total_seconds / 3)
+            raise FakeServiceUnavailable("Simulated 503 from the fake model backend")
+        with self._lock:
+            self._attempts.pop(request, None)
+
+        # Content depends only on the request, not on the attempt
+        text = model.reply_text(random.Random(f"{self.seed}:{request}"), contents)
+        prompt_tokens = _prompt_tokens(contents) + len(model.system_instruction or "") // 4
+        output_tokens = len(text) // 4 + 1
+        usage = FakeUsage(prompt_tokens, output_tokens, prompt_tokens + output_tokens)
+        if stream:
+            return FakeStream(text, usage, total_seconds / 3, total_seconds)
+        time.sleep(total_seconds)
+        return FakeResponse(text, usage)
+
+    def __len__(self):
+        return len(self._models)
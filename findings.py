@@ -0,0 +1,370 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from analysis_cache import DEFAULT_CACHE_DIR
+
+SEVERITIES = ["normal", "mild", "moderate", "severe", "undetermined"]
+
+# Response schema for Gemini structured output (OpenAPI subset: no $ref, no additionalProperties).
+# One field per heading of the report, plus typed findings that can be filtered.
+analysis_schema = {
+    "type": "object",
+    "properties": {
+        "modality": {"type": "string", "description": "Imaging modality, e.g. X-ray, CT, MRI, ultrasound, skin photo"},
+        "body_region": {"type": "string", "description": "Main body region shown, e.g. chest, left knee, skin of forearm"},
+        "detailed_analysis": {"type": "string"},
+        "findings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "finding": {"type": "string"},
+                    "body_region": {"type": "string"},
+                    "severity": {"type": "string", "enum": SEVERITIES},
+                    "confidence": {"type": "number", "description": "0 to 1"},
+                },
+                "required": ["finding", "severity"],
+            },
+        },
+        "recommendations": {"type": "array", "items": {"type": "string"}},
+        "treatments": {"type": "array", "items": {"type": "string"}},
+        "medications": {"type": "array", "items": {"type": "string"}, "description": "Medications and ointments with dosage"},
+        "home_remedies": {"type": "array", "items": {"type": "string"}},
+        "disclaimer": {"type": "string"},
+    },
+    "required": ["modality", "body_region", "detailed_analysis", "findings", "recommendations"],
+}
+
+# Appended to the analysis prompt when the model is asked for JSON instead of markdown
+structured_instructions = """
+Return the report as JSON that follows the response schema instead of markdown headings: the Detailed Analysis
+goes in "detailed_analysis", each anomaly in "findings", Recommendation and Next Steps in "recommendations",
+Treatment Suggestions in "treatments", medications and ointments in "medications" and home-made remedies in
+"home_remedies". Use "normal" severity for a normal study and "undetermined" when the image does not allow a judgement.
+"""
+
+# Used to turn an already written (streamed) report into the same JSON, without re-sending the image
+extraction_prompt = """
+Convert the following medical image report into JSON that follows the response schema. Use only information
+stated in the report; leave arrays empty when a section is missing.
+
+Report:
+"""
+
+Finding = namedtuple("Finding", ["finding", "body_region", "severity", "confidence"])
+StructuredAnalysis = namedtuple(
+    "StructuredAnalysis",
+    ["modality", "body_region", "detailed_analysis", "findings", "recommendations", "treatments",
+     "medications", "home_remedies", "disclaimer"],
+)
+
+# Recommendation-like fields, stored together in one table with their kind
+_RECOMMENDATION_FIELDS = ["recommendations", "treatments", "medications", "home_remedies"]
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _strings(values):
+    return [_text(value) for value in values or [] if _text(value)]
+
+
+# Parse the model's JSON into a StructuredAnalysis. Tolerates code fences and missing optional fields;
+# raises ValueError if the response is not a JSON object.
+def parse_structured_analysis(response_text):
+    text = response_text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):] if "{" in text else text
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("Structured analysis is not a JSON object")
+
+    findings = []
+    for item in data.get("findings") or []:
+        if isinstance(item, str):
+            item = {"finding": item}
+        if not isinstance(item, dict) or not _text(item.get("finding")):
+            continue
+        severity = _text(item.get("severity")).lower()
+        try:
+            confidence = float(item["confidence"]) if item.get("confidence") is not None else None
+        except (TypeError, ValueError):
+            confidence = None
+        findings.append(Finding(
+            finding=_text(item["finding"]),
+            body_region=_text(item.get("body_region")) or _text(data.get("body_region")),
+            severity=severity if severity in SEVERITIES else "undetermined",
+            confidence=confidence,
+        ))
+
+    return StructuredAnalysis(
+        modality=_text(data.get("modality")),
+        body_region=_text(data.get("body_region")),
+        detailed_analysis=_text(data.get("detailed_analysis")),
+        findings=findings,
+        recommendations=_strings(data.get("recommendations")),
+        treatments=_strings(data.get("treatments")),
+        medications=_strings(data.get("medications")),
+        home_remedies=_strings(data.get("home_remedies")),
+        disclaimer=_text(data.get("disclaimer")) or "Consult with a Doctor before making any decisions.",
+    )
+
+
+def _bullets(items):
+    return "\n".join(f"- {item}" for item in items) if items else "- None"
+
+
+# Render a StructuredAnalysis as the markdown report shown in the app and in PDFs
+def render_markdown(analysis):
+    findings = []
+    for finding in analysis.findings:
+        details = ", ".join(part for part in (finding.body_region, finding.severity) if part)
+        findings.append(f"**{finding.finding}**" + (f" ({details})" if details else ""))
+    header = " · ".join(part for part in (analysis.modality, analysis.body_region) if part)
+    return "\n\n".join(part for part in (
+        f"*{header}*" if header else "",
+        "### Detailed Analysis\n" + (analysis.detailed_analysis or "Unable to be determined based on the provided image."),
+        "### Findings Report\n" + _bullets(findings),
+        "### Recommendation and Next Steps\n" + _bullets(analysis.recommendations),
+        "### Treatment Suggestions\n" + _bullets(analysis.treatments),
+        "### Medications and Ointments\n" + _bullets(analysis.medications),
+        "### Home-Made Remedies\n" + _bullets(analysis.home_remedies),
+        f"⚠️ {analysis.disclaimer}",
+    ) if part)
+
+
+def _normalize(value):
+    return _text(value).lower()
+
+
+# Quote every term so user input can't inject FTS5 query syntax; terms are ANDed
+def _fts_query(text):
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+# SQLite table of parsed analyses, one row per finding and per recommendation, indexed for filtering
+# by modality, body region and severity, with full-text search over findings and recommendations
+# (FTS5 when the SQLite build has it, LIKE otherwise). Analyses are shared by every session that produced
+# the same cache key; `analysis_owners` records which sessions did, and searches can be limited to one.
+class FindingsStore:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "findings.sqlite3")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                image_digest TEXT NOT NULL,
+                image_name TEXT,
+                modality TEXT NOT NULL,
+                body_region TEXT NOT NULL,
+                record TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_analyses_modality ON analyses(modality);
+            CREATE INDEX IF NOT EXISTS idx_analyses_body_region ON analyses(body_region);
+            CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses(created_at);
+            CREATE TABLE IF NOT EXISTS findings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                analysis_key TEXT NOT NULL,
+                finding TEXT NOT NULL,
+                body_region TEXT NOT NULL,
+                severity TEXT NOT NULL,
+                confidence REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_findings_analysis ON findings(analysis_key);
+            CREATE INDEX IF NOT EXISTS idx_findings_body_region ON findings(body_region, severity);
+            CREATE INDEX IF NOT EXISTS idx_findings_severity ON findings(severity);
+            CREATE TABLE IF NOT EXISTS recommendations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                analysis_key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_recommendations_analysis ON recommendations(analysis_key);
+            CREATE TABLE IF NOT EXISTS analysis_owners (
+                session_id TEXT NOT NULL,
+                analysis_key TEXT NOT NULL,
+                PRIMARY KEY (session_id, analysis_key)
+            );"""
+        )
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS findings_fts USING fts5(analysis_key UNINDEXED, field UNINDEXED, text)"
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False  # SQLite built without FTS5
+        self._conn.commit()
+
+    def has(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM analyses WHERE key = ?", (key,)).fetchone() is not None
+
+    # Store (or replace) the parsed analysis for an analysis cache key
+    def put(self, key, image_digest, image_name, analysis):
+        record = json.dumps({**analysis._asdict(), "findings": [finding._asdict() for finding in analysis.findings]})
+        texts = [("finding", finding.finding) for finding in analysis.findings]
+        recommendations = [(field, text) for field in _RECOMMENDATION_FIELDS for text in getattr(analysis, field)]
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO analyses (key, image_digest, image_name, modality, body_region, record, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, image_digest, image_name, _normalize(analysis.modality), _normalize(analysis.body_region), record, time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO findings (analysis_key, finding, body_region, severity, confidence) VALUES (?, ?, ?, ?, ?)",
+                [(key, finding.finding, _normalize(finding.body_region), finding.severity, finding.confidence) for finding in analysis.findings],
+            )
+            self._conn.executemany(
+                "INSERT INTO recommendations (analysis_key, kind, text) VALUES (?, ?, ?)",
+                [(key, kind, text) for kind, text in recommendations],
+            )
+            if self.full_text:
+                self._conn.executemany(
+                    "INSERT INTO findings_fts (analysis_key, field, text) VALUES (?, ?, ?)",
+                    [(key, field, text) for field, text in texts + recommendations],
+                )
+            self._conn.commit()
+
+    # Record that a session produced (or was served) the analysis stored under `key`
+    def add_owner(self, key, session_id):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO analysis_owners (session_id, analysis_key) VALUES (?, ?)", (session_id, key))
+            self._conn.commit()
+
+    # Hide every analysis from a session's searches (the analyses stay for other sessions)
+    def remove_session(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_owners WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def _delete(self, key):
+        for table, column in (("analyses", "key"), ("findings", "analysis_key"), ("recommendations", "analysis_key")):
+            self._conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+        if self.full_text:
+            self._conn.execute("DELETE FROM findings_fts WHERE analysis_key = ?", (key,))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        data["findings"] = [Finding(**finding) for finding in data["findings"]]
+        return StructuredAnalysis(**data)
+
+    # Filter past analyses. `text` searches findings and recommendations, `recommendation` only the
+    # recommendation-like fields; modality, body_region and severity are exact (case-insensitive) matches
+    # on indexed columns. With `session_id`, only that session's analyses are searched. Returns dicts, newest
+    # first, with the matching findings of each analysis.
+    def search(self, text=None, body_region=None, severity=None, modality=None, recommendation=None, limit=50, offset=0, session_id=None):
+        conditions, params = [], []
+        if session_id is not None:
+            conditions.append("a.key IN (SELECT analysis_key FROM analysis_owners WHERE session_id = ?)")
+            params.append(session_id)
+        if modality:
+            conditions.append("a.modality = ?")
+            params.append(_normalize(modality))
+        if body_region or severity:
+            finding_conditions, finding_params = [], []
+            if body_region:
+                finding_conditions.append("body_region = ?")
+                finding_params.append(_normalize(body_region))
+            if severity:
+                finding_conditions.append("severity = ?")
+                finding_params.append(_normalize(severity))
+            region_match = "a.body_region = ? OR " if body_region and not severity else ""
+            conditions.append(
+                f"({region_match}a.key IN (SELECT analysis_key FROM findings WHERE {' AND '.join(finding_conditions)}))"
+            )
+            params += ([_normalize(body_region)] if region_match else []) + finding_params
+        for query, fields in ((text, None), (recommendation, _RECOMMENDATION_FIELDS)):
+            if not query or not query.strip():
+                continue
+            condition, condition_params = self._text_condition(query, fields)
+            conditions.append(f"a.key IN ({condition})")
+            params += condition_params
+
+        sql = "SELECT a.key, a.image_digest, a.image_name, a.modality, a.body_region, a.created_at FROM analyses a"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY a.created_at DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            results = []
+            for key, image_digest, image_name, row_modality, row_region, created_at in rows:
+                finding_rows = self._conn.execute(
+                    "SELECT finding, body_region, severity FROM findings WHERE analysis_key = ?"
+                    + (" AND severity = ?" if severity else ""),
+                    (key, _normalize(severity)) if severity else (key,),
+                ).fetchall()
+                results.append({
+                    "key": key,
+                    "image_digest": image_digest,
+                    "image_name": image_name,
+                    "modality": row_modality,
+                    "body_region": row_region,
+                    "created_at": created_at,
+                    "findings": [f"{finding} ({region or 'n/a'}, {level})" for finding, region, level in finding_rows],
+                })
+        return results
+
+    def _text_condition(self, query, fields):
+        if self.full_text:
+            condition = "SELECT analysis_key FROM findings_fts WHERE findings_fts MATCH ?"
+            params = [_fts_query(query)]
+            if fields:
+                condition += f" AND field IN ({', '.join('?' for _ in fields)})"
+                params += fields
+            return condition, params
+        pattern = f"%{query.strip()}%"
+        if fields:
+            placeholders = ", ".join("?" for _ in fields)
+            return f"SELECT analysis_key FROM recommendations WHERE text LIKE ? AND kind IN ({placeholders})", [pattern] + fields
+        return (
+            "SELECT analysis_key FROM findings WHERE finding LIKE ? UNION SELECT analysis_key FROM recommendations WHERE text LIKE ?",
+            [pattern, pattern],
+        )
+
+    # Distinct values with counts, for filter widgets (of one session's analyses with `session_id`)
+    def facets(self, session_id=None):
+        owned, params = self._owned(session_id)
+        with self._lock:
+            return {
+                "modality": self._conn.execute(
+                    f"SELECT modality, COUNT(*) FROM analyses WHERE modality != ''{owned.format(column='key')} GROUP BY modality ORDER BY COUNT(*) DESC",
+                    params,
+                ).fetchall(),
+                "body_region": self._conn.execute(
+                    f"SELECT body_region, COUNT(*) FROM findings WHERE body_region != ''{owned.format(column='analysis_key')} GROUP BY body_region ORDER BY COUNT(*) DESC",
+                    params,
+                ).fetchall(),
+                "severity": self._conn.execute(
+                    f"SELECT severity, COUNT(*) FROM findings WHERE 1{owned.format(column='analysis_key')} GROUP BY severity ORDER BY COUNT(*) DESC",
+                    params,
+                ).fetchall(),
+            }
+
+    def count(self, session_id=None):
+        owned, params = self._owned(session_id)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM analyses WHERE 1{owned.format(column='key')}", params).fetchone()[0]
+
+    def _owned(self, session_id):
+        if session_id is None:
+            return "", []
+        return " AND {column} IN (SELECT analysis_key FROM analysis_owners WHERE session_id = ?)", [session_id]
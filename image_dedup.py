@@ -0,0 +1,101 @@
+import hashlib
+from collections import OrderedDict
+
+from image_preprocess import open_image
+from instrumentation import metrics
+
+# Max Hamming distance between perceptual hashes for two images to count as near-duplicates
+DEFAULT_PERCEPTUAL_THRESHOLD = 6
+
+
+# Fast digest of the compressed upload bytes (no pixel decode); accepts bytes or memoryview
+def fast_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# Difference hash (dHash): survives re-encoding, resizing and small brightness changes
+def perceptual_hash(data, hash_size=8):
+    from PIL import Image
+
+    image = open_image(data)
+    # JPEG draft mode decodes straight to a reduced size instead of the full-resolution image
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    image = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+# Stable identity for an upload across Streamlit reruns
+def upload_key(upload):
+    file_id = getattr(upload, "file_id", None)
+    if file_id:
+        return file_id
+    return (upload.name, upload.size)
+
+
+# Read upload bytes without an extra copy when the object supports it
+def upload_bytes(upload):
+    if hasattr(upload, "getbuffer"):
+        return upload.getbuffer()
+    return upload.getvalue()
+
+
+# Memoizes fingerprints per upload so reruns don't re-hash unchanged files
+class UploadDeduper:
+    def __init__(self, perceptual_threshold=DEFAULT_PERCEPTUAL_THRESHOLD, max_entries=512):
+        self.perceptual_threshold = perceptual_threshold
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+
+    # Return {"digest", "phash"} for an upload, computing only what is missing
+    def fingerprint(self, upload, perceptual=False):
+        key = upload_key(upload)
+        fingerprint = self._memo.get(key)
+        if fingerprint is None or (perceptual and fingerprint["phash"] is None):
+            data = upload_bytes(upload)
+            try:
+                if fingerprint is None:
+                    with metrics.timer("hash_image"):
+                        fingerprint = {"digest": fast_digest(data), "phash": None}
+                if perceptual:
+                    with metrics.timer("perceptual_hash"):
+                        fingerprint["phash"] = perceptual_hash(data)
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+            self._memo[key] = fingerprint
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        else:
+            self._memo.move_to_end(key)
+        return fingerprint
+
+    # Group uploads into unique images: returns [(digest, primary_upload, [duplicate_uploads])]
+    def group(self, uploads, perceptual=False):
+        groups = []
+        by_digest = {}
+        for upload in uploads:
+            fingerprint = self.fingerprint(upload, perceptual)
+            match = by_digest.get(fingerprint["digest"])
+            if match is None and perceptual:
+                for group in groups:
+                    if hamming_distance(group["phash"], fingerprint["phash"]) <= self.perceptual_threshold:
+                        match = group
+                        break
+            if match is None:
+                match = {"digest": fingerprint["digest"], "phash": fingerprint["phash"], "primary": upload, "duplicates": []}
+                groups.append(match)
+            else:
+                match["duplicates"].append(upload)
+            by_digest[fingerprint["digest"]] = match
+        return [(group["digest"], group["primary"], group["duplicates"]) for group in groups]
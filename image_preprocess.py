@@ -0,0 +1,225 @@
+import io
+import threading
+from collections import OrderedDict
+
+from instrumentation import metrics
+
+# Gemini tiles images internally at ~768px, so edges beyond this mostly add upload time and tokens
+DEFAULT_MAX_EDGE = 1536
+DEFAULT_QUALITY = 85
+DEFAULT_FORMAT = "JPEG"
+
+# Gallery previews are displayed at 150px; 256px keeps them sharp on high-DPI screens
+THUMBNAIL_EDGE = 256
+THUMBNAIL_QUALITY = 75
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 16-bit and float modes, e.g. 12/16-bit radiographs saved as PNG or TIFF
+HIGH_BIT_DEPTH_MODES = ("I", "I;16", "I;16B", "I;16L", "I;16N", "F")
+
+# Magic-byte signatures, checked before falling back to Pillow
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+
+# Read-only file object over a bytes-like buffer. io.BytesIO copies a memoryview (e.g. of a memory-mapped
+# upload) before reading it; this reads straight from the buffer.
+class BufferReader(io.RawIOBase):
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        memoryview(buffer).cast("B")[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+# Open image bytes or a memoryview with Pillow without copying the compressed data
+def open_image(data):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(data) if isinstance(data, bytes) else BufferReader(data))
+
+
+# Stretch 16-bit and float images to the full 8-bit grayscale range. convert("RGB") or convert("L") would
+# clip every value above 255, turning a 12-bit radiograph into a white square. Other modes are returned as is.
+def stretch_to_8bit(image):
+    if image.mode not in HIGH_BIT_DEPTH_MODES:
+        return image
+    image = image.convert("F")
+    low, high = image.getextrema()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return image.point(lambda value: (value - low) * scale).convert("L")
+
+
+# Detect the real MIME type of image bytes instead of trusting the file extension
+def detect_mime_type(data):
+    head = bytes(data[:16])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    from PIL import Image
+
+    image = open_image(data)
+    return Image.MIME.get(image.format, "application/octet-stream")
+
+
+# Downscale to max_edge and re-encode compactly. Returns (bytes, mime_type, info).
+# The original bytes are kept when they are already small enough and re-encoding would not help.
+def preprocess_image(data, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY, output_format=DEFAULT_FORMAT):
+    with metrics.timer("image_preprocess"):
+        return _preprocess_image(data, max_edge, quality, output_format)
+
+
+def _preprocess_image(data, max_edge, quality, output_format):
+    from PIL import Image, ImageOps
+
+    original_mime = detect_mime_type(data)
+    image = open_image(data)
+    original_size = image.size
+
+    if max_edge:
+        # JPEG draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale directly
+        image.draft("RGB", (max_edge, max_edge))
+    image = stretch_to_8bit(ImageOps.exif_transpose(image))
+    if max_edge and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    if output_format == "JPEG":
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+    elif output_format == "WEBP" and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+
+    buffer = io.BytesIO()
+    save_options = {"optimize": True}
+    if output_format in ("JPEG", "WEBP"):
+        save_options["quality"] = quality
+    image.save(buffer, format=output_format, **save_options)
+    processed = buffer.getvalue()
+
+    info = {
+        "original_bytes": len(data),
+        "original_size": original_size,
+        "original_mime_type": original_mime,
+        "size": image.size,
+    }
+    if original_size == image.size and original_mime in OUTPUT_MIME_TYPES.values() and len(processed) >= len(data):
+        info["bytes"] = len(data)
+        return bytes(data), original_mime, info
+    info["bytes"] = len(processed)
+    return processed, OUTPUT_MIME_TYPES[output_format], info
+
+
+# Small JPEG preview of an image (tiny images are passed through unchanged)
+def make_thumbnail(data, max_edge=THUMBNAIL_EDGE, quality=THUMBNAIL_QUALITY):
+    with metrics.timer("thumbnail"):
+        return _preprocess_image(data, max_edge, quality, "JPEG")[0]
+
+
+# Bounded LRU of preprocessed payloads keyed on image digest and settings
+class PreprocessedImageCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY, output_format=DEFAULT_FORMAT):
+        self.max_bytes = max_bytes
+        self.max_edge = max_edge
+        self.quality = quality
+        self.output_format = output_format
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    # Settings that change what the model sees (part of the analysis cache key)
+    def settings(self):
+        return {"max_edge": self.max_edge, "quality": self.quality, "format": self.output_format}
+
+    # Return (bytes, mime_type, info) for an image, preprocessing it at most once per digest
+    def get(self, image_digest, data):
+        key = (image_digest, self.max_edge, self.quality, self.output_format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = preprocess_image(data, self.max_edge, self.quality, self.output_format)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._total_bytes += len(entry[0])
+                while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= len(evicted[0])
+        return entry
+
+
+# Bounded LRU of thumbnails keyed on image digest. `load` is only called on a miss, so cached
+# previews never touch the full-resolution bytes.
+class ThumbnailCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_edge=THUMBNAIL_EDGE):
+        self.max_bytes = max_bytes
+        self.max_edge = max_edge
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, image_digest, load):
+        with self._lock:
+            thumbnail = self._entries.get(image_digest)
+            if thumbnail is not None:
+                self._entries.move_to_end(image_digest)
+                self.hits += 1
+                return thumbnail
+            self.misses += 1
+
+        thumbnail = make_thumbnail(load(), self.max_edge)
+
+        with self._lock:
+            if image_digest not in self._entries:
+                self._entries[image_digest] = thumbnail
+                self._total_bytes += len(thumbnail)
+                while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= len(evicted)
+        return thumbnail
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._total_bytes}
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# USD per million tokens, used for the cost estimate (defaults: gemini-1.5-pro, prompts up to 128k tokens)
+INPUT_COST_PER_MTOK = float(os.getenv("MEDIGEN_INPUT_COST_PER_MTOK", "1.25"))
+OUTPUT_COST_PER_MTOK = float(os.getenv("MEDIGEN_OUTPUT_COST_PER_MTOK", "5.00"))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Process-wide timings, token usage and cost. Keeps the most recent samples per operation for
+# percentiles, running totals for counters, and optionally appends every event to a JSONL trace file.
+class Metrics:
+    def __init__(self, max_samples=5000, trace_path=None):
+        self.trace_path = trace_path
+        self._durations = defaultdict(lambda: deque(maxlen=max_samples))
+        self._first_tokens = defaultdict(lambda: deque(maxlen=max_samples))
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    # Expose a current value (queue depth, busy workers, ...) as a Prometheus gauge; read() is called per scrape
+    def register_gauge(self, name, help_text, read):
+        with self._lock:
+            self._gauges[name] = (help_text, read)
+
+    # Record one completed operation
+    def observe(self, name, seconds, first_token_seconds=None, input_tokens=None, output_tokens=None, error=None, **attributes):
+        with self._lock:
+            self._durations[name].append(seconds)
+            totals = self._totals[name]
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            if error:
+                totals["errors"] += 1
+            if first_token_seconds is not None:
+                self._first_tokens[name].append(first_token_seconds)
+            if input_tokens:
+                totals["input_tokens"] += input_tokens
+                totals["cost_usd"] += input_tokens * INPUT_COST_PER_MTOK / 1e6
+            if output_tokens:
+                totals["output_tokens"] += output_tokens
+                totals["cost_usd"] += output_tokens * OUTPUT_COST_PER_MTOK / 1e6
+        if self.trace_path:
+            event = {"ts": time.time(), "name": name, "seconds": round(seconds, 6)}
+            for key, value in (("first_token_seconds", first_token_seconds), ("input_tokens", input_tokens),
+                               ("output_tokens", output_tokens), ("error", error)):
+                if value is not None:
+                    event[key] = value
+            event.update(attributes)
+            self._write_trace(event)
+
+    def _write_trace(self, event):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            with open(self.trace_path, "a", encoding="utf-8") as trace:
+                trace.write(line)
+
+    # Time a block: `with metrics.timer("generate_pdf"):`. Exceptions are recorded and re-raised.
+    @contextmanager
+    def timer(self, name, **attributes):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.observe(name, time.perf_counter() - started, error=type(e).__name__, **attributes)
+            raise
+        self.observe(name, time.perf_counter() - started, **attributes)
+
+    # Record a model call from its latency figures and the API's usage_metadata
+    def observe_model_call(self, name, seconds, usage=None, first_token_seconds=None, **attributes):
+        self.observe(
+            name,
+            seconds,
+            first_token_seconds=first_token_seconds,
+            input_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            **attributes,
+        )
+
+    # Per-operation p50/p95 latency, time-to-first-token and token/cost totals
+    def summary(self):
+        with self._lock:
+            rows = []
+            for name in sorted(self._totals):
+                durations = list(self._durations[name])
+                first_tokens = list(self._first_tokens[name])
+                totals = self._totals[name]
+                rows.append({
+                    "operation": name,
+                    "count": int(totals["count"]),
+                    "errors": int(totals["errors"]),
+                    "p50_ms": round(percentile(durations, 0.5) * 1000, 1),
+                    "p95_ms": round(percentile(durations, 0.95) * 1000, 1),
+                    "ttft_p50_ms": round(percentile(first_tokens, 0.5) * 1000, 1) if first_tokens else None,
+                    "ttft_p95_ms": round(percentile(first_tokens, 0.95) * 1000, 1) if first_tokens else None,
+                    "input_tokens": int(totals["input_tokens"]),
+                    "output_tokens": int(totals["output_tokens"]),
+                    "cost_usd": round(totals["cost_usd"], 4),
+                })
+            return rows
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        lines = [
+            "# HELP medigen_operation_seconds Latency of instrumented operations.",
+            "# TYPE medigen_operation_seconds summary",
+        ]
+        with self._lock:
+            names = sorted(self._totals)
+            snapshot = {name: (list(self._durations[name]), dict(self._totals[name])) for name in names}
+            gauges = sorted(self._gauges.items())
+        for name, (durations, totals) in snapshot.items():
+            for quantile in (0.5, 0.95, 0.99):
+                lines.append(f'medigen_operation_seconds{{operation="{name}",quantile="{quantile}"}} {percentile(durations, quantile):.6f}')
+            lines.append(f'medigen_operation_seconds_sum{{operation="{name}"}} {totals.get("seconds", 0.0):.6f}')
+            lines.append(f'medigen_operation_seconds_count{{operation="{name}"}} {int(totals.get("count", 0))}')
+        for metric, key, help_text in (
+            ("medigen_operation_errors_total", "errors", "Failed instrumented operations."),
+            ("medigen_input_tokens_total", "input_tokens", "Prompt tokens sent to the model."),
+            ("medigen_output_tokens_total", "output_tokens", "Tokens generated by the model."),
+            ("medigen_cost_usd_total", "cost_usd", "Estimated model cost in USD."),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, (_, totals) in snapshot.items():
+                lines.append(f'{metric}{{operation="{name}"}} {totals.get(key, 0)}')
+        for metric, (help_text, read) in gauges:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {read()}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._first_tokens.clear()
+            self._totals.clear()
+
+
+# Shared instance used by every module (trace file from MEDIGEN_TRACE_FILE)
+metrics = Metrics(trace_path=os.getenv("MEDIGEN_TRACE_FILE"))
+
+
+# Serve /metrics for a Prometheus scraper on a background thread
+def start_metrics_server(port, registry=metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+from instrumentation import metrics
+from request_scheduler import INTERACTIVE
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+# One unit of background work. The job function receives the Job and may update `progress` (done, total),
+# `partial` (text streamed so far) and `message` while it runs; its return value becomes `result`.
+class Job:
+    def __init__(self, fn, session_id, kind, title, priority, key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.fn = fn
+        self.key = key
+        self.session_id = session_id
+        self.kind = kind
+        self.title = title
+        self.priority = priority
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = None
+        self.partial = ""
+        self.message = None
+        self.result = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+
+# Process-wide queue of analysis jobs run by a fixed pool of worker threads, independent of any Streamlit
+# script run: a rerun, a page switch or a closed tab does not stop a job, and the job itself writes its
+# result to the session history. Jobs are kept by id (and listed per session) until `retention_seconds`
+# after they finish, so the UI can poll them.
+class JobQueue:
+    def __init__(self, max_workers=4, retention_seconds=3600, max_finished=1000):
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+        self._condition = threading.Condition()
+        for index in range(max_workers):
+            threading.Thread(target=self._worker, name=f"analysis-job-{index}", daemon=True).start()
+
+    # Queue fn(job) and return the new job's id. While a job with the same `key` is queued or running for
+    # the session, submitting again returns that job's id instead (e.g. a double-clicked button).
+    def submit(self, fn, session_id, kind, title, priority=INTERACTIVE, key=None):
+        job = Job(fn, session_id, kind, title, priority, key)
+        with self._condition:
+            if key is not None:
+                for existing in self._jobs.values():
+                    if existing.key == key and existing.session_id == session_id and not existing.finished:
+                        return existing.id
+            self._prune()
+            self._jobs[job.id] = job
+            self._counts["submitted"] += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            self._condition.notify()
+        return job.id
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    # A session's jobs, oldest first
+    def list_jobs(self, session_id, active_only=False):
+        with self._condition:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id and not (active_only and job.finished)]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    # Cancel a job that has not started yet; returns True if it was cancelled
+    def cancel(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            job.fn = None
+            self._counts["cancelled"] += 1
+            return True
+
+    # Forget a finished job (e.g. once the user has dismissed it)
+    def forget(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished:
+                del self._jobs[job_id]
+
+    def queue_depth(self):
+        with self._condition:
+            return sum(1 for _, _, job in self._queue if job.status == QUEUED)
+
+    # Queue depth, busy workers and utilisation (now, and averaged since the queue started)
+    def stats(self):
+        with self._condition:
+            busy_seconds = self._busy_seconds + sum(
+                time.time() - job.started_at for job in self._jobs.values() if job.status == RUNNING
+            )
+            uptime = time.monotonic() - self._started_at
+            return dict(
+                self._counts,
+                queued=sum(1 for _, _, job in self._queue if job.status == QUEUED),
+                running=self._running,
+                workers=self.max_workers,
+                utilisation=self._running / self.max_workers,
+                average_utilisation=busy_seconds / (self.max_workers * uptime) if uptime else 0.0,
+            )
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, job = heapq.heappop(self._queue)
+                if job.status != QUEUED:
+                    continue  # cancelled while waiting
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+            metrics.observe("job.wait", job.started_at - job.created_at, kind=job.kind)
+            try:
+                job.result = job.fn(job)
+                status = DONE
+            except Exception as e:
+                job.error = e
+                status = FAILED
+            with self._condition:
+                job.finished_at = time.time()
+                job.status = status
+                job.fn = None  # release captured upload bytes
+                self._running -= 1
+                self._busy_seconds += job.finished_at - job.started_at
+                self._counts["completed" if status == DONE else "failed"] += 1
+            metrics.observe("job.run", job.finished_at - job.started_at, kind=job.kind, error=type(job.error).__name__ if job.error else None)
+
+    # Drop finished jobs past their retention time, and the oldest ones beyond max_finished
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+        cutoff = time.time() - self.retention_seconds
+        excess = len(finished) - self.max_finished
+        for index, job in enumerate(finished):
+            if index < excess or job.finished_at < cutoff:
+                del self._jobs[job.id]
@@ -0,0 +1,328 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+
+from batch_analysis import run_bounded
+from image_preprocess import DEFAULT_MAX_EDGE, DEFAULT_QUALITY, open_image, stretch_to_8bit
+from instrumentation import metrics
+from request_scheduler import INTERACTIVE
+from triage import ImageRejected
+
+
+LARGE_IMAGE_EXTENSIONS = {".dcm", ".dicom", ".tif", ".tiff"}
+
+# How much of one input is sent to the model
+MAX_FRAMES = int(os.getenv("MEDIGEN_MAX_FRAMES", "8"))
+MAX_TILES = int(os.getenv("MEDIGEN_MAX_TILES", "16"))
+# Single images with an edge longer than this are split into tiles instead of being downscaled
+TILE_THRESHOLD = int(os.getenv("MEDIGEN_TILE_THRESHOLD", "4096"))
+TILE_OVERLAP = 64
+# Largest bitmap the Pillow fallback will decode at once (pyvips streams and is not limited)
+MAX_DECODE_PIXELS = int(os.getenv("MEDIGEN_MAX_DECODE_MEGAPIXELS", "150")) * 1000 * 1000
+
+_TIFF_SIGNATURES = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+# Optional readers: pydicom for DICOM, pyvips to stream huge TIFF/JPEG/PNG files region by region. Both are
+# imported on first use, so pages that never open a large image do not pay for them at startup.
+@lru_cache(maxsize=None)
+def load_pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        return None
+    return pydicom
+
+
+@lru_cache(maxsize=None)
+def load_pyvips():
+    try:
+        import pyvips
+    except (ImportError, OSError):  # OSError: the binding is installed but libvips is not
+        return None
+    return pyvips
+
+
+# "dicom", "tiff" or "image" from the first bytes of a file (DICOM has "DICM" after a 128-byte preamble)
+def sniff_format(head):
+    if head[128:132] == b"DICM":
+        return "dicom"
+    if head[:4] in _TIFF_SIGNATURES:
+        return "tiff"
+    return "image"
+
+
+# Longest edge of an image, read from its header (Image.open decodes no pixels). 0 if Pillow cannot read it;
+# images too large for Pillow's decompression-bomb check are certainly over any tile threshold.
+def header_edge(source):
+    from PIL import Image
+
+    try:
+        with Image.open(source) if isinstance(source, str) else open_image(source) as image:
+            return max(image.size)
+    except Image.DecompressionBombError:
+        return float("inf")
+    except Exception:
+        return 0
+
+
+# Whether an upload goes to frame-by-frame or tiled analysis: DICOM and TIFF files, and any other image
+# whose longest edge is over TILE_THRESHOLD. `source` is a file path or the upload's bytes/memoryview.
+def is_large_format(name, source):
+    head = _read_head(source)
+    if os.path.splitext(name)[1].lower() in LARGE_IMAGE_EXTENSIONS or sniff_format(head) != "image":
+        return True
+    return header_edge(source) > TILE_THRESHOLD
+
+
+def _read_head(source, size=132):
+    if isinstance(source, str):
+        with open(source, "rb") as image_file:
+            return image_file.read(size)
+    return bytes(source[:size])
+
+
+# Memory-map a file read-only; readers page it in on demand instead of copying it into the heap
+@contextmanager
+def mapped_file(path):
+    with open(path, "rb") as source:
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+# Evenly spaced frame indices, always including the first and last frame
+def representative_indices(count, max_frames=MAX_FRAMES):
+    if count <= max_frames:
+        return list(range(count))
+    if max_frames <= 1:
+        return [count // 2]
+    step = (count - 1) / (max_frames - 1)
+    return sorted({round(i * step) for i in range(max_frames)})
+
+
+# Tile rectangles (left, top, width, height) covering the image, neighbours overlapping by `overlap` pixels
+def tile_grid(width, height, tile_edge, overlap=TILE_OVERLAP):
+    step = tile_edge - overlap
+    for top in range(0, max(1, height - overlap), step):
+        for left in range(0, max(1, width - overlap), step):
+            yield left, top, min(tile_edge, width - left), min(tile_edge, height - top)
+
+
+# Smallest integer downscale factor that keeps the tile grid within max_tiles
+def tile_scale(width, height, tile_edge, max_tiles, overlap=TILE_OVERLAP):
+    scale = 1
+    while sum(1 for _ in tile_grid(width // scale, height // scale, tile_edge, overlap)) > max_tiles:
+        scale += 1
+    return scale
+
+
+# Read the header only: {"format", "frames", "size", "photometric"}
+def probe(path):
+    with open(path, "rb") as source:
+        file_format = sniff_format(source.read(132))
+    pydicom, pyvips = load_pydicom(), load_pyvips()
+    if file_format == "dicom":
+        if pydicom is None:
+            raise RuntimeError("Reading DICOM files needs the 'pydicom' package (pip install pydicom numpy)")
+        dataset = pydicom.dcmread(path, stop_before_pixels=True)
+        return {
+            "format": "dicom",
+            "frames": int(getattr(dataset, "NumberOfFrames", 1) or 1),
+            "size": (int(getattr(dataset, "Columns", 0)), int(getattr(dataset, "Rows", 0))),
+            "photometric": str(getattr(dataset, "PhotometricInterpretation", "")),
+        }
+    if pyvips is not None:
+        image = pyvips.Image.new_from_file(path)
+        frames = image.get("n-pages") if "n-pages" in image.get_fields() else 1
+        return {"format": file_format, "frames": frames, "size": (image.width, image.height), "photometric": None}
+
+    from PIL import Image
+
+    with mapped_file(path) as mapped:
+        image = Image.open(mapped)
+        return {"format": file_format, "frames": getattr(image, "n_frames", 1), "size": image.size, "photometric": None}
+
+
+# Decide how an input is split: every representative frame, a tile grid, or the whole image
+def plan(path, max_frames=MAX_FRAMES, max_tiles=MAX_TILES, tile_threshold=TILE_THRESHOLD, tile_edge=DEFAULT_MAX_EDGE):
+    info = probe(path)
+    if info["frames"] > 1:
+        info.update(mode="frames", indices=representative_indices(info["frames"], max_frames))
+        info["parts"] = len(info["indices"])
+    elif info["format"] != "dicom" and max(info["size"]) > tile_threshold:
+        scale = tile_scale(info["size"][0], info["size"][1], tile_edge, max_tiles)
+        info.update(mode="tiles", scale=scale, tile_edge=tile_edge)
+        info["parts"] = sum(1 for _ in tile_grid(info["size"][0] // scale, info["size"][1] // scale, tile_edge))
+    else:
+        info.update(mode="frames", indices=[0], parts=1)
+    return info
+
+
+def _encode(image, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY):
+    from PIL import Image
+
+    image = stretch_to_8bit(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _encode_vips(image, quality=DEFAULT_QUALITY):
+    if image.format != "uchar":
+        image = image.scaleimage()
+    return image.write_to_buffer(".jpg", Q=quality)
+
+
+def _array_to_image(array, invert=False):
+    import numpy as np
+    from PIL import Image
+
+    array = np.asarray(array, dtype=np.float32)
+    low, high = float(array.min()), float(array.max())
+    scaled = (array - low) * (255.0 / (high - low)) if high > low else np.zeros_like(array)
+    if invert:
+        scaled = 255.0 - scaled  # MONOCHROME1 stores bright as low values
+    return Image.fromarray(scaled.astype(np.uint8))
+
+
+def _check_decode_budget(image, max_edge):
+    if image.format == "JPEG":
+        image.draft("RGB", (max_edge, max_edge))
+    width, height = image.size
+    if width * height > MAX_DECODE_PIXELS:
+        raise ValueError(
+            f"{width}x{height} image exceeds the decode budget (MEDIGEN_MAX_DECODE_MEGAPIXELS); "
+            "install pyvips to stream it"
+        )
+
+
+def _iter_dicom_frames(path, info, max_edge):
+    invert = info["photometric"] == "MONOCHROME1"
+    pydicom = load_pydicom()
+    try:
+        from pydicom.pixels import iter_pixels  # pydicom 3: decodes one frame at a time
+    except ImportError:
+        iter_pixels = None
+    if iter_pixels is not None:
+        frames = zip(info["indices"], iter_pixels(path, indices=info["indices"]))
+    else:
+        pixels = pydicom.dcmread(path).pixel_array  # older pydicom decodes the whole series
+        frames = ((index, pixels[index] if info["frames"] > 1 else pixels) for index in info["indices"])
+    for index, array in frames:
+        yield _frame_label(info, index), _encode(_array_to_image(array, invert), max_edge)
+
+
+def _iter_image_frames(path, info, max_edge):
+    pyvips = load_pyvips()
+    if pyvips is not None:
+        for index in info["indices"]:
+            options = f"page={index}" if info["frames"] > 1 else ""
+            yield _frame_label(info, index), _encode_vips(pyvips.Image.thumbnail(path, max_edge, height=max_edge, option_string=options))
+        return
+
+    from PIL import Image
+
+    with mapped_file(path) as mapped:
+        image = Image.open(mapped)
+        for index in info["indices"]:
+            image.seek(index)
+            _check_decode_budget(image, max_edge)
+            yield _frame_label(info, index), _encode(image, max_edge)
+
+
+def _frame_label(info, index):
+    return f"Frame {index + 1} of {info['frames']}" if info["frames"] > 1 else "Whole image"
+
+
+def _iter_tiles(path, info, quality=DEFAULT_QUALITY):
+    scale, tile_edge = info["scale"], info["tile_edge"]
+    width, height = info["size"][0] // scale, info["size"][1] // scale
+    grid = list(tile_grid(width, height, tile_edge))
+    pyvips = load_pyvips()
+    if pyvips is not None:
+        # Random access: tiled TIFFs only decode the regions that are cropped
+        image = pyvips.Image.new_from_file(path)
+        if scale > 1:
+            image = image.resize(width / image.width, vscale=height / image.height)
+        for left, top, tile_width, tile_height in grid:
+            tile = image.crop(left, top, min(tile_width, image.width - left), min(tile_height, image.height - top))
+            yield _tile_label(left, top, scale), _encode_vips(tile, quality)
+        return
+
+    from PIL import Image
+
+    with mapped_file(path) as mapped:
+        image = Image.open(mapped)
+        _check_decode_budget(image, max(width, height))
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.Resampling.BOX)
+        for left, top, tile_width, tile_height in grid:
+            tile = image.crop((left, top, left + tile_width, top + tile_height))
+            yield _tile_label(left, top, scale), _encode(tile, tile_edge, quality)
+
+
+def _tile_label(left, top, scale):
+    return f"Tile at x={left * scale}, y={top * scale}"
+
+
+# Lazily yield (index, label, jpeg_bytes) for every part of a plan. Only one decoded frame or tile
+# (or, for the Pillow tile fallback, one bitmap within MAX_DECODE_PIXELS) is held at a time.
+def iter_parts(path, info, max_edge=DEFAULT_MAX_EDGE):
+    if info["mode"] == "tiles":
+        parts = _iter_tiles(path, info)
+    elif info["format"] == "dicom":
+        parts = _iter_dicom_frames(path, info, max_edge)
+    else:
+        parts = _iter_image_frames(path, info, max_edge)
+    for index, (label, data) in enumerate(parts):
+        yield index, label, data
+
+
+# Analyze a DICOM series, multi-page TIFF or very large scan. Parts are extracted one at a time, at most
+# max_workers are analyzed concurrently (each cached like a regular upload), and the part reports are
+# merged into one. Parts only get the local triage checks, so blank or blurry tiles are skipped without a
+# model call. Returns {"report", "parts": [(label, text)], "failed": [(label, error)], "skipped": [(label, reason)],
+# "preview", "plan"}. on_progress(done, total) is called after each part.
+def analyze_large_image(pipeline, path, title, priority=INTERACTIVE, max_workers=4, on_progress=None, prompt=None):
+    info = plan(path)
+    preview = None
+    results, failed, skipped = {}, [], []
+
+    def analyze_part(part):
+        _, label, data = part
+        return pipeline.analyze(pipeline.digest(data), data, priority, image_name=f"{title} ({label})", prompt=prompt, triage="local")[0]
+
+    with metrics.timer("large_image", mode=info["mode"], parts=info["parts"]):
+        parts = iter_parts(path, info)
+        for done, ((index, label, data), text, error) in enumerate(
+            run_bounded(parts, analyze_part, max_workers=max_workers, max_pending=max_workers), start=1
+        ):
+            if index == 0:
+                preview = data
+            if isinstance(error, ImageRejected):
+                skipped.append((label, error.verdict.reason))
+            elif error or not text:
+                failed.append((label, str(error) if error else "empty response from model"))
+            else:
+                results[index] = (label, text)
+            if on_progress:
+                on_progress(done, info["parts"])
+
+        part_reports = [results[index] for index in sorted(results)]
+        if not part_reports:
+            reasons = failed or skipped
+            raise RuntimeError(f"No part of {title} could be analyzed: {reasons[0][1] if reasons else 'no frames found'}")
+        if len(part_reports) == 1:
+            report = part_reports[0][1]
+        else:
+            kind = "tiles" if info["mode"] == "tiles" else "frames"
+            report = pipeline.merge_reports(title, part_reports, kind=kind, priority=priority)
+            if not report:
+                report = "\n\n".join(f"## {label}\n\n{text}" for label, text in part_reports)
+    return {"report": report, "parts": part_reports, "failed": failed, "skipped": skipped, "preview": preview, "plan": info}
@@ -1,15 +1,30 @@
 import streamlit as st
-from PIL import Image
-from google.cloud import aiplatform
 from api_key import api_key
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
+from streaming import start_stream
+from image_preprocess import preprocess_image
+from model_clients import create_model_registry
+from request_scheduler import RequestScheduler
+from prompt_registry import default_registry
 
 # Load environment variables
 load_dotenv()
 google_api_key = os.getenv("GOOGLE_API_KEY")
-aiplatform.init(project="medical", location="us-central1")
+
+# Model clients are created (and google.generativeai imported) on the first analysis, once per process
+@st.cache_resource
+def get_model_registry(google_api_key):
+    return create_model_registry(google_api_key)
+
+model_registry = get_model_registry(google_api_key)
+
+# Shared rate limiter/retry queue in front of every model call on this server
+@st.cache_resource
+def get_scheduler():
+    return RequestScheduler(requests_per_minute=int(os.getenv("MEDIGEN_REQUESTS_PER_MINUTE", "60")))
+
+scheduler = get_scheduler()
 
 # Set up the model
 generation_config = {
@@ -26,48 +41,9 @@ safety_settings = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
-# System prompts
-system_prompts = """
-As a highly skilled medical practitioner specializing in image analysis, you are tasked with examining medical images for a renowned hospital. Your expertise is crucial in identifying any anomalies, diseases, or health issues that may be present in the image.
-
-Your Responsibilities include:
-
-1. Detailed Analysis: Thoroughly analyze each image, focusing on identifying any abnormal findings.
-2. Findings Report: Document all observed anomalies or signs of disease. Clearly articulate these findings in a structured form.
-3. Recommendation and Next Steps: Based on your analysis, suggest potential next steps, including further tests or treatments as applicable.
-4. Treatment Suggestions: If appropriate, recommend possible treatment options or interventions.
-
-Important Notes:
-1. Scope of Response: Only respond if the image pertains to human health issues.
-2. Clarity of Image: In cases where the image quality impedes clear analysis, note that certain aspects are 'Unable to be determined based on the provided image.'
-3. Disclaimer: Accompany your analysis with the disclaimer "Consult with a Doctor before making any decisions."
-4. Your insights are invaluable in guiding clinical decisions. Please proceed with the analysis, adhering to the structured approach outlined above.
-
-Please provide me an output response with these 4 headings Detailed Analysis,Findings Report,Recommendation and Next Steps,Treatment Suggestions
-"""
-
-# system_prompts = """
-# As a highly skilled medical practitioner specializing in image analysis, you are tasked with examining medical images for a renowned hospital. Your expertise is crucial in identifying any anomalies, diseases, or health issues present in these images.
-
-# Your Responsibilities include:
-
-# 1. Detailed Analysis:Thoroughly analyze each image.
-#                      Focus on identifying any abnormal findings.
-# 2. Findings Report: Document all observed anomalies or signs of disease.
-#                     Clearly articulate these findings in a structured form.
-# 3. Recommendations and Next Steps:Based on your analysis, suggest potential next steps.
-#                         Include recommendations for further tests or treatments as applicable.
-# 4. Treatment Suggestions: If appropriate, recommend possible treatment options or interventions.
-
-# Important Notes:
-
-# 1. Scope of Response: Only respond if the image pertains to human health issues.
-# 2. Clarity of Image: If the image quality impedes clear analysis, note that certain aspects are "Unable to be determined based on the provided image"
-# 3. Disclaimer:
-
-# Accompany your analysis with the disclaimer: "Consult with a doctor before making any decisions."
-# Your insights are invaluable in guiding clinical decisions. Please proceed with the analysis, adhering to the structured approach outlined above.
-# """
+# Analysis prompt from the shared registry, pinned to the original four-heading version.
+# The instructions are sent as the model's system instruction; only a short request goes with the image.
+prompt_template = default_registry().get("general", version=1)
 
 # Create a unique interface
 st.set_page_config(page_title="MediGen Catalyst", page_icon=":microscope:")
@@ -81,6 +57,8 @@ st.subheader("An application that helps analyze medical images")
 uploaded_file = st.file_uploader("Upload a medical image for analysis", type=["png", "jpg", "jpeg"])
 
 if uploaded_file:
+    from PIL import Image
+
     # Display uploaded image
     image = Image.open(uploaded_file)
     st.image(image, width=300, caption="Uploaded Medical Image")
@@ -91,23 +69,25 @@ if uploaded_file:
         progress_bar = st.progress(0)
         progress_text = st.empty()
 
-        # Prepare image data
-        image_data = uploaded_file.getvalue()
-        image_parts = [{"mime_type": "image/jpeg", "data": image_data}]
+        # Prepare image data: detect the real format and downscale before upload
+        image_data, mime_type, _ = preprocess_image(uploaded_file.getvalue())
+        image_parts = [{"mime_type": mime_type, "data": image_data}]
 
         # Generate analysis
-        prompt_parts = [image_parts[0], system_prompts]
-        model = genai.GenerativeModel(model_name="gemini-1.5-pro-latest", generation_config=generation_config,
-                                      safety_settings=safety_settings)
+        prompt_parts = [image_parts[0], prompt_template.request_text]
+        model = model_registry.get(
+            "gemini-1.5-pro-latest", generation_config, safety_settings, system_instruction=prompt_template.system_instruction
+        )
 
         with st.spinner("Analyzing..."):
-            response = model.generate_content(prompt_parts)
+            stream = start_stream(model.generate_content, prompt_parts, scheduler=scheduler, metric="model.analysis")
 
-        # Display analysis
-        if response:
+        # Display analysis as it streams in
+        st.title("Here is the analysis based on your image: ")
+        analysis_text = st.write_stream(stream)
+        if analysis_text:
             progress_bar.progress(100)
             progress_text.text("Analysis Complete!")
-            st.title("Here is the analysis based on your image: ")
-            st.write(response.text)
+            st.metric("Time to first token", f"{stream.first_token_seconds:.2f} s")
 else:
     st.warning("Please upload an image for analysis.")
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from batch_analysis import run_bounded
+from instrumentation import percentile
+from large_images import LARGE_IMAGE_EXTENSIONS, analyze_large_image, is_large_format, mapped_file
+from medigen_core import create_pipeline
+from triage import ImageRejected
+from request_scheduler import BATCH
+from pdf_reports import pdf_filename
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"} | LARGE_IMAGE_EXTENSIONS
+
+
+# Lazily yield image paths from directories (walked recursively) and manifest files
+# (.txt with one path per line, or .jsonl with a "path" field)
+def iter_inputs(inputs):
+    for source in inputs:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name)
+        elif source.endswith(".jsonl"):
+            with open(source, encoding="utf-8") as manifest:
+                for line in manifest:
+                    if line.strip():
+                        yield json.loads(line)["path"]
+        elif source.endswith(".txt"):
+            with open(source, encoding="utf-8") as manifest:
+                for line in manifest:
+                    if line.strip():
+                        yield line.strip()
+        else:
+            yield source
+
+
+# Read an existing results file so an interrupted run can resume where it stopped
+def load_checkpoint(output_path):
+    done_paths, done_digests = set(), set()
+    if not os.path.exists(output_path):
+        return done_paths, done_digests
+    with open(output_path, encoding="utf-8") as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # partial line from an interrupted write
+            # "skipped" means the digest was already done, so the next resume does not write it again
+            if record.get("status") in ("ok", "duplicate", "skipped", "rejected"):
+                done_paths.add(record["path"])
+            # A duplicate only says another path had the same bytes, not that they were analyzed: its
+            # primary may have failed or still been in flight when the run stopped
+            if record.get("status") in ("ok", "skipped", "rejected") and record.get("digest"):
+                done_digests.add(record["digest"])
+    return done_paths, done_digests
+
+
+class BatchRunner:
+    def __init__(self, pipeline, done_digests, pdf_dir=None, prompt=None):
+        self.pipeline = pipeline
+        self.done_digests = done_digests
+        self.pdf_dir = pdf_dir
+        self.prompt = prompt
+        self._claimed = {}
+        self._lock = threading.Lock()
+
+    # Runs on a worker thread: read, dedup, analyze and optionally render one image.
+    # DICOM, TIFF and other large inputs are hashed through a memory map and analyzed frame by frame
+    # or tile by tile instead of being read into memory.
+    def process(self, path):
+        started = time.perf_counter()
+        large = is_large_format(path, path)
+        if not large:
+            with open(path, "rb") as image_file:
+                image_data = image_file.read()
+        if large:
+            with mapped_file(path) as mapped:
+                digest = self.pipeline.digest(mapped)
+        else:
+            digest = self.pipeline.digest(image_data)
+        record = {"path": path, "digest": digest}
+
+        with self._lock:
+            if digest in self.done_digests:
+                return dict(record, status="skipped", reason="completed in a previous run")
+            if digest in self._claimed:
+                return dict(record, status="duplicate", duplicate_of=self._claimed[digest])
+            self._claimed[digest] = path
+
+        if large:
+            result = analyze_large_image(self.pipeline, path, os.path.basename(path), priority=BATCH, prompt=self.prompt)
+            analysis_text, from_cache = result["report"], False
+            record["parts"] = len(result["parts"])
+            if result["failed"]:
+                record["failed_parts"] = [label for label, _ in result["failed"]]
+            if result["skipped"]:
+                record["skipped_parts"] = [label for label, _ in result["skipped"]]
+            indexing = self.pipeline.index_analysis(digest, os.path.basename(path), analysis_text, prompt=self.prompt) if analysis_text else None
+            if indexing is not None and indexing.exception() is not None:
+                record["index_error"] = str(indexing.exception())
+        else:
+            try:
+                analysis_text, from_cache = self.pipeline.analyze(digest, image_data, priority=BATCH, image_name=os.path.basename(path), prompt=self.prompt)
+            except ImageRejected as e:
+                return dict(record, status="rejected", tier=e.verdict.tier, reason=e.verdict.reason)
+        if not analysis_text:
+            return dict(record, status="error", error="empty response from model")
+        record.update(status="ok", from_cache=from_cache, analysis=analysis_text)
+
+        if self.pdf_dir:
+            pdf_path = os.path.join(self.pdf_dir, f"{digest[:12]}_{pdf_filename(os.path.basename(path))}")
+            with open(pdf_path, "wb") as pdf_file:
+                pdf_file.write(self.pipeline.render_pdf(os.path.basename(path), analysis_text))
+            record["pdf"] = pdf_path
+
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of medical images without the UI")
+    parser.add_argument("inputs", nargs="+", help="image files, directories, or .txt/.jsonl manifests")
+    parser.add_argument("-o", "--output", default="medigen_results.jsonl", help="JSONL results file (also the checkpoint)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent model calls")
+    parser.add_argument("--pdf-dir", help="also write a PDF report per image into this directory")
+    parser.add_argument("--limit", type=int, help="stop after this many new images")
+    parser.add_argument("--prompt", default="general", help="prompt template: general, radiology or dermatology (optionally name@version)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    if not os.getenv("GOOGLE_API_KEY"):
+        parser.error("GOOGLE_API_KEY is not set (environment or .env file)")
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+
+    done_paths, done_digests = load_checkpoint(args.output)
+    if done_paths:
+        print(f"Resuming: {len(done_paths)} images already completed in {args.output}", file=sys.stderr)
+
+    paths = (path for path in iter_inputs(args.inputs) if path not in done_paths)
+    if args.limit:
+        paths = (path for _, path in zip(range(args.limit), paths))
+
+    runner = BatchRunner(create_pipeline(os.getenv("GOOGLE_API_KEY")), done_digests, args.pdf_dir, args.prompt)
+    counts = {"ok": 0, "cached": 0, "duplicate": 0, "skipped": 0, "rejected": 0, "error": 0}
+    latencies = []
+    started = time.perf_counter()
+
+    with open(args.output, "a", encoding="utf-8") as results:
+        for path, record, error in run_bounded(paths, runner.process, max_workers=args.workers):
+            if error:
+                record = {"path": path, "status": "error", "error": str(error)}
+            counts[record["status"]] += 1
+            if record.get("from_cache"):
+                counts["cached"] += 1
+            elif record["status"] == "ok":
+                latencies.append(record["seconds"])
+            results.write(json.dumps(record) + "\n")
+            results.flush()
+
+            processed = sum(counts[status] for status in ("ok", "duplicate", "skipped", "rejected", "error"))
+            if processed % 25 == 0:
+                print(f"  {processed} processed ({processed / (time.perf_counter() - started):.2f} images/s)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    processed = sum(counts[status] for status in ("ok", "duplicate", "skipped", "rejected", "error"))
+    print(f"\nProcessed {processed} images in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.2f} images/s)")
+    print(f"  analyzed: {counts['ok']} ({counts['cached']} from cache)  duplicates: {counts['duplicate']}  "
+          f"skipped: {counts['skipped']}  rejected by triage: {counts['rejected']}  errors: {counts['error']}")
+    if runner.pipeline.triage is not None:
+        triage_stats = runner.pipeline.triage.stats()
+        print(f"  triage: {triage_stats['checked']} screened, {triage_stats['model_checks']} flash-model checks, "
+              f"{triage_stats['pro_calls_avoided']:.0%} of analysis-model calls avoided")
+    if latencies:
+        print(f"  model latency p50 {statistics.median(latencies):.2f}s  p95 {percentile(latencies, 0.95):.2f}s")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
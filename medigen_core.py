@@ -0,0 +1,248 @@
+import os
+import time
+
+from analysis_cache import AnalysisCache, make_cache_key
+from findings import (
+    FindingsStore, analysis_schema, extraction_prompt, parse_structured_analysis, render_markdown, structured_instructions,
+)
+from image_dedup import fast_digest
+from image_preprocess import PreprocessedImageCache
+from instrumentation import metrics
+from model_clients import create_model_registry
+from pdf_reports import ReportRenderer
+from prompt_registry import default_registry, template_id
+from request_scheduler import BATCH, INTERACTIVE, RequestScheduler
+from streaming import start_stream
+from triage import ImageRejected, Triage
+from chat_engine import CONTEXT_CACHE_MODEL
+
+analysis_model_name = "gemini-1.5-pro-latest"
+# Cheaper model that turns an already written report into structured findings (no image involved)
+extraction_model_name = os.getenv("MEDIGEN_EXTRACTION_MODEL", "gemini-1.5-flash-latest")
+# Cheap model that screens colour uploads before they reach the analysis model
+triage_model_name = os.getenv("MEDIGEN_TRIAGE_MODEL", "gemini-1.5-flash-latest")
+
+generation_config = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 0,
+    "max_output_tokens": 8192,
+}
+
+# Same settings, but the model must answer with JSON matching analysis_schema
+structured_generation_config = dict(
+    generation_config, response_mime_type="application/json", response_schema=analysis_schema
+)
+
+safety_settings = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+# Analysis prompts (general, radiology, dermatology), versioned; "general" is the default
+prompts = default_registry(structured_instructions)
+
+# Put the system instruction in a Gemini context cache (needs a versioned model and a large enough prompt)
+use_prompt_context_cache = os.getenv("MEDIGEN_PROMPT_CONTEXT_CACHE", "0") == "1"
+
+# Prompt used to combine the reports of several frames or tiles of one study into a single report
+merge_prompt = """
+You are given {count} separate analyses of {kind} taken from the same medical study ("{title}").
+Each analysis only saw its own {kind_singular}. Combine them into one report for the whole study with the
+same headings (Detailed Analysis, Findings Report, Recommendation and Next Steps, Treatment Suggestions,
+medications and ointments, home-made remedies). Say which {kind} each finding comes from, merge repeated
+findings, point out disagreements between {kind}, and keep the disclaimer "Consult with a Doctor before
+making any decisions."
+"""
+
+
+# Everything needed to analyze images outside of Streamlit: warm model clients, the request scheduler,
+# the on-disk analysis cache, preprocessed payloads, the PDF renderer, the findings index and the triage
+# step that keeps out-of-scope images away from the analysis model. Safe to share between threads.
+class AnalysisPipeline:
+    def __init__(self, models, analysis_cache, preprocessed_images, report_renderer, scheduler, findings=None, prompts=prompts,
+                 triage=None):
+        self.prompts = prompts
+        self.triage = triage
+        self.models = models
+        self.analysis_cache = analysis_cache
+        self.preprocessed_images = preprocessed_images
+        self.report_renderer = report_renderer
+        self.scheduler = scheduler
+        self.findings = findings
+
+    @staticmethod
+    def digest(image_data):
+        return fast_digest(image_data)
+
+    # `prompt` is a template name ("radiology") or a pinned version ("general@1"); default is the latest general
+    def template(self, prompt=None):
+        name, _, version = (prompt or "general").partition("@")
+        return self.prompts.get(name, int(version) if version else None)
+
+    def cache_key(self, image_digest, prompt=None):
+        template = self.template(prompt)
+        request_config = {"generation": generation_config, "preprocess": self.preprocessed_images.settings()}
+        prompt_text = "\n".join((template_id(template), template.system_instruction, template.request_text))
+        return make_cache_key(image_digest, prompt_text, analysis_model_name, request_config)
+
+    # Cached report for an image, counted as a hit or miss for the template version
+    def cached_analysis(self, image_digest, prompt=None):
+        analysis_text = self.analysis_cache.get(self.cache_key(image_digest, prompt))
+        self.prompts.record(self.template(prompt), bool(analysis_text))
+        return analysis_text
+
+    def store_analysis(self, image_digest, analysis_text, prompt=None):
+        self.analysis_cache.put(self.cache_key(image_digest, prompt), analysis_text)
+
+    # Model for a template: the fixed instructions go in the system-instruction slot (or a context cache)
+    def analysis_model(self, prompt=None, structured=False):
+        template = self.template(prompt)
+        config = structured_generation_config if structured else generation_config
+        instruction = template.structured_system_instruction if structured else template.system_instruction
+        if use_prompt_context_cache:
+            return self.models.get_cached(CONTEXT_CACHE_MODEL, config, safety_settings, instruction)
+        return self.models.get(analysis_model_name, config, safety_settings, system_instruction=instruction)
+
+    # Model request for one image: the preprocessed payload and the template's short request text
+    def build_prompt(self, image_digest, image_data, prompt=None):
+        payload, mime_type, _ = self.preprocessed_images.get(image_digest, image_data)
+        return [{"mime_type": mime_type, "data": payload}, self.template(prompt).request_text]
+
+    # Triage an image before it is sent for analysis; raises ImageRejected if it fails.
+    # `triage` is True for every configured tier, "local" for the local checks only, False to skip.
+    def screen(self, image_digest, image_data, priority=INTERACTIVE, triage=True):
+        if self.triage is None or not triage:
+            return None
+        verdict = self.triage.check(image_digest, image_data, priority, use_model=triage != "local")
+        if not verdict.passed:
+            raise ImageRejected(verdict)
+        return verdict
+
+    # Start a streamed analysis of one image; iterate the result to receive text chunks.
+    # The request goes through the scheduler; time-to-first-token includes any queueing.
+    def stream_analysis(self, image_digest, image_data, priority=INTERACTIVE, prompt=None, triage=True):
+        self.screen(image_digest, image_data, priority, triage)
+        model = self.analysis_model(prompt)
+        prompt_parts = self.build_prompt(image_digest, image_data, prompt)
+        return start_stream(
+            model.generate_content, prompt_parts, scheduler=self.scheduler, priority=priority, metric="model.analysis"
+        )
+
+    # One non-streamed model call, recorded under `metric`. Returns the text, or None if blocked/empty.
+    def _generate_text(self, prompt_parts, metric, model=None):
+        model = model or self.models.get(analysis_model_name, generation_config, safety_settings)
+        started = time.perf_counter()
+        try:
+            response = model.generate_content(prompt_parts)
+        except Exception as e:
+            metrics.observe(metric, time.perf_counter() - started, error=type(e).__name__)
+            raise
+        metrics.observe_model_call(metric, time.perf_counter() - started, getattr(response, "usage_metadata", None))
+        try:
+            return response.text
+        except ValueError:
+            return None  # blocked or empty candidate
+
+    # Non-streamed analyses ask for structured JSON, index the parsed findings and keep the rendered
+    # markdown as the report. A response that fails to parse is never cached or shown: the image is
+    # analyzed once more with the markdown config and that report is kept (not indexed).
+    def _generate(self, image_digest, image_data, image_name=None, prompt=None):
+        structured = self.findings is not None
+        prompt_parts = self.build_prompt(image_digest, image_data, prompt)
+        analysis_text = self._generate_text(prompt_parts, "model.analysis", self.analysis_model(prompt, structured))
+        if analysis_text and structured:
+            try:
+                with metrics.timer("findings.index"):
+                    analysis = parse_structured_analysis(analysis_text)
+                    self.findings.put(self.cache_key(image_digest, prompt), image_digest, image_name, analysis)
+                analysis_text = render_markdown(analysis)
+            except ValueError:
+                analysis_text = self._generate_text(prompt_parts, "model.analysis", self.analysis_model(prompt, structured=False))
+        if analysis_text:
+            self.store_analysis(image_digest, analysis_text, prompt)
+        return analysis_text
+
+    # Analyze one image, checking the analysis cache first and triaging it otherwise. Returns
+    # (analysis_text, from_cache). Identical in-flight requests (same image, prompt and settings) share a
+    # single model call.
+    def analyze(self, image_digest, image_data, priority=INTERACTIVE, image_name=None, prompt=None, triage=True):
+        analysis_text = self.cached_analysis(image_digest, prompt)
+        if analysis_text:
+            return analysis_text, True
+
+        self.screen(image_digest, image_data, priority, triage)
+
+        analysis_text = self.scheduler.run(
+            lambda: self._generate(image_digest, image_data, image_name, prompt), priority, key=self.cache_key(image_digest, prompt)
+        )
+        return analysis_text or None, False
+
+    # Index a report that was produced as free text (streamed in the UI, or merged from frames/tiles) by
+    # asking the extraction model for the structured form. Runs in the background at batch priority and
+    # returns its Future, or None if the report is already indexed. With `session_id` the analysis is also
+    # listed in that session's findings searches.
+    def index_analysis(self, image_digest, image_name, analysis_text, priority=BATCH, prompt=None, session_id=None):
+        key = self.cache_key(image_digest, prompt)
+        if self.findings is None:
+            return None
+        if session_id is not None:
+            self.findings.add_owner(key, session_id)
+        if self.findings.has(key):
+            return None
+
+        def extract():
+            response_text = self._generate_text(
+                [extraction_prompt + analysis_text], "model.extract_findings",
+                self.models.get(extraction_model_name, structured_generation_config, safety_settings),
+            )
+            if response_text:
+                with metrics.timer("findings.index"):
+                    self.findings.put(key, image_digest, image_name, parse_structured_analysis(response_text))
+
+        return self.scheduler.submit(extract, priority, key=("findings", key))
+
+    # Combine per-frame or per-tile reports [(label, text), ...] into one report (text only, cached on its inputs).
+    # `kind` names the parts in the prompt, e.g. "frames" or "tiles".
+    def merge_reports(self, title, part_reports, kind="frames", priority=INTERACTIVE):
+        prompt = merge_prompt.format(count=len(part_reports), kind=kind, kind_singular=kind.rstrip("s"), title=title)
+        prompt += "\n\n" + "\n\n".join(f"### {label}\n{text}" for label, text in part_reports)
+        key = make_cache_key(fast_digest(prompt.encode("utf-8")), "merge", analysis_model_name, generation_config)
+        merged = self.analysis_cache.get(key)
+        if merged:
+            return merged
+        merged = self.scheduler.run(lambda: self._generate_text([prompt], "model.merge"), priority, key=key)
+        if merged:
+            self.analysis_cache.put(key, merged)
+        return merged
+
+    # Render an analysis to PDF bytes (blocking, served from the renderer cache when possible)
+    def render_pdf(self, title, analysis_text):
+        return self.report_renderer.render(title, analysis_text)
+
+
+# Build a pipeline configured from MEDIGEN_* environment variables
+def create_pipeline(api_key=None):
+    models = create_model_registry(api_key)
+    scheduler = RequestScheduler(
+        requests_per_minute=int(os.getenv("MEDIGEN_REQUESTS_PER_MINUTE", "60")),
+        max_workers=int(os.getenv("MEDIGEN_SCHEDULER_WORKERS", "8")),
+        max_retries=int(os.getenv("MEDIGEN_MAX_RETRIES", "5")),
+    )
+    return AnalysisPipeline(
+        models=models,
+        analysis_cache=AnalysisCache(
+            max_bytes=int(os.getenv("MEDIGEN_CACHE_MAX_MB", "256")) * 1024 * 1024,
+            max_age_seconds=int(os.getenv("MEDIGEN_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+        ),
+        preprocessed_images=PreprocessedImageCache(
+            max_edge=int(os.getenv("MEDIGEN_MAX_IMAGE_EDGE", "1536")),
+            output_format=os.getenv("MEDIGEN_IMAGE_FORMAT", "JPEG").upper(),
+        ),
+        report_renderer=ReportRenderer(max_workers=int(os.getenv("MEDIGEN_PDF_WORKERS", "1"))),
+        scheduler=scheduler,
+        findings=FindingsStore(),
+        triage=Triage(models, triage_model_name, scheduler, safety_settings=safety_settings),
+    )
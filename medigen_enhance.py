@@ -1,10 +1,24 @@
 import streamlit as st
 import os
-from PIL import Image
+import time
+from datetime import datetime
 from dotenv import load_dotenv
-import hashlib
-import google.generativeai as genai
-from weasyprint import HTML
+from image_dedup import UploadDeduper
+from chat_engine import ChatEngine, context_cache_factory
+from analysis_cache import make_cache_key
+from qa_cache import QACache
+from pdf_reports import pdf_filename, report_key
+from medigen_core import analysis_model_name, create_pipeline, generation_config, safety_settings
+from instrumentation import metrics, start_metrics_server
+from findings import SEVERITIES, render_markdown
+from image_preprocess import ThumbnailCache, open_image
+from large_images import LARGE_IMAGE_EXTENSIONS, analyze_large_image, is_large_format
+from blob_store import UploadBlobStore, UploadLimitExceeded
+from search_index import SearchIndex
+from session_store import create_session_store, is_valid_session_id, new_session_id
+from triage import ImageRejected
+from job_queue import CANCELLED, DONE, QUEUED, JobQueue
+from request_scheduler import BATCH, INTERACTIVE
 
 # Configure page
 st.set_page_config(page_title="MediGen Catalyst", page_icon="🩺")
@@ -20,78 +34,379 @@ if not google_api_key:
         st.warning("No API key found. Please enter your Google API key to continue.")
         st.stop()
 
-# Configure AI Model
-genai.configure(api_key=google_api_key)
-
-generation_config = {
-    "temperature": 1,
-    "top_p": 0.95,
-    "top_k": 0,
-    "max_output_tokens": 8192,
-}
-
-safety_settings = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-]
-
-# Updated System Prompt with Medications & Ointments
-system_prompts = """
-As a highly skilled medical practitioner specializing in image analysis, you are tasked with examining medical images for a renowned hospital. Your expertise is crucial in identifying any anomalies, diseases, or health issues that may be present in the image.
-
-Your Responsibilities include:
-
-1. Detailed Analysis: Thoroughly analyze each image, focusing on identifying any abnormal findings.
-2. Findings Report: Document all observed anomalies or signs of disease. Clearly articulate these findings in a structured form.
-3. Recommendation and Next Steps: Based on your analysis, suggest potential next steps, including further tests or treatments as applicable.
-4. Treatment Suggestions: If appropriate, recommend possible treatment options or interventions.
-5. Medications & Ointments - If applicable, suggest medications (with dosage) and ointments based on the diagnosis.
-6.  Home-Made Remedies - If suitable, provide safe and effective natural remedies that may help alleviate symptoms.
-
-⚠️ Important Notes:
-1. Scope of Response: Only respond if the image pertains to human health issues.
-2. Only provide medications if there is a clear diagnosis.
-3. Ensure that your recommendations align with standard medical practices.
-4. Clarity of Image: In cases where the image quality impedes clear analysis, note that certain aspects are 'Unable to be determined based on the provided image.'
-5. Home-made remedies should be **safe, simple, and widely recognized** (e.g., warm compress, turmeric milk, saline rinse).
-6. Disclaimer: Accompany your analysis with the disclaimer "Consult with a Doctor before making any decisions."
-7. Your insights are invaluable in guiding clinical decisions. Please proceed with the analysis, adhering to the structured approach outlined above.
-
-
-Please provide me an output response with these 4 headings Detailed Analysis,Findings Report,Recommendation and Next Steps,Treatment Suggestions, medications and ointments, home-made remedies 
-"""
-
-# Initialize session states
-if "analyses" not in st.session_state:
-    st.session_state.analyses = {}
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-if "selected_image" not in st.session_state:
-    st.session_state.selected_image = None
-
-# Function to generate and download PDF reports
-def generate_pdf(report_text, filename="analysis_report.pdf"):
+# Configure AI Model once per process. The pipeline keeps warm model clients, the on-disk analysis cache,
+# preprocessed payloads and the background PDF renderer, shared across reruns and sessions. The genai client
+# holds a single API key per process, so a key that differs from the one already in use is refused.
+@st.cache_resource
+def get_pipeline(api_key):
+    return create_pipeline(api_key)
+
+try:
+    pipeline = get_pipeline(google_api_key)
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
+model_registry = pipeline.models
+analysis_cache = pipeline.analysis_cache
+preprocessed_images = pipeline.preprocessed_images
+report_renderer = pipeline.report_renderer
+
+# Optional Prometheus scrape endpoint (set MEDIGEN_METRICS_PORT), started once per process
+@st.cache_resource
+def get_metrics_server():
+    port = os.getenv("MEDIGEN_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+get_metrics_server()
+
+# History store shared by every session in this process (MEDIGEN_SESSION_STORE selects SQLite or Redis
+# so it survives restarts and is shared across replicas)
+@st.cache_resource
+def get_session_store():
+    return create_session_store()
+
+session_store = get_session_store()
+
+# Keyword (and, with numpy, semantic) index over analyses and chat turns, filled as they are produced
+@st.cache_resource
+def get_search_index():
+    return SearchIndex(semantic=os.getenv("MEDIGEN_SEMANTIC_SEARCH", "1") == "1")
+
+search_index = get_search_index()
+
+# Gallery previews, generated once per image digest and shared by every session in this process
+@st.cache_resource
+def get_thumbnail_cache():
+    return ThumbnailCache(max_bytes=int(os.getenv("MEDIGEN_THUMBNAIL_CACHE_MB", "32")) * 1024 * 1024)
+
+thumbnails = get_thumbnail_cache()
+
+# Upload bytes, spilled to disk once per digest and read back through memory maps, so reruns, jobs, triage
+# and thumbnails share one copy instead of each holding the full file. Each session may hold at most
+# MEDIGEN_SESSION_UPLOAD_MB of uploads.
+@st.cache_resource
+def get_upload_store():
+    store = UploadBlobStore(
+        root=os.getenv("MEDIGEN_UPLOAD_DIR") or None,
+        session_limit_bytes=int(os.getenv("MEDIGEN_SESSION_UPLOAD_MB", "1024")) * 1024 * 1024,
+        max_bytes=int(os.getenv("MEDIGEN_UPLOAD_STORE_MB", "8192")) * 1024 * 1024,
+        session_ttl_seconds=float(os.getenv("MEDIGEN_UPLOAD_SESSION_TTL_HOURS", "6")) * 3600,
+    )
+    metrics.register_gauge("medigen_upload_store_bytes", "Upload bytes spilled to the blob store.", lambda: store.stats()["bytes"])
+    metrics.register_gauge("medigen_upload_store_sessions", "Sessions holding uploads in the blob store.", lambda: store.stats()["sessions"])
+    return store
+
+upload_blobs = get_upload_store()
+
+# Analyses run as background jobs on a process-wide pool (MEDIGEN_JOB_WORKERS at a time), so reruns,
+# page switches and closed tabs do not throw away a model call that is already paid for
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue(max_workers=int(os.getenv("MEDIGEN_JOB_WORKERS", "4")))
+    metrics.register_gauge("medigen_job_queue_depth", "Analysis jobs waiting for a worker.", queue.queue_depth)
+    metrics.register_gauge("medigen_job_workers_busy", "Job workers running an analysis.", lambda: queue.stats()["running"])
+    metrics.register_gauge("medigen_job_worker_utilisation", "Average share of time job workers were busy.", lambda: round(queue.stats()["average_utilisation"], 4))
+    return queue
+
+job_queue = get_job_queue()
+
+# Answers to follow-up questions, reused when the same (or a very similar) question is asked about the same analysis
+@st.cache_resource
+def get_qa_cache():
+    cache = QACache(
+        threshold=float(os.getenv("MEDIGEN_QA_CACHE_THRESHOLD", "0.85")),
+        ttl_seconds=float(os.getenv("MEDIGEN_QA_CACHE_TTL_HOURS", "24")) * 3600,
+        max_entries=int(os.getenv("MEDIGEN_QA_CACHE_MAX_ENTRIES", "2000")),
+    )
+    metrics.register_gauge("medigen_qa_cache_hit_rate", "Share of follow-up questions answered from the Q&A cache.", lambda: round(cache.stats()["hit_rate"], 4))
+    return cache
+
+qa_cache = get_qa_cache()
+
+# Rows per page in "Previous Analyses" and "Previous Interactions", thumbnails per gallery page
+HISTORY_PAGE_SIZE = int(os.getenv("MEDIGEN_HISTORY_PAGE_SIZE", "10"))
+GALLERY_PAGE_SIZE = int(os.getenv("MEDIGEN_GALLERY_PAGE_SIZE", "12"))
+GALLERY_COLUMNS = 4
+
+# Initialize session states. The session id is kept in the URL so a refresh finds the same history.
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("session")
+    st.session_state.session_id = session_id if is_valid_session_id(session_id) else new_session_id()
+    st.query_params["session"] = st.session_state.session_id
+session_id = st.session_state.session_id
+if "chat_engines" not in st.session_state:
+    st.session_state.chat_engines = {}
+if "bulk_export" not in st.session_state:
+    st.session_state.bulk_export = None
+if "last_chat_timing" not in st.session_state:
+    st.session_state.last_chat_timing = None
+if "upload_deduper" not in st.session_state:
+    st.session_state.upload_deduper = UploadDeduper()
+if "opened_image" not in st.session_state:
+    st.session_state.opened_image = None
+if "pdf_requests" not in st.session_state:
+    st.session_state.pdf_requests = set()
+
+# Function to generate PDF reports in the background (in memory, nothing written to disk).
+# Returns the render key, or None if the job could not be queued.
+def generate_pdf(image_name, report_text):
     try:
-        HTML(string=report_text).write_pdf(filename)
-        return filename
+        return report_renderer.submit(image_name, report_text)
     except Exception as e:
         st.error(f"Error generating PDF: {str(e)}")
         return None
 
-# Function to hash images (for deduplication)
-def hash_image(image):
+# Function to show a download button for a rendered PDF/ZIP (or a placeholder while it renders)
+def show_report_download(render_key, label, file_name, mime="application/pdf", key_prefix="pdf"):
     try:
-        image_bytes = image.tobytes()
-        return hashlib.md5(image_bytes).hexdigest()
+        data = report_renderer.result(render_key)
     except Exception as e:
-        st.error(f"Error hashing image: {str(e)}")
-        return None
+        st.error(f"Error generating PDF: {str(e)}")
+        return
+    if data is None:
+        st.caption("⏳ Preparing report...")
+    else:
+        st.download_button(label=label, data=data, file_name=file_name, mime=mime, key=f"{key_prefix}_{render_key}")
+
+# Polls every two seconds until the background render is ready
+@st.fragment(run_every=2)
+def poll_report_download(render_key, label, file_name, mime="application/pdf", key_prefix="pdf"):
+    show_report_download(render_key, label, file_name, mime, key_prefix)
+
+# Function to offer a report download, polling only while the render is pending
+def report_download(render_key, label, file_name, mime="application/pdf", key_prefix="pdf"):
+    if render_key is None:
+        return
+    try:
+        pending = report_renderer.result(render_key) is None
+    except Exception:
+        pending = False  # show_report_download surfaces the error
+    if pending:
+        poll_report_download(render_key, label, file_name, mime, key_prefix)
+    else:
+        show_report_download(render_key, label, file_name, mime, key_prefix)
+
+# Function to offer one report as a PDF. Nothing is rendered until the user clicks "Prepare PDF" (listing
+# reports must not queue WeasyPrint work nobody asked for); reports that are already rendered go straight
+# to the download button.
+def pdf_download(image_name, report_text, key_prefix):
+    render_key = report_key(image_name, report_text)
+    if render_key not in st.session_state.pdf_requests:
+        try:
+            rendered = report_renderer.result(render_key) is not None
+        except Exception:
+            rendered = False
+        if not rendered:
+            if not st.button("📄 Prepare PDF", key=f"prepare_{key_prefix}_{render_key}"):
+                return
+            st.session_state.pdf_requests.add(render_key)
+    report_download(generate_pdf(image_name, report_text), "📥 Download Report", pdf_filename(image_name), key_prefix=key_prefix)
+
+# Function to hash images (for deduplication) - digests the compressed upload bytes, memoized across reruns.
+# Optionally merges near-duplicates by perceptual hash.
+def dedupe_images(uploaded_files, perceptual=False):
+    try:
+        return st.session_state.upload_deduper.group(uploaded_files, perceptual)
+    except Exception as e:
+        st.warning(f"Near-duplicate detection failed, falling back to exact matching: {str(e)}")
+        return st.session_state.upload_deduper.group(uploaded_files)
+
+# Function to record a finished analysis in a session's history and queue free-text reports for the findings
+# index. The history keeps the preprocessed payload the model saw (already in the preprocessing cache), not a
+# full-resolution copy; the original stays in the upload store while the session holds it. Called from job
+# worker threads, so it takes the session id explicitly and returns a warning instead of showing one.
+def save_analysis(job_session_id, image_hash, image_name, image_data, analysis_text, prompt=None):
+    session_store.put_blob(image_hash, preprocessed_images.get(image_hash, image_data)[0])
+    session_store.save_analysis(job_session_id, image_hash, image_name, analysis_text)
+    search_index.add_analysis(job_session_id, {"digest": image_hash, "image_name": image_name, "analysis": analysis_text, "updated_at": time.time()})
+    try:
+        pipeline.index_analysis(image_hash, image_name, analysis_text, prompt=prompt, session_id=job_session_id)
+    except Exception as e:
+        return f"Could not index findings for {image_name}: {str(e)}"
+    return None
+
+# Function to map an upload's stored bytes for a job (a zero-copy view, released when the job is done).
+# Queued jobs only hold the digest, so the upload may have been released before the job starts.
+def stored_upload(image_hash, image_name):
+    image_data = upload_blobs.view(image_hash)
+    if image_data is None:
+        raise RuntimeError(f"{image_name} is no longer stored, please upload it again.")
+    return image_data
+
+# Background job: stream one image's analysis (the text so far is shown while it runs) and save it
+def stream_analysis_job(image_hash, image_name, prompt):
+    job_session_id = session_id
+
+    def run(job):
+        analysis_text = pipeline.cached_analysis(image_hash, prompt)
+        notes = []
+        image_data = stored_upload(image_hash, image_name)
+        try:
+            if analysis_text:
+                notes.append("⚡ Served from analysis cache")
+            else:
+                stream = pipeline.stream_analysis(image_hash, image_data, prompt=prompt)
+                for chunk in stream:
+                    job.partial += chunk
+                analysis_text = stream.text
+                if not analysis_text:
+                    raise RuntimeError("Failed to generate analysis. Please try again.")
+                pipeline.store_analysis(image_hash, analysis_text, prompt)
+                notes.append(f"⏱️ First token after {stream.first_token_seconds or 0:.2f} s, complete after {stream.total_seconds or 0:.2f} s")
+            notes.append(save_analysis(job_session_id, image_hash, image_name, image_data, analysis_text, prompt))
+        finally:
+            image_data.release()
+        job.message = " · ".join(note for note in notes if note)
+        return {"analysis": analysis_text}
+
+    return run
+
+# Background job: analyze one image of an "Analyze all" batch and save it
+def analysis_job(image_hash, image_name, prompt):
+    job_session_id = session_id
+
+    def run(job):
+        image_data = stored_upload(image_hash, image_name)
+        try:
+            analysis_text, from_cache = pipeline.analyze(image_hash, image_data, image_name=image_name, prompt=prompt)
+            if not analysis_text:
+                raise RuntimeError(f"Failed to generate analysis for {image_name}.")
+            notes = ["⚡ Served from analysis cache" if from_cache else None,
+                     save_analysis(job_session_id, image_hash, image_name, image_data, analysis_text, prompt)]
+        finally:
+            image_data.release()
+        job.message = " · ".join(note for note in notes if note)
+        return {"analysis": analysis_text}
+
+    return run
+
+# Background job: analyze a DICOM series, multi-page TIFF or huge scan part by part and save the merged report.
+# The readers open the stored upload by path, so it is pinned on disk while the job runs.
+def large_image_job(image_hash, image_name, prompt):
+    job_session_id = session_id
+
+    def run(job):
+        def on_progress(done, total):
+            job.progress = (done, total)
+
+        if image_hash not in upload_blobs:
+            raise RuntimeError(f"{image_name} is no longer stored, please upload it again.")
+        with upload_blobs.local_path(image_hash) as path:
+            result = analyze_large_image(
+                pipeline, path, image_name,
+                max_workers=int(os.getenv("MEDIGEN_MAX_CONCURRENCY", "4")), on_progress=on_progress, prompt=prompt,
+            )
+        notes = [f"⚠️ {label} could not be analyzed: {error}" for label, error in result["failed"]]
+        if result["skipped"]:
+            notes.append(f"⏭️ Skipped {len(result['skipped'])} part(s) that failed triage: " + ", ".join(label for label, _ in result["skipped"]))
+        # The first frame/tile stands in for the file in the gallery and in "Ask AI"
+        notes.append(save_analysis(job_session_id, image_hash, image_name, result["preview"], result["report"], prompt))
+        job.message = " · ".join(note for note in notes if note)
+        return {"analysis": result["report"], "parts": result["parts"] if len(result["parts"]) > 1 else [], "mode": result["plan"]["mode"]}
+
+    return run
+
+# Function to show one running or queued job (progress, and the streamed text so far)
+def show_active_job(job):
+    if job.status == QUEUED:
+        status_col, cancel_col = st.columns([4, 1])
+        status_col.write(f"⏳ Queued: **{job.title}**")
+        if cancel_col.button("✖️ Cancel", key=f"cancel_{job.id}"):
+            job_queue.cancel(job.id)
+        return
+    st.write(f"🔄 Analyzing **{job.title}**...")
+    if job.progress:
+        done, total = job.progress
+        st.progress(done / total, text=f"{done}/{total} parts analyzed")
+    if job.partial:
+        st.write(job.partial)
+
+# Polls every second while jobs are running and reruns the page whenever one of them finishes, so the
+# report, its PDF and the history appear without a click
+@st.fragment(run_every=1)
+def poll_jobs(job_ids):
+    jobs = [job_queue.get(job_id) for job_id in job_ids]
+    if any(job is None or job.finished for job in jobs):
+        st.rerun()
+    for job in jobs:
+        show_active_job(job)
+
+# Function to show this session's analysis jobs: live progress while they run, then the report (or the
+# error) until the user clears them. Finished jobs are already in the history.
+def show_jobs():
+    jobs = job_queue.list_jobs(session_id)
+    if not jobs:
+        return
+    finished = [job for job in jobs if job.finished]
+    st.subheader(f"🧾 Analysis jobs ({len(finished)}/{len(jobs)} finished)")
+    for job in finished:
+        if job.status == DONE:
+            with st.expander(f"📝 Analysis for {job.title}", expanded=len(jobs) == 1):
+                if job.message:
+                    st.caption(job.message)
+                st.write(job.result["analysis"])
+                if job.result.get("parts"):
+                    st.markdown(f"**Per-part reports ({len(job.result['parts'])} {job.result['mode']})**")
+                    for label, part_text in job.result["parts"]:
+                        st.markdown(f"**{label}**")
+                        st.write(part_text)
+                pdf_download(job.title, job.result["analysis"], key_prefix=f"job_{job.id}")
+        elif job.status == CANCELLED:
+            st.caption(f"✖️ Cancelled: {job.title}")
+        elif isinstance(job.error, ImageRejected):
+            st.warning(f"🚫 {job.title}: {str(job.error)}")
+        else:
+            st.error(f"Error analyzing {job.title}: {str(job.error)}")
+    active = [job.id for job in jobs if not job.finished]
+    if active:
+        poll_jobs(active)
+    elif st.button("🧹 Clear finished jobs"):
+        for job in finished:
+            job_queue.forget(job.id)
+        st.rerun()
+
+# Function to pick the image "Ask AI" talks about
+def select_image(image_hash, image_name):
+    session_store.set_selected(session_id, image_hash, image_name)
+
+# Function to show a page selector and return (offset, limit) for a paged list
+def history_page(total, key, page_size=HISTORY_PAGE_SIZE):
+    pages = max(1, -(-total // page_size))
+    page_number = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key) if pages > 1 else 1
+    return (page_number - 1) * page_size, page_size
+
+# Function to show one question/answer pair
+def show_chat_turn(turn):
+    st.markdown(f"**🧑‍⚕️ User:** {turn['question']}")
+    st.markdown(f"**🤖 AI:** {turn['answer']}")
+
+# Function to get (or start) the follow-up conversation about an analyzed image
+def get_chat_engine(image_hash, image_data, analysis_text):
+    engine = st.session_state.chat_engines.get(image_hash)
+    if engine is None or engine.analysis_text != analysis_text:
+        payload, mime_type, _ = preprocessed_images.get(image_hash, image_data)
+        use_context_cache = os.getenv("MEDIGEN_CONTEXT_CACHE", "0") == "1"
+        engine = ChatEngine(
+            model_registry.get(analysis_model_name, generation_config, safety_settings),
+            analysis_text,
+            image_part={"mime_type": mime_type, "data": payload},
+            max_history_tokens=int(os.getenv("MEDIGEN_CHAT_HISTORY_TOKENS", "4000")),
+            cached_model_factory=context_cache_factory(generation_config, safety_settings) if use_context_cache else None,
+            scheduler=pipeline.scheduler,
+            # Earlier questions about this image (e.g. before a restart or in another worker) stay in context
+            turns=[(turn["question"], turn["answer"]) for turn in reversed(session_store.list_chat_turns(session_id, digest=image_hash))],
+        )
+        st.session_state.chat_engines[image_hash] = engine
+    return engine
 
 # Sidebar Navigation
 st.sidebar.title("🔍 Navigation")
-page = st.sidebar.radio("Go to:", ["🏠 Home", "📂 Upload & Analyze", "💬 Ask AI", "🕘 Previous Interactions", "ℹ️ How It Works"])
+page = st.sidebar.radio("Go to:", ["🏠 Home", "📂 Upload & Analyze", "💬 Ask AI", "🕘 Previous Interactions", "🔎 Search Findings", "ℹ️ How It Works", "📊 Admin"])
+
+# Analyses keep running in the background while other pages are open
+active_job_count = len(job_queue.list_jobs(session_id, active_only=True))
+if active_job_count:
+    st.sidebar.caption(f"⏳ {active_job_count} analysis job(s) running or queued, see 'Upload & Analyze'")
 
 # ------------------- HOME PAGE -------------------
 if page == "🏠 Home":
@@ -109,118 +424,244 @@ if page == "🏠 Home":
 # ------------------- UPLOAD & ANALYZE -------------------
 elif page == "📂 Upload & Analyze":
     st.title("📂 Upload & Analyze Medical Images")
+
+    # Modality-specific prompt template (latest version of each)
+    prompt_names = [template.name for template in pipeline.prompts.latest()]
+    prompt_name = st.selectbox(
+        "🩻 Image type", prompt_names, index=prompt_names.index("general"),
+        format_func=lambda name: pipeline.prompts.get(name).label,
+    )
     
     # File uploader
-    uploaded_files = st.file_uploader("Upload medical images", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
+    uploaded_files = st.file_uploader(
+        "Upload medical images",
+        type=["png", "jpg", "jpeg"] + sorted(extension.lstrip(".") for extension in LARGE_IMAGE_EXTENSIONS),
+        accept_multiple_files=True,
+    )
+
+    # Spill each upload to the blob store once (later reruns only look it up). Files beyond this session's
+    # upload budget are left out, and files removed from the uploader are released unless a job still needs them.
+    stored_files = []
+    for uploaded_file in uploaded_files or []:
+        try:
+            upload_blobs.put(session_id, st.session_state.upload_deduper.fingerprint(uploaded_file)["digest"], uploaded_file)
+            stored_files.append(uploaded_file)
+        except UploadLimitExceeded as e:
+            st.warning(f"⚠️ Skipping {uploaded_file.name}: {str(e)}")
+    upload_blobs.retain(
+        session_id,
+        [st.session_state.upload_deduper.fingerprint(f)["digest"] for f in stored_files]
+        + [job.key[0] for job in job_queue.list_jobs(session_id, active_only=True) if job.key],
+    )
+    upload_usage = upload_blobs.usage(session_id)
+    if upload_usage["blobs"]:
+        st.caption(f"📦 Uploads held for this session: {upload_usage['bytes'] / (1024 * 1024):.1f} of {upload_usage['limit'] / (1024 * 1024):.0f} MB")
+
+    # DICOM series, multi-page TIFFs and huge scans of any format (judged by the header's dimensions)
+    # are analyzed frame by frame or tile by tile
+    large_files = [f for f in stored_files if is_large_format(f.name, f.getbuffer())]
+    uploaded_files = [f for f in stored_files if f not in large_files]
+
+    if large_files:
+        st.subheader("🧩 Large & multi-frame images")
+        for large_file in large_files:
+            image_hash = st.session_state.upload_deduper.fingerprint(large_file)["digest"]
+            st.caption(f"{large_file.name} ({large_file.size / (1024 * 1024):.1f} MB)")
+
+            if st.button(f"🧩 Analyze {large_file.name}", key=f"large_{image_hash}"):
+                job_queue.submit(large_image_job(image_hash, large_file.name, prompt_name), session_id, "large_image", large_file.name, key=(image_hash, prompt_name))
+                select_image(image_hash, large_file.name)
 
     if uploaded_files:
         processed_images = {}
         unique_images = []
+        perceptual_dedup = st.checkbox("🧬 Also skip near-duplicates (re-encoded or resized copies)")
 
-        for uploaded_file in uploaded_files:
-            try:
-                image = Image.open(uploaded_file)
-                st.image(image, width=150, caption=f"Uploaded: {uploaded_file.name}")
-
-                image_hash = hash_image(image)
-                if image_hash and image_hash not in processed_images:
-                    processed_images[image_hash] = uploaded_file
-                    unique_images.append(image_hash)
-            except Exception as e:
-                st.error(f"Error processing image {uploaded_file.name}: {str(e)}")
+        # 🔹 Gallery of cached thumbnails, one page at a time. Only the opened image is decoded at full resolution.
+        offset, limit = history_page(len(uploaded_files), "gallery_page", GALLERY_PAGE_SIZE)
+        gallery_columns = st.columns(GALLERY_COLUMNS)
+        for index, uploaded_file in enumerate(uploaded_files[offset:offset + limit]):
+            with gallery_columns[index % GALLERY_COLUMNS]:
+                try:
+                    image_hash = st.session_state.upload_deduper.fingerprint(uploaded_file)["digest"]
+                    st.image(thumbnails.get(image_hash, lambda: upload_blobs.view(image_hash)), width=150, caption=f"Uploaded: {uploaded_file.name}")
+                    if st.button("🔍 Open", key=f"open_{offset + index}"):
+                        st.session_state.opened_image = image_hash
+                except Exception as e:
+                    st.error(f"Error processing image {uploaded_file.name}: {str(e)}")
+
+        if st.session_state.opened_image:
+            opened_file = next(
+                (f for f in uploaded_files if st.session_state.upload_deduper.fingerprint(f)["digest"] == st.session_state.opened_image),
+                None,
+            )
+            if opened_file is not None:
+                try:
+                    with metrics.timer("image_decode"):
+                        image = open_image(upload_blobs.view(st.session_state.opened_image))
+                        image.load()
+                    st.image(image, caption=f"{opened_file.name} ({image.width}×{image.height})")
+                except Exception as e:
+                    st.error(f"Error processing image {opened_file.name}: {str(e)}")
+                if st.button("✖️ Close image"):
+                    st.session_state.opened_image = None
+                    st.rerun()
+
+        for image_hash, primary_file, duplicates in dedupe_images(uploaded_files, perceptual_dedup):
+            processed_images[image_hash] = primary_file
+            unique_images.append(image_hash)
+            for duplicate in duplicates:
+                st.caption(f"⏭️ Skipping {duplicate.name} (duplicate of {primary_file.name})")
+
+        # 🔹 Analyze all unique images as background jobs (queued behind single-image analyses)
+        if len(unique_images) > 1:
+            if st.button(f"🚀 Analyze all ({len(unique_images)} images)"):
+                for image_hash in unique_images:
+                    upload = processed_images[image_hash]
+                    job_queue.submit(
+                        analysis_job(image_hash, upload.name, prompt_name),
+                        session_id, "analysis", upload.name, priority=BATCH, key=(image_hash, prompt_name),
+                    )
+                # Store the first image for follow-up questions
+                select_image(unique_images[0], processed_images[unique_images[0]].name)
 
         for image_hash in unique_images:
             primary_file = processed_images[image_hash]
 
             if st.button(f"🔬 Analyze {primary_file.name}"):
-                st.session_state.selected_image = primary_file  # Store the image for follow-up questions
-                progress_bar = st.progress(0)
-
-                try:
-                    image_data = primary_file.getvalue()
-                    image_parts = [{"mime_type": "image/jpeg", "data": image_data}]
-                    prompt_parts = [image_parts[0], system_prompts]
-
-                    model = genai.GenerativeModel(
-                        model_name="gemini-1.5-pro-latest",
-                        generation_config=generation_config,
-                        safety_settings=safety_settings,
-                    )
-
-                    with st.spinner("🔎 Analyzing..."):
-                        response = model.generate_content(prompt_parts)
-                        progress_bar.progress(50)
-
-                    if response and response.text:
-                        analysis_text = response.text
-                        st.write(f"### 📝 Analysis for {primary_file.name}")
-                        st.write(analysis_text)
-                        st.session_state.analyses[primary_file.name] = analysis_text
-                        progress_bar.progress(100)
-
-                        # Generate and provide download link for report
-                        pdf_filename = generate_pdf(analysis_text)
-                        if pdf_filename:
-                            with open(pdf_filename, "rb") as pdf_file:
-                                st.download_button(label="📥 Download Report", data=pdf_file, file_name=pdf_filename, mime="application/pdf")
-                    else:
-                        st.error("❌ Failed to generate analysis. Please try again.")
-                except Exception as e:
-                    st.error(f"Error during analysis: {str(e)}")
-                    progress_bar.progress(100)
-
-    # 🔹 Show previous analyses below images
-    if st.session_state.analyses:
+                select_image(image_hash, primary_file.name)  # Store the image for follow-up questions
+                job_queue.submit(
+                    stream_analysis_job(image_hash, primary_file.name, prompt_name),
+                    session_id, "analysis", primary_file.name, priority=INTERACTIVE, key=(image_hash, prompt_name),
+                )
+
+    # 🔹 Running and finished analysis jobs (results are saved to the history by the jobs themselves)
+    show_jobs()
+
+    # 🔹 Show previous analyses below images, one page at a time (newest first)
+    analysis_count = session_store.count_analyses(session_id)
+    if analysis_count:
         st.subheader("🔍 Previous Analyses")
-        for image_name, analysis_text in st.session_state.analyses.items():
+        offset, limit = history_page(analysis_count, "analyses_page")
+        for record in session_store.list_analyses(session_id, offset, limit):
+            image_name = record["image_name"]
             with st.expander(f"Analysis for {image_name}"):
-                st.write(analysis_text)
+                st.write(record["analysis"])
+                pdf_download(image_name, record["analysis"], key_prefix="history")
+
+        # 🔹 Bulk export of every analysis in this session
+        if analysis_count > 1:
+            zip_col, pdf_col = st.columns(2)
+            export_zip = zip_col.button("📦 Export all as ZIP")
+            export_pdf = pdf_col.button("📚 Export all as one PDF")
+            if export_zip or export_pdf:
+                reports = [(record["image_name"], record["analysis"]) for record in reversed(session_store.list_analyses(session_id))]
+                if export_zip:
+                    st.session_state.bulk_export = (report_renderer.submit_zip(reports), "medigen_reports.zip", "application/zip")
+                else:
+                    st.session_state.bulk_export = (report_renderer.submit_bundle(reports), "medigen_reports.pdf", "application/pdf")
+            if st.session_state.bulk_export:
+                render_key, file_name, mime = st.session_state.bulk_export
+                report_download(render_key, f"📥 Download {file_name}", file_name, mime, key_prefix="bulk")
 
     # 🔹 Button to clear analysis history
     if st.button("🗑️ Clear Analysis History"):
-        st.session_state.analyses = {}
+        session_store.clear_analyses(session_id)
+        search_index.remove_session(session_id, "analysis")
+        if pipeline.findings is not None:
+            pipeline.findings.remove_session(session_id)
+        st.session_state.bulk_export = None
         st.rerun()
 
+    cache_stats = analysis_cache.stats()
+    st.caption(
+        f"Analysis cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+        f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB)"
+    )
+
 # ------------------- ASK AI (CHATBOT) -------------------
 elif page == "💬 Ask AI":
     st.title("💬 Ask AI About Your Analysis")
 
-    if not st.session_state.selected_image:
+    selected_image = session_store.get_selected(session_id)
+    if not selected_image:
         st.warning("Please analyze an image first in 'Upload & Analyze' before asking AI.")
     else:
         try:
-            selected_image = st.session_state.selected_image
-            analysis_text = st.session_state.analyses.get(selected_image.name, "No analysis available.")
-
-            # Show the analyzed image and its report
-            st.image(selected_image, width=200, caption=f"Current Image: {selected_image.name}")
-            st.write(f"### 📝 Analysis for {selected_image.name}")
+            image_hash, image_name = selected_image["digest"], selected_image["image_name"]
+            record = session_store.get_analysis(session_id, image_hash)
+            analysis_text = record["analysis"] if record else "No analysis available."
+            image_data = session_store.get_blob(image_hash)
+
+            # Show the analyzed image (cached thumbnail, full resolution on request) and its report
+            if image_data is not None:
+                st.image(thumbnails.get(image_hash, lambda: image_data), width=200, caption=f"Current Image: {image_name}")
+                if st.toggle("🔍 Show full resolution"):
+                    # The original while this session still holds the upload, otherwise the copy sent to the model
+                    original = upload_blobs.view(image_hash)
+                    st.image(open_image(original) if original is not None else image_data, caption=image_name)
+            else:
+                st.caption(f"Current Image: {image_name} (no longer stored, please upload it again)")
+            st.write(f"### 📝 Analysis for {image_name}")
             st.write(analysis_text)
 
-            # Display chat history
+            # Display the most recent turns about this image, oldest first
             chat_container = st.container()
-            for q, r in st.session_state.chat_history:
+            turn_count = session_store.count_chat_turns(session_id, digest=image_hash)
+            if turn_count > HISTORY_PAGE_SIZE:
+                chat_container.caption(f"Showing the last {HISTORY_PAGE_SIZE} of {turn_count} questions. See 'Previous Interactions' for the rest.")
+            for turn in reversed(session_store.list_chat_turns(session_id, 0, HISTORY_PAGE_SIZE, digest=image_hash)):
                 with chat_container:
-                    st.markdown(f"**🧑‍⚕️ User:** {q}")
-                    st.markdown(f"**🤖 AI:** {r}")
+                    show_chat_turn(turn)
+
+            if st.session_state.last_chat_timing and "cached_question" in st.session_state.last_chat_timing:
+                timing = st.session_state.last_chat_timing
+                match = "same question" if timing["similarity"] >= 1 else f"similar to \"{timing['cached_question']}\", {timing['similarity']:.0%} match"
+                st.caption(f"⚡ Last answer came from the Q&A cache ({match}), no model call")
+            elif st.session_state.last_chat_timing:
+                timing = st.session_state.last_chat_timing
+                input_tokens = f", {timing['input_tokens']} input tokens" if timing["input_tokens"] else ""
+                st.caption(
+                    f"⏱️ Last answer: first token after {timing['first_token_seconds']:.2f} s, "
+                    f"complete after {timing['total_seconds']:.2f} s{input_tokens}"
+                )
 
             # Input for AI follow-up questions
             question = st.text_input("💡 Ask a follow-up question:", key="chat_input")
 
+            bypass_cache = st.checkbox("🔄 Always ask the model (skip cached answers)")
+
             if st.button("Ask AI") and question:
                 try:
-                    chatbot_prompt = f"Based on the previous analysis: {analysis_text}, answer this question: {question}"
-                    model = genai.GenerativeModel(
-                        model_name="gemini-1.5-pro-latest",
-                        generation_config=generation_config,
-                        safety_settings=safety_settings,
-                    )
-
-                    with st.spinner("🤖 Thinking..."):
-                        chatbot_response = model.generate_content(chatbot_prompt)
-
-                    if chatbot_response and chatbot_response.text:
-                        st.session_state.chat_history.append((question, chatbot_response.text))
+                    # Repeated questions about the same report are answered from the Q&A cache without a model call.
+                    # Answers depend on this session's earlier turns (age, allergies...), so they are never shared
+                    # with another session that got the same report.
+                    analysis_key = (session_id, make_cache_key(image_hash, analysis_text, analysis_model_name, generation_config))
+                    cached = None if bypass_cache else qa_cache.get(analysis_key, question)
+                    if cached is not None:
+                        chatbot_answer = cached.answer
+                        if image_hash in st.session_state.chat_engines:
+                            st.session_state.chat_engines[image_hash].record_turn(question, chatbot_answer)
+                        timing = {"cached_question": cached.question, "similarity": cached.similarity}
+                    else:
+                        # The conversation keeps the report as context, so only the new question is sent each turn
+                        if image_data is None:
+                            raise RuntimeError("The image for this analysis is no longer stored. Please upload it again.")
+                        chat_engine = get_chat_engine(image_hash, image_data, analysis_text)
+
+                        st.markdown(f"**🧑‍⚕️ User:** {question}")
+                        st.markdown("**🤖 AI:**")
+                        with st.spinner("🤖 Thinking..."):
+                            chatbot_stream = chat_engine.ask(question)
+                        chatbot_answer = st.write_stream(chatbot_stream)
+                        if chatbot_answer:
+                            qa_cache.put(analysis_key, question, chatbot_answer)
+                            timing = chat_engine.turn_stats[-1]
+
+                    if chatbot_answer:
+                        session_store.add_chat_turn(session_id, image_hash, question, chatbot_answer)
+                        search_index.add_chat_turn(session_id, session_store.list_chat_turns(session_id, 0, 1, digest=image_hash)[0])
+                        st.session_state.last_chat_timing = timing
                         st.rerun()
                     else:
                         st.error("Failed to get a response from AI. Please try again.")
@@ -233,17 +674,78 @@ elif page == "💬 Ask AI":
 elif page == "🕘 Previous Interactions":
     st.title("🕘 Previous AI Interactions")
 
-    if not st.session_state.chat_history:
-        st.info("No previous interactions found. Ask a follow-up question in 'Ask AI'!")
+    # 🔹 Search this session's analyses and questions
+    query_col, mode_col = st.columns([3, 1])
+    search_query = query_col.text_input("🔎 Search your analyses and questions")
+    search_mode = mode_col.selectbox("Match", search_index.modes)
+    search_kind = st.radio("In", ["Everything", "Analyses", "Questions"], horizontal=True)
+
+    if search_query:
+        search_index.backfill(session_store, session_id)
+        started = time.perf_counter()
+        results = search_index.search(
+            search_query, k=10, session_id=session_id, mode=search_mode,
+            kind={"Analyses": "analysis", "Questions": "chat"}.get(search_kind),
+        )
+        st.caption(f"{len(results)} matches in {(time.perf_counter() - started) * 1000:.1f} ms")
+        for result in results:
+            icon = "📝" if result["kind"] == "analysis" else "💬"
+            with st.expander(f"{icon} {result['title']} (score {result['score']})"):
+                st.caption(result["snippet"])
+                st.write(result["text"])
     else:
-        for q, r in st.session_state.chat_history:
-            st.markdown(f"**🧑‍⚕️ User:** {q}")
-            st.markdown(f"**🤖 AI:** {r}")
+        turn_count = session_store.count_chat_turns(session_id)
+        if not turn_count:
+            st.info("No previous interactions found. Ask a follow-up question in 'Ask AI'!")
+        else:
+            # Newest first, one page at a time
+            offset, limit = history_page(turn_count, "interactions_page")
+            for turn in session_store.list_chat_turns(session_id, offset, limit):
+                show_chat_turn(turn)
 
     if st.sidebar.button("🗑️ Clear Chat History"):
-        st.session_state.chat_history = []
+        session_store.clear_chat(session_id)
+        search_index.remove_session(session_id, "chat")
+        st.session_state.chat_engines = {}
         st.rerun()
 
+# ------------------- SEARCH FINDINGS -------------------
+elif page == "🔎 Search Findings":
+    st.title("🔎 Search Findings")
+    findings_store = pipeline.findings
+    st.caption(f"Structured findings from {findings_store.count(session_id)} of your analyses.")
+
+    facets = findings_store.facets(session_id)
+    text_query = st.text_input("Finding or recommendation contains")
+    modality_col, region_col, severity_col = st.columns(3)
+    modality = modality_col.selectbox("Modality", [""] + [value for value, _ in facets["modality"]])
+    body_region = region_col.selectbox("Body region", [""] + [value for value, _ in facets["body_region"]])
+    severity = severity_col.selectbox("Severity", [""] + SEVERITIES)
+    recommendation_query = st.text_input("Recommendation / treatment contains")
+
+    started = time.perf_counter()
+    results = findings_store.search(
+        text=text_query, body_region=body_region, severity=severity, modality=modality,
+        recommendation=recommendation_query, limit=200, session_id=session_id,
+    )
+    st.caption(f"{len(results)} matching analyses in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    if results:
+        st.dataframe(
+            [{
+                "Image": result["image_name"] or result["image_digest"][:12],
+                "Modality": result["modality"],
+                "Body region": result["body_region"],
+                "Findings": "; ".join(result["findings"]),
+                "Analyzed": datetime.fromtimestamp(result["created_at"]).strftime("%Y-%m-%d %H:%M"),
+            } for result in results],
+            use_container_width=True, hide_index=True,
+        )
+        labels = {f"{result['image_name'] or result['image_digest'][:12]} ({result['key'][:8]})": result["key"] for result in results}
+        opened = st.selectbox("Open report", [""] + list(labels))
+        if opened:
+            st.markdown(render_markdown(findings_store.get(labels[opened])))
+
 # ------------------- HOW IT WORKS -------------------
 elif page == "ℹ️ How It Works":
     st.title("ℹ️ How MediGen Catalyst Works")
@@ -259,3 +761,69 @@ elif page == "ℹ️ How It Works":
         st.image("workflow_diagram.png", caption="Working of Medigen-Catalyst")
     except:
         st.warning("Workflow diagram not found. Please add 'workflow_diagram.png' to your app directory.")
+
+# ------------------- ADMIN: PERFORMANCE -------------------
+elif page == "📊 Admin":
+    st.title("📊 Performance & Usage")
+    st.caption("Process-wide figures for this server since it started (all sessions).")
+
+    rows = metrics.summary()
+    if rows:
+        total_cost = sum(row["cost_usd"] for row in rows)
+        total_tokens = sum(row["input_tokens"] + row["output_tokens"] for row in rows)
+        model_calls = sum(row["count"] for row in rows if row["operation"].startswith("model."))
+        calls_col, tokens_col, cost_col = st.columns(3)
+        calls_col.metric("Model calls", model_calls)
+        tokens_col.metric("Tokens", f"{total_tokens:,}")
+        cost_col.metric("Estimated cost", f"${total_cost:.2f}")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No instrumented operations recorded yet. Analyze an image to collect timings.")
+
+    cache_stats = analysis_cache.stats()
+    st.write(
+        f"**Analysis cache:** {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} entries"
+    )
+    st.write(f"**Scheduler:** {pipeline.scheduler.stats}, queue depth {pipeline.scheduler.queue_depth()}")
+    qa_stats = qa_cache.stats()
+    st.write(
+        f"**Q&A cache:** {qa_stats['exact_hits']} exact + {qa_stats['similar_hits']} similar hits / {qa_stats['misses']} misses "
+        f"({qa_stats['hit_rate']:.0%} hit rate), {qa_stats['entries']} answers, {qa_stats['evictions']} evicted, {qa_stats['expired']} expired"
+    )
+    job_stats = job_queue.stats()
+    queued_col, running_col, utilisation_col = st.columns(3)
+    queued_col.metric("Queued analysis jobs", job_stats["queued"])
+    running_col.metric("Busy job workers", f"{job_stats['running']}/{job_stats['workers']}")
+    utilisation_col.metric("Worker utilisation (average)", f"{job_stats['average_utilisation']:.0%}")
+    st.caption(f"Jobs: {job_stats['submitted']} submitted, {job_stats['completed']} completed, {job_stats['failed']} failed, {job_stats['cancelled']} cancelled")
+    if pipeline.triage is not None:
+        triage_stats = pipeline.triage.stats()
+        tier_latency = {row["operation"]: row["p50_ms"] for row in rows if row["operation"] in ("triage.local", "model.triage", "model.analysis")}
+        st.write(
+            f"**Triage ({pipeline.triage.mode}):** {triage_stats['checked']} screened, "
+            f"{triage_stats['rejected_local']} rejected locally, {triage_stats['rejected_model']} by the flash model "
+            f"({triage_stats['pro_calls_avoided']:.0%} of analysis-model calls avoided); p50 local "
+            f"{tier_latency.get('triage.local', 0):.0f} ms, flash {tier_latency.get('model.triage', 0):.0f} ms, "
+            f"analysis {tier_latency.get('model.analysis', 0):.0f} ms"
+        )
+    prompt_stats = pipeline.prompts.stats()
+    if prompt_stats:
+        st.write("**Analysis cache by prompt template:**")
+        st.dataframe(prompt_stats, use_container_width=True, hide_index=True)
+    upload_stats = upload_blobs.stats()
+    st.write(
+        f"**Upload store:** {upload_stats['blobs']} uploads ({upload_stats['bytes'] / (1024 * 1024):.1f} MB on disk) "
+        f"held by {upload_stats['sessions']} sessions, largest session {upload_stats['largest_session_bytes'] / (1024 * 1024):.1f} MB; "
+        f"{upload_stats['shared']} uploads shared, {upload_stats['rejected']} over the session limit, "
+        f"{upload_stats['released_sessions']} idle sessions released"
+    )
+    thumbnail_stats = thumbnails.stats()
+    st.write(
+        f"**Thumbnails:** {thumbnail_stats['hits']} hits / {thumbnail_stats['misses']} misses, "
+        f"{thumbnail_stats['entries']} cached ({thumbnail_stats['bytes'] / 1024:.0f} KB)"
+    )
+
+    st.download_button("📥 Export Prometheus metrics", data=metrics.prometheus(), file_name="medigen_metrics.prom", mime="text/plain")
+    with st.expander("Prometheus exposition"):
+        st.code(metrics.prometheus(), language="text")
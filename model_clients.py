@@ -0,0 +1,126 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+_configure_lock = threading.Lock()
+_configured_api_key = None
+_claimed_api_key = None
+
+
+# google.generativeai (and grpc/protobuf behind it) is slow to import, so load it on first use
+def load_genai():
+    import google.generativeai as genai
+
+    return genai
+
+
+# genai keeps one API key per process, so two registries with different keys would keep switching it and send
+# requests under each other's key. The first key used in a process wins; a different one is refused.
+def claim_api_key(api_key):
+    global _claimed_api_key
+    with _configure_lock:
+        if _claimed_api_key is None:
+            _claimed_api_key = api_key
+        elif api_key != _claimed_api_key:
+            raise ValueError(
+                "This server is already using a different Google API key. Keys cannot be mixed within one process; "
+                "run a separate server for this key."
+            )
+
+
+# Configure the genai client once per process (it is global), not on every Streamlit rerun
+def configure_genai(api_key):
+    global _configured_api_key
+    with _configure_lock:
+        if api_key and api_key != _configured_api_key:
+            load_genai().configure(api_key=api_key)
+            _configured_api_key = api_key
+
+
+# Process-wide registry of configured GenerativeModel instances.
+# Models (and the client connections behind them) are built once per configuration and shared
+# by every rerun, session and worker thread on this server.
+# Nothing is imported or configured until the first model is requested.
+class ModelRegistry:
+    def __init__(self, api_key=None):
+        if api_key:
+            claim_api_key(api_key)
+        self.api_key = api_key
+        self._models = {}
+        self._cached_models = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name, generation_config=None, safety_settings=None, system_instruction=None):
+        key = (
+            model_name,
+            json.dumps(generation_config, sort_keys=True),
+            json.dumps(safety_settings, sort_keys=True),
+            system_instruction,
+        )
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                configure_genai(self.api_key)
+                model = load_genai().GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                    system_instruction=system_instruction,
+                )
+                self._models[key] = model
+        return model
+
+    # Like get(), but the system instruction lives in a Gemini context cache, so it is processed and billed
+    # at the cached rate instead of on every call. Needs a versioned model and enough tokens for the API's
+    # minimum cache size; when creation fails the plain system-instruction model is used from then on.
+    # Caches are recreated shortly before their TTL runs out.
+    def get_cached(self, model_name, generation_config, safety_settings, system_instruction, ttl_minutes=60):
+        key = (model_name, json.dumps(generation_config, sort_keys=True), json.dumps(safety_settings, sort_keys=True), system_instruction)
+        with self._lock:
+            entry = self._cached_models.get(key)
+            if entry is not None and (entry[0] is None or time.time() < entry[1]):
+                model = entry[0]
+            else:
+                model = None
+                try:
+                    configure_genai(self.api_key)
+                    genai = load_genai()
+                    from google.generativeai import caching
+
+                    cached_content = caching.CachedContent.create(
+                        model=model_name,
+                        system_instruction=system_instruction,
+                        ttl=datetime.timedelta(minutes=ttl_minutes),
+                    )
+                    model = genai.GenerativeModel.from_cached_content(
+                        cached_content=cached_content,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                    )
+                except Exception:
+                    pass  # too small to cache, unversioned model, or caching unavailable
+                self._cached_models[key] = (model, time.time() + ttl_minutes * 60 * 0.9)
+        return model or self.get(model_name, generation_config, safety_settings, system_instruction)
+
+    def __len__(self):
+        return len(self._models)
+
+
+# Model backend chosen by MEDIGEN_MODEL_BACKEND: "gemini" (default) or "fake", a local stand-in with
+# MEDIGEN_FAKE_LATENCY seconds per response and MEDIGEN_FAKE_ERROR_RATE simulated 503s, for benchmarks
+# and offline development
+def create_model_registry(api_key=None, backend=None):
+    backend = (backend or os.getenv("MEDIGEN_MODEL_BACKEND", "gemini")).lower()
+    if backend == "fake":
+        from fake_models import FakeModelRegistry
+
+        return FakeModelRegistry(
+            latency=float(os.getenv("MEDIGEN_FAKE_LATENCY", "1.0")),
+            error_rate=float(os.getenv("MEDIGEN_FAKE_ERROR_RATE", "0")),
+            seed=int(os.getenv("MEDIGEN_FAKE_SEED", "0")),
+        )
+    if backend != "gemini":
+        raise ValueError(f"Unknown MEDIGEN_MODEL_BACKEND: {backend!r} (expected 'gemini' or 'fake')")
+    return ModelRegistry(api_key)
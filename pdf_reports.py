@@ -0,0 +1,162 @@
+import hashlib
+import html
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+
+from instrumentation import metrics
+
+try:
+    import markdown
+except ImportError:  # optional: reports fall back to preformatted text
+    markdown = None
+
+REPORT_CSS = """
+@page { size: A4; margin: 2cm; @bottom-right { content: "Page " counter(page) " of " counter(pages); font-size: 9pt; color: #666; } }
+body { font-family: "DejaVu Sans", Arial, sans-serif; font-size: 11pt; line-height: 1.45; color: #222; }
+header { border-bottom: 2px solid #1f6f8b; margin-bottom: 1em; padding-bottom: 0.4em; }
+header h1 { font-size: 18pt; color: #1f6f8b; margin: 0; }
+header p { margin: 0.2em 0 0; color: #666; font-size: 9pt; }
+h1, h2, h3 { color: #1f6f8b; }
+pre { white-space: pre-wrap; font-family: inherit; }
+.report { page-break-after: always; }
+.report:last-child { page-break-after: auto; }
+.disclaimer { margin-top: 2em; font-size: 9pt; color: #666; border-top: 1px solid #ccc; padding-top: 0.5em; }
+"""
+
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>$title</title></head>
+<body>$sections</body></html>""")
+
+SECTION_TEMPLATE = Template("""<section class="report">
+<header><h1>MediGen Catalyst Analysis Report</h1><p>$title</p></header>
+$body
+<p class="disclaimer">AI-generated analysis. Consult with a Doctor before making any decisions.</p>
+</section>""")
+
+
+# Convert the model's markdown into safe HTML
+def markdown_to_html(report_text):
+    if markdown is not None:
+        return markdown.markdown(html.escape(report_text, quote=False), extensions=["sane_lists"])
+    return f"<pre>{html.escape(report_text)}</pre>"
+
+
+def report_key(title, report_text):
+    return hashlib.sha256(f"{title}\0{report_text}".encode("utf-8")).hexdigest()
+
+
+# Renders analysis reports to in-memory PDFs on a background worker, caching finished PDFs by content
+class ReportRenderer:
+    def __init__(self, max_workers=1, max_cached_bytes=64 * 1024 * 1024):
+        self.max_cached_bytes = max_cached_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-render")
+        self._pdfs = OrderedDict()
+        self._cached_bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stylesheet = None
+
+    def _render(self, sections_html, title):
+        from weasyprint import CSS, HTML
+
+        if self._stylesheet is None:
+            self._stylesheet = CSS(string=REPORT_CSS)
+        document = PAGE_TEMPLATE.substitute(title=html.escape(title), sections=sections_html)
+        buffer = io.BytesIO()
+        with metrics.timer("generate_pdf"):
+            HTML(string=document).write_pdf(buffer, stylesheets=[self._stylesheet])
+        return buffer.getvalue()
+
+    def _section(self, title, report_text):
+        return SECTION_TEMPLATE.substitute(title=html.escape(title), body=markdown_to_html(report_text))
+
+    def _store(self, key, pdf_bytes):
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._pdfs:
+                return
+            self._pdfs[key] = pdf_bytes
+            self._cached_bytes += len(pdf_bytes)
+            while self._cached_bytes > self.max_cached_bytes and len(self._pdfs) > 1:
+                _, evicted = self._pdfs.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def _run(self, key, build, *args):
+        output = build(*args)
+        self._store(key, output)
+        return output
+
+    # Queue a job unless its output is cached or already queued; returns the cache key.
+    # Failed jobs stay in _pending (so result() can report the error) until they are resubmitted.
+    def _submit(self, key, build, *args):
+        with self._lock:
+            future = self._pending.get(key)
+            if key not in self._pdfs and (future is None or future.done()):
+                self._pending[key] = self._executor.submit(self._run, key, build, *args)
+        return key
+
+    # Queue a report for rendering
+    def submit(self, title, report_text):
+        return self._submit(report_key(title, report_text), self._render, self._section(title, report_text), title)
+
+    # Queue one combined PDF for many (title, report_text) pairs
+    def submit_bundle(self, reports):
+        reports = list(reports)
+        key = report_key("bundle", "\0".join(f"{title}\0{text}" for title, text in reports))
+        sections = "\n".join(self._section(title, text) for title, text in reports)
+        return self._submit(key, self._render, sections, f"{len(reports)} analyses")
+
+    # Queue a ZIP with one PDF per report
+    def submit_zip(self, reports):
+        reports = list(reports)
+        key = report_key("zip", "\0".join(f"{title}\0{text}" for title, text in reports))
+        return self._submit(key, self._build_zip, reports)
+
+    def _build_zip(self, reports):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for title, report_text in reports:
+                key = report_key(title, report_text)
+                with self._lock:
+                    pdf_bytes = self._pdfs.get(key)
+                if pdf_bytes is None:
+                    # Already on the worker thread, so render inline rather than queueing behind ourselves
+                    pdf_bytes = self._render(self._section(title, report_text), title)
+                    self._store(key, pdf_bytes)
+                archive.writestr(pdf_filename(title), pdf_bytes)
+        return buffer.getvalue()
+
+    # Finished output for a key, or None while it is still rendering.
+    # Raises the rendering error if the job failed.
+    def result(self, key):
+        with self._lock:
+            pdf_bytes = self._pdfs.get(key)
+            if pdf_bytes is not None:
+                self._pdfs.move_to_end(key)
+                return pdf_bytes
+            future = self._pending.get(key)
+        if future is not None and future.done():
+            return future.result()
+        return None
+
+    # Block until a queued job finishes and return its output
+    def wait(self, key):
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        return self.result(key)
+
+    # Render synchronously (still served from the cache when possible)
+    def render(self, title, report_text):
+        return self.wait(self.submit(title, report_text))
+
+
+# Download-friendly file name for a report
+def pdf_filename(title):
+    stem = "".join(c if c.isalnum() or c in "-_" else "_" for c in title.rsplit(".", 1)[0]).strip("_")
+    return f"{stem or 'analysis'}_report.pdf"
@@ -0,0 +1,148 @@
+import threading
+from collections import defaultdict, namedtuple
+
+# One analysis prompt. The fixed instructions go in the model's system-instruction slot (sent once per
+# model instance, and eligible for context caching); only the short request text travels with each image.
+# `structured_system_instruction` is the precompiled variant used when the model must answer in JSON.
+PromptTemplate = namedtuple(
+    "PromptTemplate",
+    ["name", "version", "modality", "label", "system_instruction", "request_text", "structured_system_instruction"],
+)
+
+REQUEST_TEXT = "Analyze this medical image following your instructions."
+
+# Original four-heading prompt (kept for the single-page app, medigen_catalyst.py)
+GENERAL_V1 = """
+As a highly skilled medical practitioner specializing in image analysis, you are tasked with examining medical images for a renowned hospital. Your expertise is crucial in identifying any anomalies, diseases, or health issues that may be present in the image.
+
+Your Responsibilities include:
+
+1. Detailed Analysis: Thoroughly analyze each image, focusing on identifying any abnormal findings.
+2. Findings Report: Document all observed anomalies or signs of disease. Clearly articulate these findings in a structured form.
+3. Recommendation and Next Steps: Based on your analysis, suggest potential next steps, including further tests or treatments as applicable.
+4. Treatment Suggestions: If appropriate, recommend possible treatment options or interventions.
+
+Important Notes:
+1. Scope of Response: Only respond if the image pertains to human health issues.
+2. Clarity of Image: In cases where the image quality impedes clear analysis, note that certain aspects are 'Unable to be determined based on the provided image.'
+3. Disclaimer: Accompany your analysis with the disclaimer "Consult with a Doctor before making any decisions."
+4. Your insights are invaluable in guiding clinical decisions. Please proceed with the analysis, adhering to the structured approach outlined above.
+
+Please provide me an output response with these 4 headings Detailed Analysis,Findings Report,Recommendation and Next Steps,Treatment Suggestions
+"""
+
+# Adds medications & ointments and home-made remedies
+GENERAL_V2 = """
+As a highly skilled medical practitioner specializing in image analysis, you are tasked with examining medical images for a renowned hospital. Your expertise is crucial in identifying any anomalies, diseases, or health issues that may be present in the image.
+
+Your Responsibilities include:
+
+1. Detailed Analysis: Thoroughly analyze each image, focusing on identifying any abnormal findings.
+2. Findings Report: Document all observed anomalies or signs of disease. Clearly articulate these findings in a structured form.
+3. Recommendation and Next Steps: Based on your analysis, suggest potential next steps, including further tests or treatments as applicable.
+4. Treatment Suggestions: If appropriate, recommend possible treatment options or interventions.
+5. Medications & Ointments - If applicable, suggest medications (with dosage) and ointments based on the diagnosis.
+6.  Home-Made Remedies - If suitable, provide safe and effective natural remedies that may help alleviate symptoms.
+
+⚠️ Important Notes:
+1. Scope of Response: Only respond if the image pertains to human health issues.
+2. Only provide medications if there is a clear diagnosis.
+3. Ensure that your recommendations align with standard medical practices.
+4. Clarity of Image: In cases where the image quality impedes clear analysis, note that certain aspects are 'Unable to be determined based on the provided image.'
+5. Home-made remedies should be **safe, simple, and widely recognized** (e.g., warm compress, turmeric milk, saline rinse).
+6. Disclaimer: Accompany your analysis with the disclaimer "Consult with a Doctor before making any decisions."
+7. Your insights are invaluable in guiding clinical decisions. Please proceed with the analysis, adhering to the structured approach outlined above.
+
+
+Please provide me an output response with these 4 headings Detailed Analysis,Findings Report,Recommendation and Next Steps,Treatment Suggestions, medications and ointments, home-made remedies 
+"""
+
+RADIOLOGY_GUIDANCE = """
+Modality guidance (radiology: X-ray, CT, MRI, ultrasound):
+- State the modality, view/plane and body region before the findings, and comment on technical quality (positioning, exposure, artifacts).
+- Describe findings with location, size estimate, density/signal/echogenicity and laterality, and compare both sides where applicable.
+- Separate acute or urgent findings (e.g. fracture, pneumothorax, free air, mass effect) and list them first.
+- Recommend further imaging or specialist review rather than medications when a finding needs confirmation.
+"""
+
+DERMATOLOGY_GUIDANCE = """
+Modality guidance (dermatology: clinical or dermoscopic skin photos):
+- Describe the lesion morphology: type (macule, papule, plaque, vesicle, ...), color, border, symmetry, size estimate, distribution and surface changes.
+- Apply the ABCDE criteria to pigmented lesions and flag any feature suspicious for melanoma or other skin cancer for urgent in-person review.
+- Give a short differential diagnosis, most likely first.
+- Topical treatments and home-made remedies are appropriate only for clearly benign, common conditions.
+"""
+
+
+# Versioned prompt templates. Registering a new version of a name makes it the default for that name;
+# older versions stay available so cached analyses and comparisons keep working. Cache hits and misses
+# are counted per template version.
+class PromptRegistry:
+    def __init__(self, structured_instructions=""):
+        self.structured_instructions = structured_instructions
+        self._templates = {}
+        self._latest = {}
+        self._counts = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self._lock = threading.Lock()
+
+    def register(self, name, version, system_instruction, modality="general", label=None, request_text=REQUEST_TEXT):
+        template = PromptTemplate(
+            name=name,
+            version=version,
+            modality=modality,
+            label=label or name.title(),
+            system_instruction=system_instruction.strip(),
+            request_text=request_text,
+            structured_system_instruction=(system_instruction.strip() + "\n" + self.structured_instructions).strip(),
+        )
+        with self._lock:
+            self._templates[(name, version)] = template
+            if version >= self._latest.get(name, 0):
+                self._latest[name] = version
+        return template
+
+    # Latest version of a template unless a version is pinned
+    def get(self, name="general", version=None):
+        with self._lock:
+            version = version if version is not None else self._latest.get(name)
+            template = self._templates.get((name, version))
+        if template is None:
+            raise KeyError(f"Unknown prompt template: {name}@{version}")
+        return template
+
+    # Latest template of each name, for choosing a modality in the UI
+    def latest(self):
+        with self._lock:
+            return [self._templates[(name, version)] for name, version in sorted(self._latest.items())]
+
+    def record(self, template, hit):
+        with self._lock:
+            self._counts[template_id(template)]["hits" if hit else "misses"] += 1
+
+    # Analysis cache hit rate per template version
+    def stats(self):
+        with self._lock:
+            rows = []
+            for key, counts in sorted(self._counts.items()):
+                lookups = counts["hits"] + counts["misses"]
+                rows.append({
+                    "template": key,
+                    "hits": counts["hits"],
+                    "misses": counts["misses"],
+                    "hit_rate": round(counts["hits"] / lookups, 3) if lookups else 0.0,
+                })
+            return rows
+
+
+def template_id(template):
+    return f"{template.name}@{template.version}"
+
+
+# Registry with the built-in templates. `structured_instructions` is appended to the structured variants.
+def default_registry(structured_instructions=""):
+    registry = PromptRegistry(structured_instructions)
+    registry.register("general", 1, GENERAL_V1, label="General (four headings)")
+    registry.register("general", 2, GENERAL_V2, label="General")
+    registry.register("radiology", 1, GENERAL_V2 + RADIOLOGY_GUIDANCE, modality="radiology", label="Radiology (X-ray, CT, MRI, ultrasound)")
+    registry.register("dermatology", 1, GENERAL_V2 + DERMATOLOGY_GUIDANCE, modality="dermatology", label="Dermatology (skin photos)")
+    return registry
@@ -0,0 +1,145 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_NUMBER = re.compile(r"\d+")
+# Words that do not change what is being asked. Negations, numbers and body parts are kept on purpose.
+FILLER_WORDS = frozenset(
+    "a an the is are am be this that these those it its i me my we our you your please can could would should "
+    "will do does did tell explain about so just really kind of any what which".split()
+)
+# A cached answer is only reused when the questions agree on these exactly ("safe" vs "not safe", "5 mg" vs "50 mg")
+NEGATIONS = frozenset("no not never without cannot dont doesnt isnt arent shouldnt cant wont".split())
+# ...and on these, which combine things ("take ibuprofen" vs "take it with ibuprofen")
+QUALIFIERS = frozenset("with and or plus together alongside instead after before during while".split())
+
+QAMatch = namedtuple("QAMatch", ["question", "answer", "similarity", "exact"])
+
+
+# Lowercased content words of a question, apostrophes folded ("don't" -> "dont")
+def question_tokens(question):
+    return [token for token in _TOKEN.findall(question.lower().replace("'", "").replace("’", "")) if token not in FILLER_WORDS]
+
+
+def normalize_question(question):
+    return " ".join(question_tokens(question))
+
+
+# Sparse word + character-trigram features (the same idea as search_index.hashing_embedding, without numpy),
+# so spelling variants and shared stems still match
+def question_features(tokens):
+    features = Counter()
+    for token in tokens:
+        features["w:" + token] += 2
+        for i in range(max(1, len(token) - 2)):
+            features["t:" + token[i:i + 3]] += 1
+    norm = math.sqrt(sum(value * value for value in features.values())) or 1.0
+    return {feature: value / norm for feature, value in features.items()}
+
+
+def _guard(tokens):
+    return frozenset(token for token in tokens if token in NEGATIONS or token in QUALIFIERS) | frozenset(_NUMBER.findall(" ".join(tokens)))
+
+
+class _Entry:
+    def __init__(self, question, answer, tokens):
+        self.question = question
+        self.answer = answer
+        self.features = question_features(tokens)
+        self.guard = _guard(tokens)
+        self.created_at = time.time()
+        self.hits = 0
+
+
+# Process-wide cache of follow-up answers, keyed on an analysis key (the app makes it per session) and the
+# question. A lookup first tries the normalized question exactly, then the most similar earlier question about
+# the same analysis (cosine of word/trigram features >= `threshold`, with identical negations, qualifiers and
+# numbers). Entries expire after `ttl_seconds`; beyond `max_entries` the least recently used are evicted.
+class QACache:
+    def __init__(self, threshold=0.85, ttl_seconds=24 * 3600, max_entries=2000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_analysis = {}
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._lock = threading.Lock()
+
+    def get(self, analysis_digest, question):
+        tokens = question_tokens(question)
+        if not tokens:
+            return None
+        normalized = " ".join(tokens)
+        now = time.time()
+        with self._lock:
+            match, similarity = self._entries.get((analysis_digest, normalized)), 1.0
+            if match is not None and self._expired(match, now):
+                self._remove((analysis_digest, normalized), "expired")
+                match = None
+            exact = match is not None
+            if match is None:
+                match, similarity = self._most_similar(analysis_digest, tokens, now)
+            if match is None:
+                self._stats["misses"] += 1
+                return None
+            match.hits += 1
+            self._stats["exact_hits" if exact else "similar_hits"] += 1
+            self._entries.move_to_end((analysis_digest, normalize_question(match.question)))
+            return QAMatch(match.question, match.answer, round(similarity, 3), exact)
+
+    def put(self, analysis_digest, question, answer):
+        tokens = question_tokens(question)
+        if not tokens or not answer:
+            return
+        key = (analysis_digest, " ".join(tokens))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(question, answer, tokens)
+            self._by_analysis.setdefault(analysis_digest, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)), "evictions")
+
+    # Forget every answer about one analysis (e.g. after it was re-run)
+    def invalidate(self, analysis_digest):
+        with self._lock:
+            for key in list(self._by_analysis.get(analysis_digest, ())):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry.created_at > self.ttl_seconds
+
+    def _most_similar(self, analysis_digest, tokens, now):
+        features, guard = question_features(tokens), _guard(tokens)
+        best, best_similarity = None, self.threshold
+        for key in list(self._by_analysis.get(analysis_digest, ())):
+            entry = self._entries[key]
+            if self._expired(entry, now):
+                self._remove(key, "expired")
+                continue
+            if entry.guard != guard:
+                continue
+            similarity = sum(value * entry.features.get(feature, 0.0) for feature, value in features.items())
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best, best_similarity
+
+    def _remove(self, key, reason=None):
+        self._entries.pop(key, None)
+        keys = self._by_analysis.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_analysis[key[0]]
+        if reason:
+            self._stats[reason] += 1
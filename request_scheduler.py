@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+# Priorities: lower runs first, so clicks in the UI overtake queued batch work
+INTERACTIVE = 0
+BATCH = 10
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "BadGateway", "GatewayTimeout",
+}
+
+
+# Quota (429) and server-side (5xx) errors are worth retrying; anything else is surfaced immediately
+def is_retryable(error):
+    for attribute in ("code", "status_code", "status"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+            return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+# Classic token bucket: `rate` tokens per second, bursts of up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared front door for model calls: rate limiting, retries with backoff, priorities and coalescing.
+# Calls are queued by priority and executed by a fixed pool of worker threads. Calls submitted with the
+# same key while one is already queued or running share its Future instead of making another API call.
+class RequestScheduler:
+    def __init__(self, requests_per_minute=60, burst=None, max_workers=8, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max(1, requests_per_minute // 10))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"submitted": 0, "coalesced": 0, "retries": 0, "completed": 0, "failed": 0}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._condition = threading.Condition()
+        for index in range(max_workers):
+            threading.Thread(target=self._worker, name=f"model-scheduler-{index}", daemon=True).start()
+
+    # Queue fn() and return a Future for its result
+    def submit(self, fn, priority=INTERACTIVE, key=None):
+        with self._condition:
+            if key is not None and key in self._inflight:
+                self.stats["coalesced"] += 1
+                return self._inflight[key]
+            future = Future()
+            if key is not None:
+                self._inflight[key] = future
+            self.stats["submitted"] += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), fn, key, future))
+            self._condition.notify()
+        return future
+
+    # Queue fn() and block until it has run
+    def run(self, fn, priority=INTERACTIVE, key=None):
+        return self.submit(fn, priority, key).result()
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, fn, key, future = heapq.heappop(self._queue)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._call_with_retries(fn))
+                    self._count("completed")
+                except BaseException as e:
+                    future.set_exception(e)
+                    self._count("failed")
+            with self._condition:
+                if key is not None and self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _call_with_retries(self, fn):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # Exponential backoff with full jitter so retries from many sessions don't synchronize
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                self._count("retries")
+                time.sleep(delay)
+
+    def _count(self, name):
+        with self._condition:
+            self.stats[name] += 1
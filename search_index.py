@@ -0,0 +1,261 @@
+import hashlib
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from instrumentation import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "i you your my me can should could would what which who how do does did not no any".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+# Short excerpt around the first query term found in the text
+def snippet(text, terms, width=160):
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms if lowered.find(term) >= 0]
+    start = max(0, min(positions) - width // 3) if positions else 0
+    excerpt = text[start:start + width].replace("\n", " ").strip()
+    return ("…" if start else "") + excerpt + ("…" if start + width < len(text) else "")
+
+
+# Incremental BM25 keyword index. Adding a document under an existing id replaces it.
+class InvertedIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._terms = {}
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            self._postings[term][doc_id] = count
+        self._terms[doc_id] = list(counts)
+        length = sum(counts.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id):
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(doc_id):
+            del self._postings[term][doc_id]
+            if not self._postings[term]:
+                del self._postings[term]
+
+    # Top-k (score, doc_id) pairs. `candidates` restricts scoring to a set of documents (walked directly when
+    # it is smaller than a term's posting list); `accept(doc_id)` filters the rest.
+    def search(self, query, k=10, accept=None, candidates=None):
+        if not self._lengths:
+            return []
+        doc_count = len(self._lengths)
+        lengths = self._lengths
+        k1 = self.k1
+        base = k1 * (1 - self.b)
+        slope = k1 * self.b / (self._total_length / doc_count or 1)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)) * (k1 + 1)
+            if candidates is not None and len(candidates) < len(postings):
+                matches = ((doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings)
+            else:
+                matches = postings.items()
+            for doc_id, count in matches:
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                if accept is not None and not accept(doc_id):
+                    continue
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * count / (count + base + slope * lengths[doc_id])
+        return heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()))
+
+
+# Local embedding without a model download: hashed word and character-trigram features, L2-normalized.
+# Catches spelling variants and shared word stems that exact keyword matching misses.
+def hashing_embedding(text, dimensions=256):
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in tokenize(text):
+        features = [token] + [token[i:i + 3] for i in range(max(1, len(token) - 2))]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+# Brute-force cosine search over a growing NumPy matrix (capacity doubles, so adds are amortized O(1)).
+# Needs numpy. `embed` maps text to a vector; the default is hashing_embedding.
+class EmbeddingIndex:
+    def __init__(self, embed=None, dimensions=256, initial_capacity=1024):
+        if np is None:
+            raise RuntimeError("The embedding index needs numpy (pip install numpy)")
+        self.embed = embed or (lambda text: hashing_embedding(text, dimensions))
+        self.dimensions = dimensions
+        self._vectors = np.zeros((initial_capacity, dimensions), dtype=np.float32)
+        self._live = np.zeros(initial_capacity, dtype=bool)
+        self._ids = []
+        self._rows = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, doc_id, text):
+        vector = np.asarray(self.embed(text), dtype=np.float32)
+        row = self._rows.get(doc_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._vectors):
+                self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+                self._live = np.concatenate([self._live, np.zeros_like(self._live)])
+            self._ids.append(doc_id)
+            self._rows[doc_id] = row
+        self._vectors[row] = vector
+        self._live[row] = True
+
+    def remove(self, doc_id):
+        row = self._rows.pop(doc_id, None)
+        if row is not None:
+            self._live[row] = False
+
+    # Top-k (score, doc_id) pairs; `mask` is an optional boolean array over rows
+    def search(self, query, k=10, mask=None):
+        count = len(self._ids)
+        if not self._rows:
+            return []
+        scores = self._vectors[:count] @ np.asarray(self.embed(query), dtype=np.float32)
+        allowed = self._live[:count] if mask is None else self._live[:count] & mask[:count]
+        scores = np.where(allowed, scores, -np.inf)
+        k = min(k, int(allowed.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), self._ids[row]) for row in top if scores[row] > 0]
+
+    # Boolean row mask selecting the given documents, for search(mask=...)
+    def mask(self, doc_ids):
+        selected = np.zeros(len(self._ids), dtype=bool)
+        rows = [self._rows[doc_id] for doc_id in doc_ids if doc_id in self._rows]
+        selected[rows] = True
+        return selected
+
+
+# Search over analyses and chat turns, filled incrementally as they are produced. Keyword (BM25) search is
+# always available; semantic search is added when numpy is installed, and "hybrid" fuses both rankings.
+# Documents carry a session id so each user only searches their own history.
+class SearchIndex:
+    def __init__(self, semantic=True, embed=None):
+        self.keywords = InvertedIndex()
+        self.embeddings = EmbeddingIndex(embed) if semantic and np is not None else None
+        self._documents = {}
+        self._sessions = defaultdict(set)
+        self._backfilled = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    @property
+    def modes(self):
+        return ["keyword", "semantic", "hybrid"] if self.embeddings is not None else ["keyword"]
+
+    def add(self, doc_id, session_id, kind, title, text, created_at=None):
+        with self._lock:
+            self._documents[doc_id] = {
+                "id": doc_id, "session_id": session_id, "kind": kind, "title": title, "text": text, "created_at": created_at,
+            }
+            self._sessions[session_id].add(doc_id)
+            self.keywords.add(doc_id, f"{title}\n{text}")
+            if self.embeddings is not None:
+                self.embeddings.add(doc_id, f"{title}\n{text}")
+
+    def add_analysis(self, session_id, record):
+        self.add(f"analysis:{session_id}:{record['digest']}", session_id, "analysis",
+                 record["image_name"], record["analysis"], record.get("updated_at"))
+
+    def add_chat_turn(self, session_id, turn):
+        self.add(f"chat:{session_id}:{turn['created_at']!r}", session_id, "chat",
+                 turn["question"], f"{turn['question']}\n{turn['answer']}", turn["created_at"])
+
+    # Drop a session's documents, optionally only one kind ("analysis" or "chat")
+    def remove_session(self, session_id, kind=None):
+        with self._lock:
+            for doc_id in list(self._sessions.get(session_id, ())):
+                if kind is None or self._documents[doc_id]["kind"] == kind:
+                    self._sessions[session_id].discard(doc_id)
+                    del self._documents[doc_id]
+                    self.keywords.remove(doc_id)
+                    if self.embeddings is not None:
+                        self.embeddings.remove(doc_id)
+
+    # Index a session's stored history once per process (e.g. after a restart with a persistent store)
+    def backfill(self, session_store, session_id):
+        with self._lock:
+            if session_id in self._backfilled:
+                return
+            self._backfilled.add(session_id)
+        for record in session_store.list_analyses(session_id):
+            self.add_analysis(session_id, record)
+        for turn in session_store.list_chat_turns(session_id):
+            self.add_chat_turn(session_id, turn)
+
+    # Top-k matches as dicts with score and snippet, best first
+    def search(self, query, k=10, session_id=None, kind=None, mode="keyword"):
+        if not query.strip():
+            return []
+        if mode != "keyword" and self.embeddings is None:
+            mode = "keyword"
+        with self._lock, metrics.timer(f"search.{mode}"):
+            candidates = self._sessions.get(session_id, set()) if session_id is not None else None
+            accept = (lambda doc_id: self._documents[doc_id]["kind"] == kind) if kind is not None else None
+
+            rankings = []
+            if mode in ("keyword", "hybrid"):
+                rankings.append(self.keywords.search(query, k * 2 if mode == "hybrid" else k, accept, candidates))
+            if mode in ("semantic", "hybrid"):
+                mask = None
+                if session_id is not None or kind is not None:
+                    scope = candidates if candidates is not None else self._documents
+                    mask = self.embeddings.mask(doc_id for doc_id in scope if accept is None or accept(doc_id))
+                rankings.append(self.embeddings.search(query, k * 2 if mode == "hybrid" else k, mask))
+
+            if len(rankings) == 1:
+                ranked = rankings[0]
+            else:
+                # Reciprocal rank fusion: robust to the two scores living on different scales
+                fused = defaultdict(float)
+                for ranking in rankings:
+                    for rank, (_, doc_id) in enumerate(ranking):
+                        fused[doc_id] += 1.0 / (60 + rank)
+                ranked = heapq.nlargest(k, ((score, doc_id) for doc_id, score in fused.items()))
+
+            terms = tokenize(query)
+            return [
+                dict(self._documents[doc_id], score=round(score, 4), snippet=snippet(self._documents[doc_id]["text"], terms))
+                for score, doc_id in ranked[:k]
+            ]
@@ -0,0 +1,414 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from analysis_cache import DEFAULT_CACHE_DIR
+
+# Per-user history (analyses, chat turns, selected image) kept outside st.session_state so it survives a
+# refresh and can be shared by several app replicas. Every backend offers the same methods:
+#   put_blob / get_blob                      image bytes, content-addressed by digest
+#   save_analysis / get_analysis             one report per image digest and session
+#   list_analyses / count_analyses           newest first, paged with offset/limit
+#   add_chat_turn / list_chat_turns / count_chat_turns   optionally filtered by image digest
+#   set_selected / get_selected              the image "Ask AI" talks about
+#   clear_analyses / clear_chat
+
+
+# Random, URL-safe session identifier
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+# Accept only identifiers we could have issued (they end up in the URL and in store keys)
+def is_valid_session_id(session_id):
+    return isinstance(session_id, str) and len(session_id) == 32 and all(c in "0123456789abcdef" for c in session_id)
+
+
+def _page(items, offset, limit):
+    return items[offset:offset + limit] if limit is not None else items[offset:]
+
+
+# Default backend: plain dicts in this process. History survives a page refresh but not a restart,
+# and is not shared between replicas. Blobs and sessions are evicted least-recently-used.
+class MemorySessionStore:
+    def __init__(self, max_blob_bytes=256 * 1024 * 1024, max_sessions=1000):
+        self.max_blob_bytes = max_blob_bytes
+        self.max_sessions = max_sessions
+        self._blobs = OrderedDict()
+        self._blob_bytes = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"analyses": OrderedDict(), "chat": [], "selected": None}
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def put_blob(self, digest, data):
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return
+        data = bytes(data)  # detach from the caller's buffer (e.g. a memory-mapped upload)
+        with self._lock:
+            if digest in self._blobs:
+                return
+            self._blobs[digest] = data
+            self._blob_bytes += len(data)
+            while self._blob_bytes > self.max_blob_bytes and len(self._blobs) > 1:
+                _, evicted = self._blobs.popitem(last=False)
+                self._blob_bytes -= len(evicted)
+
+    def get_blob(self, digest):
+        with self._lock:
+            data = self._blobs.get(digest)
+            if data is not None:
+                self._blobs.move_to_end(digest)
+            return data
+
+    def save_analysis(self, session_id, digest, image_name, analysis):
+        record = {"digest": digest, "image_name": image_name, "analysis": analysis, "updated_at": time.time()}
+        with self._lock:
+            analyses = self._session(session_id)["analyses"]
+            analyses.pop(digest, None)
+            analyses[digest] = record
+
+    def get_analysis(self, session_id, digest):
+        with self._lock:
+            record = self._session(session_id)["analyses"].get(digest)
+            return dict(record) if record else None
+
+    def list_analyses(self, session_id, offset=0, limit=None):
+        with self._lock:
+            records = list(reversed(self._session(session_id)["analyses"].values()))
+        return [dict(record) for record in _page(records, offset, limit)]
+
+    def count_analyses(self, session_id):
+        with self._lock:
+            return len(self._session(session_id)["analyses"])
+
+    def clear_analyses(self, session_id):
+        with self._lock:
+            self._session(session_id)["analyses"].clear()
+
+    def add_chat_turn(self, session_id, digest, question, answer):
+        turn = {"digest": digest, "question": question, "answer": answer, "created_at": time.time()}
+        with self._lock:
+            self._session(session_id)["chat"].append(turn)
+
+    def _turns(self, session_id, digest):
+        turns = self._session(session_id)["chat"]
+        return [turn for turn in turns if turn["digest"] == digest] if digest is not None else turns
+
+    def list_chat_turns(self, session_id, offset=0, limit=None, digest=None):
+        with self._lock:
+            turns = list(reversed(self._turns(session_id, digest)))
+        return [dict(turn) for turn in _page(turns, offset, limit)]
+
+    def count_chat_turns(self, session_id, digest=None):
+        with self._lock:
+            return len(self._turns(session_id, digest))
+
+    def clear_chat(self, session_id):
+        with self._lock:
+            self._session(session_id)["chat"] = []
+
+    def set_selected(self, session_id, digest, image_name):
+        with self._lock:
+            self._session(session_id)["selected"] = {"digest": digest, "image_name": image_name}
+
+    def get_selected(self, session_id):
+        with self._lock:
+            selected = self._session(session_id)["selected"]
+            return dict(selected) if selected else None
+
+
+# SQLite backend: history and blobs on disk, shared by every process that can reach the file
+# (several replicas on one host or on a shared volume). Blobs are evicted least-recently-used.
+class SQLiteSessionStore:
+    def __init__(self, path=None, max_blob_bytes=1024 * 1024 * 1024):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "sessions.sqlite3")
+        self.max_blob_bytes = max_blob_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs(last_access);
+            CREATE TABLE IF NOT EXISTS session_analyses (
+                session_id TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                image_name TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (session_id, digest)
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_analyses_updated ON session_analyses(session_id, updated_at);
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                digest TEXT,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_turns_session ON chat_turns(session_id, id);
+            CREATE INDEX IF NOT EXISTS idx_chat_turns_digest ON chat_turns(session_id, digest, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                selected_digest TEXT,
+                selected_name TEXT,
+                updated_at REAL NOT NULL
+            );"""
+        )
+        self._conn.commit()
+
+    def put_blob(self, digest, data):
+        now = time.time()
+        with self._lock:
+            updated = self._conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest)).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO blobs (digest, data, size, last_access) VALUES (?, ?, ?, ?)",
+                    (digest, sqlite3.Binary(data), len(data), now),
+                )
+                self._evict_blobs()
+            self._conn.commit()
+
+    def _evict_blobs(self):
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        if total <= self.max_blob_bytes:
+            return
+        for digest, size in self._conn.execute("SELECT digest, size FROM blobs ORDER BY last_access ASC").fetchall():
+            if total <= self.max_blob_bytes:
+                break
+            self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            total -= size
+
+    def get_blob(self, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+            self._conn.commit()
+            return bytes(row[0])
+
+    def save_analysis(self, session_id, digest, image_name, analysis):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_analyses (session_id, digest, image_name, analysis, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, digest, image_name, analysis, time.time()),
+            )
+            self._conn.commit()
+
+    def get_analysis(self, session_id, digest):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, image_name, analysis, updated_at FROM session_analyses WHERE session_id = ? AND digest = ?",
+                (session_id, digest),
+            ).fetchone()
+        return dict(zip(("digest", "image_name", "analysis", "updated_at"), row)) if row else None
+
+    def list_analyses(self, session_id, offset=0, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT digest, image_name, analysis, updated_at FROM session_analyses WHERE session_id = ? "
+                "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (session_id, -1 if limit is None else limit, offset),
+            ).fetchall()
+        return [dict(zip(("digest", "image_name", "analysis", "updated_at"), row)) for row in rows]
+
+    def count_analyses(self, session_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM session_analyses WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def clear_analyses(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_analyses WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def add_chat_turn(self, session_id, digest, question, answer):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chat_turns (session_id, digest, question, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, digest, question, answer, time.time()),
+            )
+            self._conn.commit()
+
+    def list_chat_turns(self, session_id, offset=0, limit=None, digest=None):
+        query = "SELECT digest, question, answer, created_at FROM chat_turns WHERE session_id = ?"
+        params = [session_id]
+        if digest is not None:
+            query += " AND digest = ?"
+            params.append(digest)
+        query += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(("digest", "question", "answer", "created_at"), row)) for row in rows]
+
+    def count_chat_turns(self, session_id, digest=None):
+        with self._lock:
+            if digest is None:
+                row = self._conn.execute("SELECT COUNT(*) FROM chat_turns WHERE session_id = ?", (session_id,)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT COUNT(*) FROM chat_turns WHERE session_id = ? AND digest = ?", (session_id, digest)
+                ).fetchone()
+        return row[0]
+
+    def clear_chat(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_turns WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def set_selected(self, session_id, digest, image_name):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, selected_digest, selected_name, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, digest, image_name, time.time()),
+            )
+            self._conn.commit()
+
+    def get_selected(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT selected_digest, selected_name FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return {"digest": row[0], "image_name": row[1]}
+
+
+# Redis backend for replicas on different hosts. Works with any client exposing the redis-py commands
+# used here (get/set/delete, hash, sorted-set and list commands), e.g. redis.Redis or a local stand-in
+# such as fakeredis. Session keys expire `ttl_seconds` after the last write.
+class RedisSessionStore:
+    def __init__(self, client, prefix="medigen", ttl_seconds=7 * 24 * 3600, blob_ttl_seconds=24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.blob_ttl_seconds = blob_ttl_seconds
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def _touch(self, *keys):
+        if self.ttl_seconds:
+            for key in keys:
+                self.client.expire(key, self.ttl_seconds)
+
+    def put_blob(self, digest, data):
+        self.client.set(self._key("blob", digest), bytes(data), ex=self.blob_ttl_seconds or None)
+
+    def get_blob(self, digest):
+        key = self._key("blob", digest)
+        data = self.client.get(key)
+        if data is not None and self.blob_ttl_seconds:
+            self.client.expire(key, self.blob_ttl_seconds)
+        return data
+
+    def save_analysis(self, session_id, digest, image_name, analysis):
+        now = time.time()
+        records = self._key("session", session_id, "analyses")
+        order = self._key("session", session_id, "analysis_order")
+        record = {"digest": digest, "image_name": image_name, "analysis": analysis, "updated_at": now}
+        self.client.hset(records, digest, json.dumps(record))
+        self.client.zadd(order, {digest: now})
+        self._touch(records, order)
+
+    def get_analysis(self, session_id, digest):
+        record = self.client.hget(self._key("session", session_id, "analyses"), digest)
+        return json.loads(record) if record is not None else None
+
+    def list_analyses(self, session_id, offset=0, limit=None):
+        end = -1 if limit is None else offset + limit - 1
+        digests = self.client.zrevrange(self._key("session", session_id, "analysis_order"), offset, end)
+        if not digests:
+            return []
+        records = self.client.hmget(self._key("session", session_id, "analyses"), digests)
+        return [json.loads(record) for record in records if record is not None]
+
+    def count_analyses(self, session_id):
+        return self.client.zcard(self._key("session", session_id, "analysis_order"))
+
+    def clear_analyses(self, session_id):
+        self.client.delete(self._key("session", session_id, "analyses"), self._key("session", session_id, "analysis_order"))
+
+    # Turns are appended to a per-session list and to a per-image list, so both views page without scanning
+    def add_chat_turn(self, session_id, digest, question, answer):
+        turn = json.dumps({"digest": digest, "question": question, "answer": answer, "created_at": time.time()})
+        keys = [self._key("session", session_id, "chat")]
+        if digest is not None:
+            keys.append(self._key("session", session_id, "chat", digest))
+        for key in keys:
+            self.client.rpush(key, turn)
+        self._touch(*keys)
+
+    def _chat_key(self, session_id, digest):
+        return self._key("session", session_id, "chat", digest) if digest is not None else self._key("session", session_id, "chat")
+
+    def list_chat_turns(self, session_id, offset=0, limit=None, digest=None):
+        # Lists are oldest first; negative indexes read them from the end
+        end = -1 - offset
+        start = 0 if limit is None else -offset - limit
+        turns = self.client.lrange(self._chat_key(session_id, digest), start, end)
+        return [json.loads(turn) for turn in reversed(turns)]
+
+    def count_chat_turns(self, session_id, digest=None):
+        return self.client.llen(self._chat_key(session_id, digest))
+
+    def clear_chat(self, session_id):
+        digests = {turn["digest"] for turn in self.list_chat_turns(session_id) if turn["digest"] is not None}
+        keys = [self._key("session", session_id, "chat")] + [self._key("session", session_id, "chat", digest) for digest in digests]
+        self.client.delete(*keys)
+
+    def set_selected(self, session_id, digest, image_name):
+        self.client.set(
+            self._key("session", session_id, "selected"),
+            json.dumps({"digest": digest, "image_name": image_name}),
+            ex=self.ttl_seconds or None,
+        )
+
+    def get_selected(self, session_id):
+        selected = self.client.get(self._key("session", session_id, "selected"))
+        return json.loads(selected) if selected is not None else None
+
+
+# Build the store named by a URL: "memory" (default), "sqlite" / "sqlite:///path/to/file.sqlite3",
+# or "redis://host:6379/0" (needs the optional redis package)
+def create_session_store(url=None):
+    url = url or os.getenv("MEDIGEN_SESSION_STORE", "memory")
+    if url == "memory":
+        return MemorySessionStore()
+    if url == "sqlite":
+        return SQLiteSessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The Redis session store needs the 'redis' package (pip install redis)") from e
+        return RedisSessionStore(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported session store: {url}")
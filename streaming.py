@@ -0,0 +1,59 @@
+import time
+
+from instrumentation import metrics
+
+
+# Wraps a streamed generate_content/send_message response: yields text chunks as they arrive
+# and records time-to-first-token and total latency once iteration finishes.
+# With a metric name, the call's latency and token usage are also reported to the metrics registry.
+class TimedStream:
+    def __init__(self, response, started_at=None, on_complete=None, metric=None):
+        self.response = response
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.on_complete = on_complete
+        self.metric = metric
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.text = ""
+        self.usage = None
+
+    def __iter__(self):
+        parts = []
+        for chunk in self.response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish-reason chunk or a safety block)
+                continue
+            if not text:
+                continue
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self.started_at
+            parts.append(text)
+            yield text
+        self.total_seconds = time.perf_counter() - self.started_at
+        self.text = "".join(parts)
+        self.usage = getattr(self.response, "usage_metadata", None)
+        if self.metric:
+            metrics.observe_model_call(self.metric, self.total_seconds, self.usage, self.first_token_seconds)
+        if self.on_complete:
+            self.on_complete(self)
+
+    # Prompt tokens billed for this request, if the API reported usage
+    @property
+    def input_tokens(self):
+        return getattr(self.usage, "prompt_token_count", None)
+
+
+# Start a streamed request and wrap it, timing from just before the call.
+# With a scheduler, the request is queued there first and the timing includes the wait.
+def start_stream(send, *args, on_complete=None, scheduler=None, priority=0, metric=None, **kwargs):
+    started_at = time.perf_counter()
+    call = lambda: send(*args, stream=True, **kwargs)
+    try:
+        response = scheduler.run(call, priority) if scheduler else call()
+    except Exception as e:
+        if metric:
+            metrics.observe(metric, time.perf_counter() - started_at, error=type(e).__name__)
+        raise
+    return TimedStream(response, started_at, on_complete, metric)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qa_cache import QACache
+
+ANALYSIS = ("session-a", "report-1")
+
+
+# Pairs that look alike but ask different things; each must miss in both directions
+@pytest.mark.parametrize("cached, asked", [
+    ("Can I take ibuprofen?", "Can I take it with ibuprofen?"),
+    ("Is it safe to exercise?", "Is it not safe to exercise?"),
+    ("Should I take 5 mg?", "Should I take 50 mg?"),
+    ("Can I shower before the follow-up?", "Can I shower after the follow-up?"),
+])
+def test_near_miss_questions_are_not_reused(cached, asked):
+    for first, second in ((cached, asked), (asked, cached)):
+        cache = QACache()
+        cache.put(ANALYSIS, first, "earlier answer")
+        assert cache.get(ANALYSIS, second) is None
+
+
+def test_rewordings_are_reused():
+    cache = QACache()
+    cache.put(ANALYSIS, "What does this finding mean?", "answer")
+    match = cache.get(ANALYSIS, "what does the finding mean")
+    assert match is not None and match.answer == "answer"
+
+
+def test_answers_are_not_shared_between_sessions():
+    cache = QACache()
+    cache.put(("session-a", "report-1"), "Can I take ibuprofen?", "answer for A")
+    assert cache.get(("session-b", "report-1"), "Can I take ibuprofen?") is None
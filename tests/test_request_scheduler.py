@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_models import FakeModelRegistry
+from request_scheduler import BATCH, INTERACTIVE, RequestScheduler
+
+
+def make_scheduler(max_workers=4):
+    return RequestScheduler(requests_per_minute=60000, burst=1000, max_workers=max_workers, max_retries=20, base_delay=0.001, max_delay=0.01)
+
+
+# Occupy the only worker until the returned event is set, so the next submissions queue up behind it
+def hold_worker(scheduler):
+    started, release = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit(blocker, BATCH)
+    assert started.wait(5)
+    return release
+
+
+def test_identical_requests_are_coalesced():
+    models = FakeModelRegistry(latency=0, error_rate=0.3, seed=1)
+    model = models.get("fake-model")
+    scheduler = make_scheduler(max_workers=1)
+    release = hold_worker(scheduler)
+
+    futures = [scheduler.submit(lambda: model.generate_content("same image").text, INTERACTIVE, key="same image") for _ in range(5)]
+    release.set()
+
+    assert all(future is futures[0] for future in futures)
+    assert futures[0].result(5)
+    assert scheduler.stats["coalesced"] == 4
+    # One request reached the model; any extra calls are retries of it
+    assert models.stats["calls"] == 1 + models.stats["errors"]
+
+
+def test_service_unavailable_is_retried():
+    models = FakeModelRegistry(latency=0, error_rate=0.5, seed=2)
+    model = models.get("fake-model")
+    reference = FakeModelRegistry(latency=0, seed=2).get("fake-model")
+    scheduler = make_scheduler()
+
+    prompts = [f"image {index}" for index in range(20)]
+    answers = [scheduler.run(lambda prompt=prompt: model.generate_content(prompt).text) for prompt in prompts]
+
+    assert models.stats["errors"] > 0
+    assert scheduler.stats["retries"] == models.stats["errors"]
+    assert scheduler.stats["failed"] == 0
+    assert answers == [reference.generate_content(prompt).text for prompt in prompts]
+
+
+def test_interactive_work_runs_before_batch():
+    models = FakeModelRegistry(latency=0, error_rate=0.3, seed=3)
+    model = models.get("fake-model")
+    scheduler = make_scheduler(max_workers=1)
+    order = []
+
+    def call(name):
+        model.generate_content(name)
+        order.append(name)
+
+    release = hold_worker(scheduler)
+    futures = [scheduler.submit(lambda name=f"batch {index}": call(name), BATCH) for index in range(3)]
+    futures += [scheduler.submit(lambda name=f"click {index}": call(name), INTERACTIVE) for index in range(2)]
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == ["click 0", "click 1", "batch 0", "batch 1", "batch 2"]
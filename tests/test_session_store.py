@@ -0,0 +1,176 @@
+import itertools
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import session_store
+from session_store import MemorySessionStore, RedisSessionStore, SQLiteSessionStore, new_session_id
+
+
+# Dict-backed stand-in for redis.Redis with the commands RedisSessionStore uses. Values come back as bytes,
+# like redis-py without decode_responses; expiry is recorded but never enforced.
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def set(self, key, value, ex=None):
+        self.data[key] = _encode(value)
+        if ex:
+            self.ttls[key] = ex
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.ttls.pop(key, None)
+
+    def expire(self, key, seconds):
+        if key in self.data:
+            self.ttls[key] = seconds
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = _encode(value)
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        return [self.hget(key, _decode(field)) for field in fields]
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zrevrange(self, key, start, end):
+        scores = self.data.get(key, {})
+        members = sorted(scores, key=lambda member: (scores[member], member), reverse=True)
+        return [_encode(member) for member in _slice(members, start, end)]
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(_encode(value))
+
+    def lrange(self, key, start, end):
+        return _slice(self.data.get(key, []), start, end)
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+
+def _encode(value):
+    return value.encode() if isinstance(value, str) else bytes(value)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# Redis ranges are inclusive, and negative indexes count from the end
+def _slice(items, start, end):
+    start = max(0, start + len(items) if start < 0 else start)
+    end = end + len(items) if end < 0 else end
+    return items[start:end + 1]
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path, monkeypatch):
+    # Distinct, increasing timestamps so "newest first" is well defined on every backend
+    clock = itertools.count(1000)
+    monkeypatch.setattr(session_store, "time", SimpleNamespace(time=lambda: float(next(clock))))
+    if request.param == "memory":
+        return MemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+    return RedisSessionStore(FakeRedis())
+
+
+def test_blobs_round_trip(store):
+    store.put_blob("digest-1", memoryview(b"\x89PNG image bytes"))
+    store.put_blob("digest-1", b"\x89PNG image bytes")
+    assert bytes(store.get_blob("digest-1")) == b"\x89PNG image bytes"
+    assert store.get_blob("missing") is None
+
+
+def test_analyses_round_trip(store):
+    session_id = new_session_id()
+    store.save_analysis(session_id, "digest-1", "chest.png", "first report")
+    store.save_analysis(session_id, "digest-2", "knee.png", "second report")
+    store.save_analysis(session_id, "digest-1", "chest.png", "updated report")
+
+    record = store.get_analysis(session_id, "digest-1")
+    assert (record["digest"], record["image_name"], record["analysis"]) == ("digest-1", "chest.png", "updated report")
+    assert store.get_analysis(session_id, "missing") is None
+    assert store.count_analyses(session_id) == 2
+    assert [record["digest"] for record in store.list_analyses(session_id)] == ["digest-1", "digest-2"]
+    assert [record["digest"] for record in store.list_analyses(session_id, offset=1, limit=1)] == ["digest-2"]
+
+    store.clear_analyses(session_id)
+    assert store.count_analyses(session_id) == 0
+    assert store.list_analyses(session_id) == []
+
+
+def test_chat_turns_round_trip(store):
+    session_id = new_session_id()
+    store.add_chat_turn(session_id, "digest-1", "What is this?", "A chest X-ray.")
+    store.add_chat_turn(session_id, "digest-2", "Is the knee swollen?", "Mildly.")
+    store.add_chat_turn(session_id, "digest-1", "Anything urgent?", "No.")
+    store.add_chat_turn(session_id, None, "General question", "General answer")
+
+    assert [turn["question"] for turn in store.list_chat_turns(session_id)] == [
+        "General question", "Anything urgent?", "Is the knee swollen?", "What is this?",
+    ]
+    turns = store.list_chat_turns(session_id, digest="digest-1")
+    assert [(turn["question"], turn["answer"]) for turn in turns] == [("Anything urgent?", "No."), ("What is this?", "A chest X-ray.")]
+    assert [turn["question"] for turn in store.list_chat_turns(session_id, offset=1, limit=2)] == ["Anything urgent?", "Is the knee swollen?"]
+    assert [turn["question"] for turn in store.list_chat_turns(session_id, 0, 1, digest="digest-1")] == ["Anything urgent?"]
+    assert store.count_chat_turns(session_id) == 4
+    assert store.count_chat_turns(session_id, digest="digest-2") == 1
+
+    store.clear_chat(session_id)
+    assert store.count_chat_turns(session_id) == 0
+    assert store.list_chat_turns(session_id, digest="digest-1") == []
+
+
+def test_selected_image_round_trip(store):
+    session_id = new_session_id()
+    assert store.get_selected(session_id) is None
+    store.set_selected(session_id, "digest-1", "chest.png")
+    assert store.get_selected(session_id) == {"digest": "digest-1", "image_name": "chest.png"}
+
+
+def test_history_is_scoped_to_the_session(store):
+    first, second = new_session_id(), new_session_id()
+    store.save_analysis(first, "digest-1", "chest.png", "report for the first session")
+    store.add_chat_turn(first, "digest-1", "What is this?", "A chest X-ray.")
+    store.set_selected(first, "digest-1", "chest.png")
+
+    assert store.get_analysis(second, "digest-1") is None
+    assert store.list_analyses(second) == [] and store.count_analyses(second) == 0
+    assert store.list_chat_turns(second, digest="digest-1") == [] and store.count_chat_turns(second) == 0
+    assert store.get_selected(second) is None
+
+    store.clear_analyses(second)
+    store.clear_chat(second)
+    assert store.count_analyses(first) == 1
+    assert store.count_chat_turns(first, digest="digest-1") == 1
+
+
+def test_redis_keys_expire():
+    client = FakeRedis()
+    store = RedisSessionStore(client, prefix="test", ttl_seconds=60, blob_ttl_seconds=30)
+    session_id = new_session_id()
+    store.put_blob("digest-1", b"bytes")
+    store.save_analysis(session_id, "digest-1", "chest.png", "report")
+    store.add_chat_turn(session_id, "digest-1", "What is this?", "A chest X-ray.")
+
+    assert client.ttls["test:blob:digest-1"] == 30
+    assert client.ttls[f"test:session:{session_id}:analyses"] == 60
+    assert client.ttls[f"test:session:{session_id}:chat:digest-1"] == 60
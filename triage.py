@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from image_preprocess import open_image, preprocess_image, stretch_to_8bit
+from instrumentation import metrics
+
+# "model" runs the local checks and then the flash-model triage, "local" only the checks, "off" neither
+TRIAGE_MODE = os.getenv("MEDIGEN_TRIAGE", "model").lower()
+# Shorter edges than this carry too little detail for a diagnostic read
+MIN_EDGE = int(os.getenv("MEDIGEN_TRIAGE_MIN_EDGE", "128"))
+# Variance of the Laplacian (on a 512px grayscale copy) below which an image counts as too blurry
+BLUR_THRESHOLD = float(os.getenv("MEDIGEN_TRIAGE_BLUR_THRESHOLD", "12"))
+# Pixel standard deviation below which an image is blank (all black, white or one flat colour)
+BLANK_THRESHOLD = 4.0
+# Colourfulness (Hasler & Süsstrunk) below which an image is treated as a grayscale scan. X-ray, CT, MRI and
+# ultrasound images are grayscale and are passed without the model check; colour images (skin photos, but
+# also screenshots and holiday snaps) go to the flash model.
+GRAYSCALE_COLORFULNESS = 6.0
+# Edge of the copy the flash model sees; enough to tell what the image is, at a fraction of the tokens
+TRIAGE_IMAGE_EDGE = 512
+
+triage_generation_config = {
+    "temperature": 0,
+    "max_output_tokens": 256,
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "medical": {"type": "boolean", "description": "Is this a medical image (scan, radiograph, clinical photo)?"},
+            "quality": {"type": "string", "enum": ["good", "poor", "unusable"]},
+            "modality": {"type": "string"},
+            "reason": {"type": "string", "description": "One short sentence"},
+        },
+        "required": ["medical", "quality", "reason"],
+    },
+}
+
+triage_prompt = """
+You screen uploads before a detailed medical image analysis. Decide whether this image is a medical image
+(radiograph, CT, MRI, ultrasound, endoscopy, histology, or a clinical photo of skin, eyes, mouth or wounds)
+and whether its quality allows an analysis. Answer "unusable" only when no finding could be read from it.
+"""
+
+TriageVerdict = namedtuple("TriageVerdict", ["passed", "tier", "reason", "checks"])
+
+
+# Raised instead of analyzing an image that failed triage; the message is shown to the user
+class ImageRejected(Exception):
+    def __init__(self, verdict):
+        super().__init__(f"Image not analyzed: {verdict.reason}")
+        self.verdict = verdict
+
+
+# Cheap signals from a small grayscale/RGB copy of the image: size, blankness, sharpness and colourfulness
+def image_checks(data):
+    from PIL import ImageFilter, ImageOps, ImageStat
+
+    image = open_image(data)
+    width, height = image.size
+    image.draft("RGB", (TRIAGE_IMAGE_EDGE, TRIAGE_IMAGE_EDGE))
+    # 16-bit scans are stretched first; converting them straight to RGB clips them to a blank white image
+    image = stretch_to_8bit(ImageOps.exif_transpose(image))
+    image.thumbnail((TRIAGE_IMAGE_EDGE, TRIAGE_IMAGE_EDGE))
+    rgb = image.convert("RGB")
+    gray = rgb.convert("L")
+
+    # Laplacian response offset by 128 so negative values survive the 8-bit result
+    laplacian = gray.filter(ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128))
+
+    # Hasler & Süsstrunk colourfulness from the rg and yb opponent channels of a 64px copy
+    small = rgb.resize((64, 64))
+    rg, yb = [], []
+    for red, green, blue in small.getdata():
+        rg.append(red - green)
+        yb.append((red + green) / 2 - blue)
+    mean_rg, mean_yb = sum(rg) / len(rg), sum(yb) / len(yb)
+    std_rg = math.sqrt(sum((value - mean_rg) ** 2 for value in rg) / len(rg))
+    std_yb = math.sqrt(sum((value - mean_yb) ** 2 for value in yb) / len(yb))
+
+    return {
+        "width": width,
+        "height": height,
+        "stddev": round(ImageStat.Stat(gray).stddev[0], 2),
+        "sharpness": round(ImageStat.Stat(laplacian).var[0], 2),
+        "colorfulness": round(math.hypot(std_rg, std_yb) + 0.3 * math.hypot(mean_rg, mean_yb), 2),
+    }
+
+
+# Verdict from the local checks alone: (passed, reason), or None when the model should decide
+def local_verdict(checks):
+    if min(checks["width"], checks["height"]) < MIN_EDGE:
+        return False, f"the image is too small ({checks['width']}×{checks['height']} px, minimum {MIN_EDGE} px)"
+    if checks["stddev"] < BLANK_THRESHOLD:
+        return False, "the image is blank"
+    if checks["sharpness"] < BLUR_THRESHOLD:
+        return False, "the image is too blurry to read"
+    if checks["colorfulness"] < GRAYSCALE_COLORFULNESS:
+        return True, "grayscale scan"
+    return None
+
+
+# Two-tier screening in front of the pro-model analysis. Tier 1 runs local heuristics in a few milliseconds
+# and rejects tiny, blank and blurry images outright; tier 2 asks the flash model whether a colour image
+# is medical at all and usable. Verdicts are remembered per image digest. A failing flash call lets the
+# image through rather than blocking the analysis.
+class Triage:
+    def __init__(self, models, model_name, scheduler=None, mode=TRIAGE_MODE, safety_settings=None, max_entries=2048):
+        self.models = models
+        self.model_name = model_name
+        self.scheduler = scheduler
+        self.mode = mode
+        self.safety_settings = safety_settings
+        self.max_entries = max_entries
+        self._verdicts = OrderedDict()
+        self._stats = {"checked": 0, "passed": 0, "rejected_local": 0, "rejected_model": 0, "model_checks": 0, "model_errors": 0}
+        self._lock = threading.Lock()
+
+    # Screen one image. `use_model=False` limits this call to the local checks.
+    def check(self, image_digest, data, priority=0, use_model=True):
+        if self.mode == "off":
+            return TriageVerdict(True, "off", "triage disabled", {})
+        use_model = use_model and self.mode == "model"
+        with self._lock:
+            verdict = self._verdicts.get((image_digest, use_model))
+            if verdict is not None:
+                self._verdicts.move_to_end((image_digest, use_model))
+                return verdict
+
+        with metrics.timer("triage.local"):
+            checks = image_checks(data)
+            local = local_verdict(checks)
+        if local is not None:
+            verdict = TriageVerdict(local[0], "local", local[1], checks)
+        elif not use_model:
+            verdict = TriageVerdict(True, "local", "passed local checks", checks)
+        else:
+            verdict = self._model_verdict(image_digest, data, checks, priority)
+
+        with self._lock:
+            self._stats["checked"] += 1
+            if verdict.passed:
+                self._stats["passed"] += 1
+            else:
+                self._stats["rejected_model" if verdict.tier == "model" else "rejected_local"] += 1
+            self._verdicts[(image_digest, use_model)] = verdict
+            while len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def _model_verdict(self, image_digest, data, checks, priority):
+        model = self.models.get(self.model_name, triage_generation_config, self.safety_settings)
+        payload, mime_type, _ = preprocess_image(data, TRIAGE_IMAGE_EDGE, 80)
+
+        def call():
+            started = time.perf_counter()
+            try:
+                response = model.generate_content([{"mime_type": mime_type, "data": payload}, triage_prompt])
+            except Exception as e:
+                metrics.observe("model.triage", time.perf_counter() - started, error=type(e).__name__)
+                raise
+            metrics.observe_model_call("model.triage", time.perf_counter() - started, getattr(response, "usage_metadata", None))
+            return response.text
+
+        with self._lock:
+            self._stats["model_checks"] += 1
+        try:
+            text = self.scheduler.run(call, priority, key=("triage", image_digest)) if self.scheduler else call()
+            answer = json.loads(text)
+        except Exception as e:
+            with self._lock:
+                self._stats["model_errors"] += 1
+            return TriageVerdict(True, "model", f"triage unavailable ({type(e).__name__}), analyzed anyway", checks)
+
+        checks = dict(checks, modality=answer.get("modality"), quality=answer.get("quality"))
+        if not answer.get("medical"):
+            return TriageVerdict(False, "model", f"this does not look like a medical image ({answer.get('reason', '')})", checks)
+        if answer.get("quality") == "unusable":
+            return TriageVerdict(False, "model", f"the image quality is too low ({answer.get('reason', '')})", checks)
+        return TriageVerdict(True, "model", answer.get("reason", "passed triage"), checks)
+
+    # Counters plus the share of screened images that never reached the pro model
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        rejected = stats["rejected_local"] + stats["rejected_model"]
+        stats["pro_calls_avoided"] = rejected / stats["checked"] if stats["checked"] else 0.0
+        return stats